@@ -0,0 +1,107 @@
+"""
+Benchmark: ASGI (uvicorn) vs WSGI (gunicorn sync workers)
+
+Measures how throughput and latency scale with concurrency for the same
+/api/customers contract served by both entry points. Start both services
+against the same database first, for example:
+
+    gunicorn --bind 0.0.0.0:8080 --workers 4 service:app
+    uvicorn service.asgi:app --port 8081 --workers 4
+
+and then run:
+
+    python benchmarks/asgi_vs_wsgi.py --wsgi http://localhost:8080 \\
+        --asgi http://localhost:8081 --concurrency 1 8 32 128 --duration 10
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+CUSTOMER = {
+    "first_name": "Bench",
+    "last_name": "Mark",
+    "active": True,
+    "addresses": [
+        {
+            "name": "home",
+            "street": "4th St",
+            "city": "New York",
+            "state": "NY",
+            "postalcode": "10003",
+        }
+    ],
+}
+
+
+async def seed(client, base_url, count):
+    """Creates the customers that the readers will fetch"""
+    ids = []
+    for _ in range(count):
+        response = await client.post(f"{base_url}/api/customers", json=CUSTOMER)
+        response.raise_for_status()
+        ids.append(response.json()["id"])
+    return ids
+
+
+async def worker(client, base_url, ids, deadline, latencies, errors):
+    """Issues GET requests one after another until the deadline"""
+    index = 0
+    while time.perf_counter() < deadline:
+        customer_id = ids[index % len(ids)]
+        index += 1
+        start = time.perf_counter()
+        try:
+            response = await client.get(f"{base_url}/api/customers/{customer_id}")
+            if response.status_code != 200:
+                errors.append(response.status_code)
+        except httpx.HTTPError as error:
+            errors.append(type(error).__name__)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_level(base_url, ids, concurrency, duration):
+    """Runs one concurrency level and returns its statistics"""
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(
+            *(worker(client, base_url, ids, deadline, latencies, errors) for _ in range(concurrency))
+        )
+    latencies.sort()
+    return {
+        "rps": len(latencies) / duration,
+        "p50": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0.0,
+        "errors": len(errors),
+    }
+
+
+async def main(args):
+    """Runs every concurrency level against every target"""
+    targets = [("wsgi", args.wsgi), ("asgi", args.asgi)]
+    print(f"{'server':8}{'concurrency':>12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, base_url in targets:
+        if not base_url:
+            continue
+        async with httpx.AsyncClient(timeout=60) as client:
+            ids = await seed(client, base_url, args.customers)
+        for concurrency in args.concurrency:
+            stats = await run_level(base_url, ids, concurrency, args.duration)
+            print(
+                f"{name:8}{concurrency:>12}{stats['rps']:>10.1f}"
+                f"{stats['p50']:>10.2f}{stats['p99']:>10.2f}{stats['errors']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--wsgi", default="http://localhost:8080", help="gunicorn base URL")
+    parser.add_argument("--asgi", default="http://localhost:8081", help="uvicorn base URL")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--customers", type=int, default=100, help="customers to seed")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,93 @@
+"""
+Benchmark: ORM instances vs Core rows for the customer list
+
+Measures the time and the peak memory of reading and serializing the
+customers as Customer instances (Customer.all()) and as read-only rows
+(Customer.rows()), the way GET /api/customers does, for example:
+
+    python benchmarks/list_rows.py --customers 10000 100000
+
+It runs in process against a throwaway SQLite database unless DATABASE_URI
+is set, no server needs to be started.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DATABASE_URI", f"sqlite:///{tempfile.mkdtemp()}/list_rows.db")
+
+# pylint: disable=wrong-import-position
+from service import app  # noqa: E402
+from service.models import Customer, CustomerChange, db  # noqa: E402
+
+SEED_BATCH = 5000
+
+
+def seed(count):
+    """Replaces the customers with count new ones"""
+    Customer.query.delete()
+    CustomerChange.query.delete()
+    for start in range(0, count, SEED_BATCH):
+        customers = []
+        for index in range(start, min(start + SEED_BATCH, count)):
+            customer = Customer()
+            customer.f_name, customer.l_name = f"First{index}", f"Last{index}"
+            customer.active = index % 2 == 0
+            customer.name, customer.street = "home", f"{index} 4th St"
+            customer.city, customer.state, customer.postalcode = "New York", "NY", "10003"
+            customers.append(customer)
+        Customer.create_many(customers)
+    db.session.commit()
+
+
+def list_instances():
+    """Serializes the customers read as ORM instances"""
+    return [customer.serialize() for customer in Customer.all()]
+
+
+def list_rows():
+    """Serializes the customers read as Core rows"""
+    return [customer.serialize() for customer in Customer.rows()]
+
+
+def measure(func, repeat):
+    """Returns the best milliseconds and the peak MiB of a fresh session"""
+
+    def run():
+        func()
+        db.session.remove()
+
+    milliseconds = min(timeit.repeat(run, number=1, repeat=repeat)) * 1000
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    tracemalloc.stop()
+    return milliseconds, peak
+
+
+def main():
+    """Runs the benchmark and prints one row per list size and read path"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--customers", type=int, nargs="+", default=[10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'customers':>9} {'read path':<10} {'ms':>10} {'peak MiB':>10} {'ms/10k':>10} {'MiB/10k':>10}")
+    with app.app_context():
+        for count in args.customers:
+            seed(count)
+            for name, func in (("instances", list_instances), ("rows", list_rows)):
+                milliseconds, peak = measure(func, args.repeat)
+                scale = 10000 / count
+                print(
+                    f"{count:>9} {name:<10} {milliseconds:>10.1f} {peak:>10.1f}"
+                    f" {milliseconds * scale:>10.1f} {peak * scale:>10.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark: JSON vs MessagePack vs CBOR
+
+Measures the encode and decode cost and the payload size of a customer list
+in every media type the API supports, with and without gzip, for example:
+
+    python benchmarks/serialization.py --customers 100 1000 10000
+
+It runs in process, no server needs to be started.
+"""
+import argparse
+import gzip
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# pylint: disable=wrong-import-position
+from service.common.media_types import decode, encode, supported  # noqa: E402
+
+
+def customers(count):
+    """Builds a list like the one GET /api/customers returns"""
+    return [
+        {
+            "id": str(index),
+            "first_name": f"First{index}",
+            "last_name": f"Last{index}",
+            "active": index % 2 == 0,
+            "addresses": [
+                {
+                    "name": "home",
+                    "street": f"{index} 4th St",
+                    "city": "New York",
+                    "state": "NY",
+                    "postalcode": "10003",
+                }
+            ],
+        }
+        for index in range(count)
+    ]
+
+
+def measure(document, media_type, repeat):
+    """Returns the encode and decode milliseconds and the plain and gzip sizes"""
+    body = encode(document, media_type)
+    encode_ms = min(timeit.repeat(lambda: encode(document, media_type), number=1, repeat=repeat)) * 1000
+    decode_ms = min(timeit.repeat(lambda: decode(body, media_type), number=1, repeat=repeat)) * 1000
+    return encode_ms, decode_ms, len(body), len(gzip.compress(body, compresslevel=6))
+
+
+def main():
+    """Runs the benchmark and prints one row per list size and media type"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--customers", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'customers':>9} {'media type':<20} {'encode ms':>10} {'decode ms':>10} {'bytes':>10} {'gzip bytes':>10}")
+    for count in args.customers:
+        document = customers(count)
+        for media_type in supported():
+            encode_ms, decode_ms, size, gzip_size = measure(document, media_type, args.repeat)
+            print(
+                f"{count:>9} {media_type:<20} {encode_ms:>10.2f} {decode_ms:>10.2f} {size:>10} {gzip_size:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
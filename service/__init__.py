@@ -4,15 +4,18 @@ Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
 """
-import sys
 from flask import Flask
 from flask_restx import Api
+from werkzeug.middleware.proxy_fix import ProxyFix
 from service import config
 from .common import log_handlers
 
 # Create Flask application
 app = Flask(__name__)
 app.config.from_object(config)
+# Only the proxies in front of the service may say who the client is
+if app.config.get("TRUSTED_PROXY_COUNT", 0):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXY_COUNT"])
 
 ######################################################################
 # Configure Swagger before initializing it
@@ -29,22 +32,33 @@ api = Api(app,
 
 # Dependencies require we import the routes AFTER the Flask app is created
 # pylint: disable=wrong-import-position, wrong-import-order
-from service import models, routes        # noqa: E402, E261
+from service import models, routes, change_routes, health_routes, admin_routes        # noqa: E402, E261
 # pylint: disable=wrong-import-position
-from .common import error_handlers, cli_commands  # noqa: F401 E402
+from .common import error_handlers, cli_commands, admission, compression, deadlines  # noqa: F401 E402
+from .common import profiling, replicas, static_assets, warmup  # noqa: F401 E402
+
+app.register_blueprint(health_routes.blueprint)
+app.register_blueprint(admin_routes.blueprint)
 
 # Set up logging for production
 log_handlers.init_logging(app, "gunicorn.error")
+log_handlers.init_access_log(app)
+replicas.init_last_write(app)
+admission.init_admission(app, routes.admission_class, admission.client_address, routes.pool_wait)
+deadlines.init_deadlines(app, routes.long_lived_request)
+static_assets.init_static_assets(app, api)
+compression.init_compression(app)
+profiling.init_profiling(app, api, routes.long_lived_request)
 
 app.logger.info(70 * "*")
 app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
 app.logger.info(70 * "*")
 
-try:
-    models.init_db(app)  # make our SQLAlchemy tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+# the service starts degraded, serving what it can, when the database is down
+if models.init_db(app):  # make our SQLAlchemy tables
+    app.logger.info("Service initialized!")
+else:
+    app.logger.critical("Service initialized in degraded mode")
 
-app.logger.info("Service initialized!")
+# the worker reports not ready until its connections, statements and caches are warm
+warmup.init_warmup(app, routes.warmup_steps())
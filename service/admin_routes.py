@@ -0,0 +1,112 @@
+# pylint: disable=cyclic-import
+"""
+Admin Routes
+
+The statistics and maintenance endpoints of a worker
+"""
+import hmac
+import os
+import subprocess
+import sys
+import threading
+
+from flask import Blueprint, jsonify, request, send_from_directory
+
+from service.models import DuplicateRun, db
+from .common import status
+from .common.db_pool import pool_status
+from .common.profiling import EXTENSIONS, PROFILE_HEADER, has_profile_token, list_profiles
+from .routes import GROUP_WRITER, abort, result_cache, stale_cache
+
+# Import Flask application
+from . import app
+
+blueprint = Blueprint("admin", __name__)
+
+
+def require_admin_token():
+    """Aborts unless the request is sent with Authorization: Bearer <ADMIN_TOKEN>"""
+    token = app.config.get("ADMIN_TOKEN", "")
+    if not token:
+        abort(status.HTTP_403_FORBIDDEN, "This endpoint is disabled until ADMIN_TOKEN is set")
+    sent = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(sent.encode("utf8"), f"Bearer {token}".encode("utf8")):
+        abort(status.HTTP_401_UNAUTHORIZED, "This endpoint needs the admin token")
+
+
+def require_profile_token():
+    """Aborts unless the request is sent with the profiling header and PROFILE_TOKEN"""
+    token = app.config.get("PROFILE_TOKEN", "")
+    if not token:
+        abort(status.HTTP_403_FORBIDDEN, "The profiles are not served until PROFILE_TOKEN is set")
+    if not has_profile_token(token):
+        abort(status.HTTP_401_UNAUTHORIZED, f"The profiles need the {PROFILE_HEADER} header with the profiling token")
+
+
+@blueprint.route("/admin/pool")
+def admin_pool():
+    """Live statistics of the database connection pool"""
+    require_admin_token()
+    stats = pool_status(db.engine)
+    if "admission" in app.extensions:
+        stats["admission"] = app.extensions["admission"].stats()
+    stats["circuit_breaker"] = app.extensions["circuit_breaker"].stats()
+    stats["stale_cache"] = stale_cache.stats()
+    stats["result_cache"] = result_cache.stats()
+    if "warmup" in app.extensions:
+        stats["warmup"] = app.extensions["warmup"].status()
+    if GROUP_WRITER is not None:
+        stats["group_commit"] = GROUP_WRITER.stats()
+    router = app.extensions.get("replica_router")
+    if router:
+        stats["replicas"] = [
+            dict(replica, **pool_status(engine))
+            for replica, engine in zip(router.status(), router.engines)
+        ]
+    return jsonify(stats), status.HTTP_200_OK
+
+
+@blueprint.route("/admin/duplicates", methods=["GET"])
+def admin_duplicates():
+    """State of the last duplicate detection and its merge report"""
+    require_admin_token()
+    run = DuplicateRun.latest()
+    return jsonify(run.serialize() if run else {"state": "idle"}), status.HTTP_200_OK
+
+
+@blueprint.route("/admin/duplicates", methods=["POST"])
+def admin_find_duplicates():
+    """Starts the duplicate detection in its own process, one run at a time"""
+    require_admin_token()
+    run = DuplicateRun.begin(app.config.get("DUPLICATE_TIMEOUT_SECONDS", 3600))
+    if run is None:
+        return jsonify(DuplicateRun.latest().serialize()), status.HTTP_409_CONFLICT
+    # the flask find-duplicates command runs it so it takes neither this worker nor its memory
+    command = [sys.executable, "-m", "flask", "find-duplicates", "--run", str(run.id), "--output", os.devnull]
+    try:
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            command, env=dict(os.environ, FLASK_APP="service:app"), stdout=subprocess.DEVNULL, start_new_session=True
+        )
+    except OSError as error:
+        run.finish(error=str(error))
+        abort(status.HTTP_500_INTERNAL_SERVER_ERROR, f"Could not start the duplicate detection: {error}")
+    # reaps the process when it exits
+    threading.Thread(target=process.wait, name="find-duplicates", daemon=True).start()
+    app.logger.info("Started the duplicate detection run %s", run.id)
+    return jsonify(run.serialize()), status.HTTP_202_ACCEPTED
+
+
+@blueprint.route("/admin/profiles")
+def admin_profiles():
+    """The request profiles of this worker, the most recent first"""
+    require_profile_token()
+    return jsonify(list_profiles(app.config.get("PROFILE_DIR", "/tmp/profiles"))), status.HTTP_200_OK
+
+
+@blueprint.route("/admin/profiles/<file_name>")
+def admin_profile(file_name):
+    """One file of a request profile, its collapsed stacks, summary or cProfile stats"""
+    require_profile_token()
+    if not file_name.endswith(EXTENSIONS):
+        abort(status.HTTP_404_NOT_FOUND, f"Profile file '{file_name}' was not found.")
+    return send_from_directory(app.config.get("PROFILE_DIR", "/tmp/profiles"), file_name, mimetype="text/plain")
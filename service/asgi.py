@@ -0,0 +1,321 @@
+# pylint: disable=cyclic-import
+"""
+ASGI Service
+
+Serves the core /api/customers calls of service.routes (list, create, read,
+update, delete, activate and deactivate) with asyncio and an async database
+driver (asyncpg for Postgres, aiosqlite for SQLite). It shares the Customer
+model for validation and serialization and the flask-restx model for
+marshalling so those calls answer the same on both entry points.
+
+It only speaks JSON and has no search, changes feed or batch. It does not
+support Idempotency-Key, so it refuses a create sent with one rather than
+silently letting its retries create duplicates.
+
+Run it with:
+    uvicorn service.asgi:app --host 0.0.0.0 --port 8080
+"""
+import logging
+from datetime import datetime
+
+from flask_restx import marshal
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.http import parse_options_header
+
+from service import app as flask_app
+from service.common.idempotency import IDEMPOTENCY_HEADER
+from service.models import Customer, CustomerChange, DataValidationError, sequence_changes
+from service.routes import customer_model
+from .common import status
+
+logger = logging.getLogger("flask.app")
+
+# Async drivers used in place of the sync DBAPI drivers
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+TRUE_VALUES = ["yes", "y", "true", "t", "1"]
+
+customers = Customer.__table__
+changes = CustomerChange.__table__
+
+
+def async_database_uri(config) -> str:
+    """Returns the async driver version of the configured database URI"""
+    if config.get("ASYNC_DATABASE_URI"):
+        return config["ASYNC_DATABASE_URI"]
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver for {url.get_backend_name()}")
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def create_engine_from_config(config):
+    """Creates the async engine with the same pool settings as the sync one"""
+    uri = async_database_uri(config)
+    options = {
+        "pool_pre_ping": config.get("DB_POOL_PRE_PING", True),
+        "pool_recycle": config.get("DB_POOL_RECYCLE", -1),
+    }
+    if make_url(uri).get_backend_name() != "sqlite":
+        options.update(
+            {
+                "pool_size": config.get("DB_POOL_SIZE", 5),
+                "max_overflow": config.get("DB_MAX_OVERFLOW", 10),
+                "pool_timeout": config.get("DB_POOL_TIMEOUT", 30),
+            }
+        )
+    return create_async_engine(uri, **options)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+
+
+def serialize(row) -> dict:
+    """Serializes a row the same way the Flask routes marshal a Customer"""
+    return marshal(Customer(**row._asdict()).serialize(), customer_model)
+
+
+def abort(error_code: int, message: str):
+    """Logs errors before aborting"""
+    logger.error(message)
+    raise HTTPException(error_code, message)
+
+
+def check_content_type(request, content_type):
+    """Checks that the media type is correct, whatever its parameters, as Flask does"""
+    if parse_options_header(request.headers.get("Content-Type", ""))[0].lower() != content_type:
+        abort(
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            f"Content-Type must be {content_type}",
+        )
+
+
+async def read_customer(request) -> dict:
+    """Validates the posted body with Customer.deserialize"""
+    check_content_type(request, "application/json")
+    try:
+        data = await request.json()
+    except ValueError as error:
+        raise DataValidationError(f"Invalid Customer: {error}") from error
+    customer = Customer().deserialize(data)
+    return {
+        column.name: getattr(customer, column.name)
+        for column in customers.columns
+        if column.name != "id"
+    }
+
+
+async def find(conn, customer_id):
+    """Finds a customer row by it's ID or aborts with a 404"""
+    result = await conn.execute(select(customers).where(customers.c.id == customer_id))
+    row = result.first()
+    if row is None:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Customer with id '{customer_id}' was not found.",
+        )
+    return row
+
+
+async def record_change(conn, row, operation: str):
+    """Appends the change to the change log in the same transaction and gives it its seq"""
+    await conn.execute(
+        insert(changes).values(
+            customer_id=row.id,
+            operation=operation,
+            data=Customer(**row._asdict()).serialize(),
+            created_at=datetime.utcnow(),
+        )
+    )
+    await conn.run_sync(sequence_changes)
+
+
+def location(request, customer_id) -> str:
+    """Returns the URL of a single customer"""
+    return str(request.url_for("customer", customer_id=customer_id))
+
+
+######################################################################
+#  R O U T E S
+######################################################################
+
+
+async def health(request):  # pylint: disable=unused-argument
+    """Health Status"""
+    return JSONResponse({"status": "OK"}, status.HTTP_200_OK)
+
+
+async def list_customers(request):
+    """Returns all of the Customers"""
+    query = select(customers)
+    active = request.query_params.get("active")
+    if active:
+        query = query.where(customers.c.active == (active.lower() in TRUE_VALUES))
+    async with request.app.state.engine.connect() as conn:
+        result = await conn.execute(query)
+        results = [serialize(row) for row in result]
+    logger.info("Returning %d customers", len(results))
+    return JSONResponse(results, status.HTTP_200_OK)
+
+
+async def create_customer(request):
+    """Creates a Customer"""
+    if IDEMPOTENCY_HEADER in request.headers:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"{IDEMPOTENCY_HEADER} is not supported by the ASGI service",
+        )
+    values = await read_customer(request)
+    async with request.app.state.engine.begin() as conn:
+        result = await conn.execute(insert(customers).values(**values))
+        customer_id = result.inserted_primary_key[0]
+        row = await find(conn, customer_id)
+        await record_change(conn, row, "create")
+    logger.info("Customer with ID [%s] created.", customer_id)
+    return JSONResponse(
+        serialize(row),
+        status.HTTP_201_CREATED,
+        headers={"Location": location(request, customer_id)},
+    )
+
+
+async def get_customer(request):
+    """Retrieves a single Customer"""
+    customer_id = request.path_params["customer_id"]
+    async with request.app.state.engine.connect() as conn:
+        row = await find(conn, customer_id)
+    return JSONResponse(serialize(row), status.HTTP_200_OK)
+
+
+async def update_customer(request):
+    """Updates a Customer"""
+    customer_id = request.path_params["customer_id"]
+    check_content_type(request, "application/json")
+    async with request.app.state.engine.begin() as conn:
+        await find(conn, customer_id)
+        values = await read_customer(request)
+        await conn.execute(update(customers).where(customers.c.id == customer_id).values(**values))
+        row = await find(conn, customer_id)
+        await record_change(conn, row, "update")
+    logger.info("Customer with ID [%s] updated.", customer_id)
+    return JSONResponse(
+        serialize(row),
+        status.HTTP_200_OK,
+        headers={"Location": location(request, customer_id)},
+    )
+
+
+async def delete_customer(request):
+    """Deletes a Customer"""
+    customer_id = request.path_params["customer_id"]
+    async with request.app.state.engine.begin() as conn:
+        row = await find(conn, customer_id)
+        await record_change(conn, row, "delete")
+        await conn.execute(delete(customers).where(customers.c.id == customer_id))
+    logger.info("customer with ID [%s] delete complete.", customer_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def set_activity(request, active: bool):
+    """Sets the active flag of a Customer"""
+    customer_id = request.path_params["customer_id"]
+    async with request.app.state.engine.begin() as conn:
+        await find(conn, customer_id)
+        await conn.execute(update(customers).where(customers.c.id == customer_id).values(active=active))
+        row = await find(conn, customer_id)
+        await record_change(conn, row, "activate" if active else "deactivate")
+    logger.info("Customer with ID [%s]'s active status is set to [%s].", customer_id, active)
+    return JSONResponse(
+        serialize(row),
+        status.HTTP_200_OK,
+        headers={"Location": location(request, customer_id)},
+    )
+
+
+async def activate_customer(request):
+    """Activates a Customer"""
+    return await set_activity(request, True)
+
+
+async def deactivate_customer(request):
+    """Deactivates a Customer"""
+    return await set_activity(request, False)
+
+
+######################################################################
+#  E R R O R   H A N D L E R S
+######################################################################
+
+
+async def request_validation_error(request, error):  # pylint: disable=unused-argument
+    """Handles Value Errors from bad data"""
+    message = str(error)
+    logger.error(message)
+    return JSONResponse(
+        {
+            "status_code": status.HTTP_400_BAD_REQUEST,
+            "error": "Bad Request",
+            "message": message,
+        },
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+async def http_error(request, error):  # pylint: disable=unused-argument
+    """Returns errors in the same shape as flask-restx"""
+    return JSONResponse({"message": error.detail}, error.status_code)
+
+
+######################################################################
+#  A P P L I C A T I O N
+######################################################################
+
+
+async def startup():
+    """Creates the async engine"""
+    app.state.engine = create_engine_from_config(flask_app.config)
+    logger.info("ASGI service running on %s", app.state.engine.url.get_backend_name())
+
+
+async def shutdown():
+    """Closes all of the database connections"""
+    await app.state.engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/health", health, methods=["GET"]),
+        Route("/api/customers", list_customers, methods=["GET"]),
+        Route("/api/customers", create_customer, methods=["POST"]),
+        Route("/api/customers/{customer_id:int}", get_customer, methods=["GET"], name="customer"),
+        Route("/api/customers/{customer_id:int}", update_customer, methods=["PUT"]),
+        Route("/api/customers/{customer_id:int}", delete_customer, methods=["DELETE"]),
+        Route("/api/customers/{customer_id:int}/activate", activate_customer, methods=["PUT"]),
+        Route("/api/customers/{customer_id:int}/deactivate", deactivate_customer, methods=["PUT"]),
+    ],
+    exception_handlers={
+        DataValidationError: request_validation_error,
+        HTTPException: http_error,
+    },
+    middleware=[
+        Middleware(GZipMiddleware, minimum_size=flask_app.config.get("COMPRESSION_MIN_SIZE", 1024))
+    ]
+    if flask_app.config.get("COMPRESSION_ENABLED", True)
+    else [],
+    on_startup=[startup],
+    on_shutdown=[shutdown],
+)
@@ -0,0 +1,204 @@
+# pylint: disable=cyclic-import
+"""
+Change Routes
+
+The incremental feed and the stream of the changes to the customers
+"""
+import json
+import threading
+
+from flask import Response, request, stream_with_context
+from flask_restx import Resource, fields, reqparse, inputs
+from sqlalchemy import event
+from service.models import CustomerChange, db
+from .common import status
+from .common.change_dispatcher import ChangeDispatcher
+
+# Import Flask application
+from . import app, api
+
+
+def read_changes(since: int, limit: int) -> list:
+    """Returns the serialized changes after since from the change log"""
+    return [change.serialize() for change in CustomerChange.since(since, limit)]
+
+
+# One dispatcher per worker fans the change log out to every subscriber
+dispatcher = ChangeDispatcher(
+    app,
+    fetch=read_changes,
+    last_seq=CustomerChange.last_seq,
+    poll_interval=app.config.get("CHANGE_STREAM_POLL_SECONDS", 1.0),
+    buffer_size=app.config.get("CHANGE_STREAM_BUFFER_SIZE", 1000),
+)
+
+
+# Streams and long-polls hold a worker thread for as long as they wait, so only
+# some of the threads of a worker may wait at once and the rest serve the API
+stream_slots = threading.BoundedSemaphore(app.config.get("CHANGE_STREAM_MAX_PER_WORKER", 16))
+
+
+def take_stream_slot():
+    """Takes one of the threads kept for streams, aborts with 503 if there are none left"""
+    if not stream_slots.acquire(blocking=False):  # pylint: disable=consider-using-with
+        app.logger.warning("Refusing a stream, this worker is waiting on as many as it can")
+        api.abort(status.HTTP_503_SERVICE_UNAVAILABLE, "Too many open streams, try again later")
+
+
+@event.listens_for(db.session, "after_commit")
+def notify_dispatcher(session):  # pylint: disable=unused-argument
+    """Lets the subscribers see a local write without waiting for the next poll"""
+    dispatcher.notify()
+
+
+change_model = api.model(
+    "CustomerChange",
+    {
+        "seq": fields.Integer(readOnly=True, description="The position of the change in the log"),
+        "customer_id": fields.Integer(readOnly=True, description="The Customer that changed"),
+        "operation": fields.String(
+            readOnly=True, description="create, update, delete, activate or deactivate"
+        ),
+        "data": fields.Raw(readOnly=True, description="The Customer after the change"),
+        "created_at": fields.String(readOnly=True, description="When the change was made"),
+    },
+)
+
+changes_model = api.model(
+    "CustomerChanges",
+    {
+        "changes": fields.List(fields.Nested(change_model)),
+        "last_seq": fields.Integer(
+            description="The seq to pass as since= to read the next changes"
+        ),
+    },
+)
+
+# Largest page of changes returned by /customers/changes
+MAX_CHANGES_LIMIT = 1000
+# Longest long-poll wait allowed on /customers/changes
+MAX_CHANGES_WAIT = 60
+
+changes_args = reqparse.RequestParser()
+changes_args.add_argument(
+    "since",
+    type=inputs.natural,
+    location="args",
+    required=False,
+    default=0,
+    help="Return the changes after this seq",
+)
+changes_args.add_argument(
+    "limit",
+    type=inputs.int_range(1, MAX_CHANGES_LIMIT),
+    location="args",
+    required=False,
+    default=100,
+    help="The maximum number of changes to return",
+)
+changes_args.add_argument(
+    "wait",
+    type=inputs.int_range(0, MAX_CHANGES_WAIT),
+    location="args",
+    required=False,
+    default=0,
+    help="Seconds to wait for a change when there are none (long-poll)",
+)
+
+stream_args = reqparse.RequestParser()
+stream_args.add_argument(
+    "since",
+    type=inputs.natural,
+    location="args",
+    required=False,
+    help="Stream the changes after this seq (defaults to Last-Event-ID or now)",
+)
+
+
+######################################################################
+#  PATH: /customers/changes
+######################################################################
+@api.route("/customers/changes", strict_slashes=False)
+class ChangesResource(Resource):
+    """
+    ChangesResource class
+    Allows consumers to follow the changes to the customers incrementally
+    GET /customers/changes?since=<seq>&limit=<n> - Returns the changes after seq
+    GET /customers/changes?since=<seq>&wait=<s> - Waits for a change (long-poll)
+    """
+
+    @api.doc("list_customer_changes")
+    @api.expect(changes_args, validate=True)
+    @api.marshal_with(changes_model)
+    def get(self):
+        """
+        List the changes to the customers
+        This endpoint returns the changes after the since seq in the order they were made
+        """
+        args = changes_args.parse_args()
+        app.logger.info("Request for changes since %s", args["since"])
+        results = None
+        if args["wait"]:
+            take_stream_slot()
+            try:
+                results = dispatcher.changes_after(args["since"], args["limit"], args["wait"])
+            finally:
+                stream_slots.release()
+        if results is None:
+            results = read_changes(args["since"], args["limit"])
+        last_seq = results[-1]["seq"] if results else args["since"]
+        app.logger.info("Returning %d changes", len(results))
+        return {"changes": results, "last_seq": last_seq}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /customers/stream
+######################################################################
+@api.route("/customers/stream", strict_slashes=False)
+class StreamResource(Resource):
+    """
+    StreamResource class
+    Pushes the changes to the customers as Server-Sent Events
+    GET /customers/stream - Streams every change as it is committed
+    """
+
+    @api.doc("stream_customer_changes")
+    @api.expect(stream_args, validate=True)
+    @api.produces(["text/event-stream"])
+    def get(self):
+        """
+        Stream the changes to the customers
+        This endpoint pushes every change as an event whose id is its seq, so
+        a client that reconnects with Last-Event-ID resumes where it left off
+        """
+        args = stream_args.parse_args()
+        since = args["since"]
+        if since is None and request.headers.get("Last-Event-ID", "").isdigit():
+            since = int(request.headers["Last-Event-ID"])
+        if since is None:
+            since = CustomerChange.last_seq()
+        app.logger.info("Request to stream changes since %s", since)
+        heartbeat = app.config.get("CHANGE_STREAM_HEARTBEAT_SECONDS", 15)
+
+        def events(since):
+            yield "retry: 3000\n\n"
+            while True:
+                changes = dispatcher.changes_after(since, MAX_CHANGES_LIMIT, heartbeat)
+                if changes is None:
+                    changes = read_changes(since, MAX_CHANGES_LIMIT)
+                    db.session.remove()
+                if not changes:
+                    yield ": keep-alive\n\n"
+                for change in changes:
+                    since = change["seq"]
+                    yield f"id: {since}\nevent: {change['operation']}\ndata: {json.dumps(change)}\n\n"
+
+        take_stream_slot()
+        response = Response(
+            stream_with_context(events(since)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        # the server closes the response when the client goes away
+        response.call_on_close(stream_slots.release)
+        return response
@@ -0,0 +1,189 @@
+"""
+Admission Control
+
+This module decides whether a request is let in before it reaches the
+flask-restx resources. Each client has a token bucket (429 when it is
+empty) and the worker sheds load (503) when too many requests are in flight
+or the database pool is slow to hand out connections. Single-customer reads
+are high priority and are shed last.
+
+Clients are told apart by their address, which the app takes from the
+X-Forwarded-For of its trusted proxies only (TRUSTED_PROXY_COUNT), so a
+client cannot get a fresh bucket by sending another header.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import jsonify, request
+from . import status
+
+# Admission classes returned by the classifier
+HIGH = "high"
+LOW = "low"
+
+# Key of the requests made without a request context or address
+LOCAL_CLIENT = "local"
+
+
+class TokenBucket:  # pylint: disable=too-few-public-methods
+    """A token bucket that refills at rate tokens per second up to burst"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token, returns 0 on success or the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:  # pylint: disable=too-many-instance-attributes
+    """Rate limits clients and sheds load when the worker is saturated"""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        client_rate=0.0,
+        client_burst=0.0,
+        max_in_flight=64,
+        low_priority_share=0.75,
+        max_pool_wait=0.5,
+        retry_after=1,
+        max_clients=10000,
+    ):
+        """
+        Args:
+            client_rate (float): requests per second per client, 0 disables the rate limit
+            client_burst (float): requests a client can make at once
+            max_in_flight (int): requests the worker serves at once
+            low_priority_share (float): share of max_in_flight that low priority requests can use
+            max_pool_wait (float): seconds of recent pool wait above which low priority
+                requests are shed (high priority ones at twice that)
+            retry_after (int): seconds sent in Retry-After when shedding load
+        """
+        self.client_rate = client_rate
+        self.client_burst = client_burst or max(client_rate, 1)
+        self.max_in_flight = max_in_flight
+        self.low_priority_limit = max(int(max_in_flight * low_priority_share), 1)
+        self.max_pool_wait = max_pool_wait
+        self.retry_after = retry_after
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.in_flight = 0
+        self.rejected = 0
+        self.shed = 0
+
+    def _rate_limit(self, client: str) -> float:
+        """Takes a token from the bucket of a client"""
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.client_rate, self.client_burst)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket.take()
+
+    def admit(self, client: str, priority: str, pool_wait: float = 0.0):
+        """
+        Decides if a request is let in
+
+        Returns None when it is admitted (release() must be called when it
+        ends) or a tuple of the status code and the Retry-After seconds
+        """
+        with self._lock:
+            if self.client_rate > 0:
+                wait = self._rate_limit(client)
+                if wait > 0:
+                    self.rejected += 1
+                    return status.HTTP_429_TOO_MANY_REQUESTS, max(int(math.ceil(wait)), 1)
+
+            limit = self.max_in_flight if priority == HIGH else self.low_priority_limit
+            wait_limit = self.max_pool_wait * (2 if priority == HIGH else 1)
+            if self.in_flight >= limit or (self.max_pool_wait and pool_wait > wait_limit):
+                self.shed += 1
+                return status.HTTP_503_SERVICE_UNAVAILABLE, self.retry_after
+
+            self.in_flight += 1
+            return None
+
+    def release(self):
+        """Ends an admitted request"""
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        """Returns the admission counters"""
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+                "shed": self.shed,
+                "clients": len(self._buckets),
+            }
+
+
+def client_address() -> str:
+    """Returns the address of the client of the current request, the rate limit key"""
+    return request.remote_addr or LOCAL_CLIENT
+
+
+def init_admission(app, classify, client_key, pool_wait):
+    """
+    Puts admission control in front of the requests
+
+    Args:
+        classify (callable): returns HIGH, LOW or None (not controlled) for the current request
+        client_key (callable): returns the key of the client of the current request
+        pool_wait (callable): returns the recent database pool wait in seconds
+    """
+    if not app.config.get("ADMISSION_CONTROL_ENABLED", True):
+        return None
+    controller = AdmissionController(
+        client_rate=app.config.get("ADMISSION_CLIENT_RATE", 0.0),
+        client_burst=app.config.get("ADMISSION_CLIENT_BURST", 0.0),
+        max_in_flight=app.config.get("ADMISSION_MAX_IN_FLIGHT", 64),
+        low_priority_share=app.config.get("ADMISSION_LOW_PRIORITY_SHARE", 0.75),
+        max_pool_wait=app.config.get("ADMISSION_MAX_POOL_WAIT", 0.5),
+        retry_after=app.config.get("ADMISSION_RETRY_AFTER", 1),
+        max_clients=app.config.get("ADMISSION_MAX_CLIENTS", 10000),
+    )
+    app.extensions["admission"] = controller
+
+    @app.before_request
+    def admit_request():
+        priority = classify()
+        if priority is None:
+            return None
+        refused = controller.admit(client_key(), priority, pool_wait())
+        if refused is None:
+            # kept in the environ so the sub-requests of a batch do not release it
+            request.environ["service.admitted"] = True
+            return None
+        code, retry_after = refused
+        if code == status.HTTP_429_TOO_MANY_REQUESTS:
+            error, message = "Too Many Requests", "Rate limit exceeded, slow down"
+        else:
+            error, message = "Service Unavailable", "The service is overloaded, try again later"
+        app.logger.warning("Refused %s request with %s", priority, code)
+        response = jsonify(status_code=code, error=error, message=message)
+        response.status_code = code
+        response.headers["Retry-After"] = str(retry_after)
+        return response
+
+    @app.teardown_request
+    def release_request(exc):  # pylint: disable=unused-argument
+        if request.environ.pop("service.admitted", False):
+            controller.release()
+
+    return controller
@@ -0,0 +1,116 @@
+"""
+Batch Operations
+
+This module runs the API calls sent together in one batch request in one
+database transaction with one commit. Each call is dispatched to its resource
+as a sub-request, so it is validated and answered exactly as if it had been
+sent on its own, but its writes are only flushed until the batch ends. In
+atomic mode the first failed call rolls every call back, in per-item mode each
+call runs in a savepoint and only the failed ones are rolled back.
+"""
+from flask import request
+
+from service.models import db
+from . import status
+from .media_types import JSON
+from .replicas import CLIENT_ENVIRON, LAST_WRITE_HEADER, client_key
+
+ATOMIC = "atomic"
+PER_ITEM = "per_item"
+MODES = (ATOMIC, PER_ITEM)
+
+METHODS = ("GET", "POST", "PUT", "DELETE")
+
+
+def _begin():
+    """Starts the database transaction before the first savepoint"""
+    connection = db.session.connection()
+    # pysqlite only begins a transaction before a write, so a savepoint taken
+    # before one would be committed as soon as it is released
+    if connection.dialect.driver == "pysqlite" and not connection.connection.in_transaction:
+        connection.exec_driver_sql("BEGIN")
+
+
+def _succeeded(result: dict) -> bool:
+    """Returns True if a call was answered with a 2xx status"""
+    return 200 <= result["status"] < 300
+
+
+def run_operation(app, operation: dict, endpoints) -> dict:
+    """
+    Runs one call of a batch as a sub-request of the current request
+
+    Args:
+        operation (dict): the method, path and optional body of the call
+        endpoints (set): the endpoints a batch may call
+
+    Returns the status, Location and body of the response
+    """
+    method, path = operation["method"].upper(), operation["path"]
+    headers = {"Accept": JSON}
+    # the calls are made on behalf of the client of the batch
+    for name in ("Cookie", LAST_WRITE_HEADER):
+        if name in request.headers:
+            headers[name] = request.headers[name]
+    with app.test_request_context(
+        path,
+        method=method,
+        base_url=request.url_root,
+        json=operation.get("body"),
+        headers=headers,
+        environ_base={"REMOTE_ADDR": request.remote_addr, CLIENT_ENVIRON: client_key()},
+    ):
+        if request.endpoint not in endpoints:
+            return {
+                "status": status.HTTP_400_BAD_REQUEST,
+                "location": None,
+                "body": {"message": f"{method} {path} cannot be called in a batch"},
+            }
+        try:
+            response = app.make_response(app.dispatch_request())
+        except Exception as error:  # pylint: disable=broad-except
+            # the error handlers answer it like they would a request of its own
+            response = app.make_response(app.handle_user_exception(error))
+        return {
+            "status": response.status_code,
+            "location": response.headers.get("Location"),
+            "body": response.get_json(silent=True),
+        }
+
+
+def run_batch(app, operations: list, mode: str, endpoints) -> tuple:
+    """
+    Runs the calls of a batch in one transaction and commits it once
+
+    Args:
+        operations (list): the calls, each a dict with a method, a path and a body
+        mode (str): ATOMIC to roll everything back when a call fails,
+            PER_ITEM to only roll back the calls that failed
+        endpoints (set): the endpoints a batch may call
+
+    Returns the results of the calls that ran and whether the transaction was committed
+    """
+    results = []
+    db.session.info["batch"] = True
+    try:
+        _begin()
+        db.session.flush()
+        for operation in operations:
+            savepoint = db.session.begin_nested() if mode == PER_ITEM else None
+            result = run_operation(app, operation, endpoints)
+            results.append(result)
+            if savepoint is not None:
+                if _succeeded(result):
+                    savepoint.commit()
+                else:
+                    savepoint.rollback()
+            elif not _succeeded(result):
+                db.session.rollback()
+                return results, False
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.info.pop("batch", None)
+    return results, True
@@ -0,0 +1,127 @@
+"""
+Change Dispatcher
+
+This module contains the per-worker dispatcher that fans the change log out
+to many subscribers. A single background thread polls the change log while
+there are subscribers and keeps the recent changes in a ring buffer, so a
+thousand waiting clients cost one query per poll instead of one each.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("flask.app")
+
+
+class ChangeDispatcher:  # pylint: disable=too-many-instance-attributes
+    """Polls the change log once per worker and wakes up the subscribers"""
+
+    def __init__(self, app, fetch, last_seq, poll_interval=1.0, buffer_size=1000):
+        """
+        Args:
+            app (Flask): the application whose context the poller runs in
+            fetch (callable): fetch(since, limit) returns the serialized changes after since
+            last_seq (callable): last_seq() returns the latest seq in the change log
+        """
+        self.app = app
+        self.fetch = fetch
+        self.last_seq = last_seq
+        self.poll_interval = poll_interval
+        self.buffer_size = buffer_size
+        self._cond = threading.Condition()
+        self._wakeup = threading.Event()
+        self._buffer = deque()
+        self._floor = None  # the buffer holds every change after this seq
+        self._seen = None  # the latest seq the poller has seen
+        self._subscribers = 0
+        self._thread = None
+
+    ######################################################################
+    # Subscribers
+    ######################################################################
+
+    def subscribe(self):
+        """Registers a subscriber and starts the poller if needed"""
+        with self._cond:
+            self._subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="change-dispatcher", daemon=True
+                )
+                self._thread.start()
+
+    def unsubscribe(self):
+        """Removes a subscriber, the poller stops when there are none left"""
+        with self._cond:
+            self._subscribers -= 1
+
+    def notify(self):
+        """Polls right away, used after a local commit"""
+        self._wakeup.set()
+
+    def changes_after(self, since: int, limit: int, timeout: float):
+        """
+        Waits up to timeout seconds for changes after since
+
+        Returns the list of changes (empty on timeout) or None if since is
+        older than the buffer and the caller must read the change log itself
+        """
+        deadline = time.monotonic() + timeout
+        self.subscribe()
+        try:
+            with self._cond:
+                while True:
+                    if self._seen is not None:
+                        if since < self._floor:
+                            return None
+                        if since < self._seen:
+                            return [change for change in self._buffer if change["seq"] > since][:limit]
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return []
+                    self._cond.wait(remaining)
+        finally:
+            self.unsubscribe()
+
+    ######################################################################
+    # Poller
+    ######################################################################
+
+    def _run(self):
+        """Polls the change log while there are subscribers"""
+        logger.info("Change dispatcher started")
+        while True:
+            with self._cond:
+                if self._subscribers <= 0:
+                    self._thread = None
+                    logger.info("Change dispatcher stopped")
+                    return
+            try:
+                self._poll()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Change dispatcher could not read the change log")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _poll(self):
+        """Reads the new changes into the buffer and wakes up the subscribers"""
+        with self.app.app_context():
+            if self._seen is None:
+                seen = self.last_seq()
+                with self._cond:
+                    self._floor = self._seen = seen
+                    self._cond.notify_all()
+            while True:
+                changes = self.fetch(self._seen, self.buffer_size)
+                if not changes:
+                    return
+                with self._cond:
+                    for change in changes:
+                        self._buffer.append(change)
+                    while len(self._buffer) > self.buffer_size:
+                        self._floor = self._buffer.popleft()["seq"]
+                    self._seen = changes[-1]["seq"]
+                    self._cond.notify_all()
+                if len(changes) < self.buffer_size:
+                    return
@@ -0,0 +1,134 @@
+"""
+Circuit Breaker
+
+This module contains the circuit breaker around the primary database. After
+a run of connection failures it opens and requests fail fast with
+CircuitOpen instead of each waiting for the database to time out. Once
+reset_timeout has passed a single trial request is let through, and its
+success closes the circuit again.
+"""
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+logger = logging.getLogger("flask.app")
+
+# Circuit states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Postgres SQLSTATE of a statement cancelled by statement_timeout
+QUERY_CANCELED = "57014"
+
+
+class CircuitOpen(Exception):
+    """Used when the database is not called because the circuit is open"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("The database is unavailable, try again later")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:  # pylint: disable=too-many-instance-attributes
+    """Fails fast after repeated failures and probes for recovery"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        """
+        Args:
+            failure_threshold (int): consecutive failures that open the circuit
+            reset_timeout (float): seconds the circuit stays open before a trial request
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self.trips = 0
+
+    def allow(self):
+        """Raises CircuitOpen unless a call to the database may be made"""
+        if self.state == CLOSED:
+            return
+        with self._lock:
+            waited = time.monotonic() - self.opened_at
+            if waited >= self.reset_timeout:
+                # let this caller try the database, the others keep failing fast
+                self.state = HALF_OPEN
+                self.opened_at = time.monotonic()
+                logger.info("Circuit breaker half open, trying the database")
+                return
+            self.rejected += 1
+            raise CircuitOpen(self.reset_timeout - waited)
+
+    def record_success(self):
+        """Closes the circuit after a successful call"""
+        if self.state == CLOSED and self.failures == 0:
+            return
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Circuit breaker closed, the database is back")
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        """Counts a failed call and opens the circuit when there are too many"""
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.failures >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                logger.error("Circuit breaker opened after %d failures", self.failures)
+
+    def trip(self):
+        """Opens the circuit right away, used when the database is down at boot"""
+        with self._lock:
+            self.failures = max(self.failures, self.failure_threshold)
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.trips += 1
+
+    def stats(self) -> dict:
+        """Returns the state and counters of the circuit"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "trips": self.trips,
+            }
+
+
+def is_outage(error: Exception) -> bool:
+    """Returns True if a database error means the database cannot be reached"""
+    if not isinstance(error, DBAPIError):
+        return False
+    if error.connection_invalidated:
+        return True
+    # statement timeouts and interrupted statements are the request's fault
+    original = error.orig
+    if getattr(original, "pgcode", None) == QUERY_CANCELED or str(original) == "interrupted":
+        return False
+    return isinstance(error, (OperationalError, InterfaceError))
+
+
+def watch_engine(engine, breaker: CircuitBreaker):
+    """Feeds the outcome of every statement on an engine to the breaker"""
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _succeeded(*args):  # pylint: disable=unused-argument
+        breaker.record_success()
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        if context.is_disconnect or is_outage(context.sqlalchemy_exception):
+            breaker.record_failure()
@@ -1,8 +1,12 @@
 """
 Flask CLI Command Extensions
 """
+import json
+
+import click
 from service import app
-from service.models import db
+from service.models import Customer, DuplicateRun, db
+from .duplicates import find_duplicates
 
 
 ######################################################################
@@ -18,3 +22,54 @@ def create_db():
     db.drop_all()
     db.create_all()
     db.session.commit()
+    Customer.create_search_index()
+    Customer.init_search(rebuild=True)
+
+
+######################################################################
+# Command to build the search index of Postgres
+# Usage: flask create-search-index
+######################################################################
+@app.cli.command("create-search-index")
+def create_search_index():
+    """
+    Builds the Postgres search index without blocking writes, run it once
+    after deploying. SQLite keeps its index with the tables.
+    """
+    if Customer.create_search_index():
+        click.echo("The customer search index is ready")
+    else:
+        click.echo("This database keeps its search index with the tables, nothing to build")
+
+
+######################################################################
+# Command to find the likely duplicate customers
+# Usage: flask find-duplicates [--window 10] [--threshold 0.85] [--workers 4]
+######################################################################
+@app.cli.command("find-duplicates")
+@click.option("--window", default=app.config.get("DUPLICATE_WINDOW", 10), help="Neighbors each row is compared with")
+@click.option("--threshold", default=app.config.get("DUPLICATE_THRESHOLD", 0.85), help="Similarity of duplicates")
+@click.option("--workers", default=app.config.get("DUPLICATE_WORKERS", 0), help="Processes to use, 0 for every core")
+@click.option("--output", type=click.File("w"), default="-", help="File to write the merge report to")
+@click.option("--run", "run_id", type=int, help="The run started by POST /admin/duplicates to record the report in")
+def find_duplicates_command(window, threshold, workers, output, run_id):  # pylint: disable=too-many-arguments
+    """
+    Finds the customers that are likely duplicates and writes the merge
+    report as JSON, it is also kept for GET /admin/duplicates
+    """
+    if run_id is None:
+        run = DuplicateRun.begin(app.config.get("DUPLICATE_TIMEOUT_SECONDS", 3600))
+    else:
+        run = db.session.get(DuplicateRun, run_id)
+    if run is None:
+        raise click.ClickException("Another duplicate detection is running")
+    try:
+        report = find_duplicates(
+            Customer.duplicate_rows(), window=window, threshold=threshold, workers=workers or None
+        )
+    except Exception as error:
+        run.finish(error=str(error))
+        raise
+    run.finish(report)
+    json.dump(report, output, indent=2)
+    output.write("\n")
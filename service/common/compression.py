@@ -0,0 +1,236 @@
+"""
+Compression
+
+This module contains the content codings the service can send, in order of
+preference, and the negotiation of the one to use from Accept-Encoding.
+Responses are compressed on the fly, chunk by chunk for streamed ones, and
+gzip request bodies are decompressed before they reach the routes. Brotli
+and Zstandard are optional: they are only offered when the brotli and
+zstandard packages are installed.
+"""
+import gzip
+import io
+import zlib
+
+from flask import jsonify, request
+from . import status
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# Compression levels used for bodies compressed once and served many times
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+ZSTD_LEVEL = 19
+
+# Compression levels used on the fly, they favor speed over ratio
+STREAM_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+
+# Media types that are worth compressing, images and fonts already are
+COMPRESSIBLE = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "application/msgpack",
+    "application/cbor",
+    "image/svg+xml",
+)
+
+
+def encodings() -> list:
+    """Returns the content codings that are available, best first"""
+    return (
+        (["zstd"] if zstandard is not None else [])
+        + (["br"] if brotli is not None else [])
+        + ["gzip"]
+    )
+
+
+def negotiate(accept_encodings, offered=None):
+    """
+    Picks the content coding of a response
+
+    Args:
+        accept_encodings (Accept): the parsed Accept-Encoding of the request
+        offered (list): the codings to choose from, best first
+
+    Returns the coding or None to send the body as is
+    """
+    for encoding in offered if offered is not None else encodings():
+        if accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compresses a whole body with the best ratio, for bodies served many times"""
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        # mtime=0 keeps the output, and so the ETag, the same across processes
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    raise ValueError(f"Unsupported content coding: {encoding}")
+
+
+class StreamCompressor:
+    """Compresses a body chunk by chunk, flushing each chunk to the client"""
+
+    def __init__(self, encoding: str):
+        level = STREAM_LEVELS[encoding]
+        if encoding == "zstd":
+            compressor = zstandard.ZstdCompressor(level=level).compressobj()
+            self._compress = compressor.compress
+            self._flush = lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+            self._finish = compressor.flush
+        elif encoding == "br":
+            compressor = brotli.Compressor(quality=level)
+            self._compress = compressor.process
+            self._flush = compressor.flush
+            self._finish = compressor.finish
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._compress = compressor.compress
+            self._flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = compressor.flush
+
+    def compress(self, chunk: bytes, flush: bool = True) -> bytes:
+        """Compresses a chunk, when flush is set everything so far can be decoded"""
+        data = self._compress(chunk)
+        return data + self._flush() if flush else data
+
+    def finish(self) -> bytes:
+        """Ends the compressed body"""
+        return self._finish()
+
+
+def compress_stream(chunks, encoding: str):
+    """Compresses an iterable of chunks as it is sent"""
+    compressor = StreamCompressor(encoding)
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield compressor.compress(chunk)
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def _compressible(response) -> bool:
+    """Returns True if a response may be compressed"""
+    return (
+        response.status_code >= 200
+        and response.status_code not in (status.HTTP_204_NO_CONTENT, status.HTTP_304_NOT_MODIFIED)
+        and "Content-Encoding" not in response.headers
+        and "no-transform" not in response.headers.get("Cache-Control", "")
+        and (response.mimetype or "").startswith(COMPRESSIBLE)
+    )
+
+
+def _error(code: int, error: str, message: str):
+    """Returns a JSON error response like the ones of the error handlers"""
+    response = jsonify(status_code=code, error=error, message=message)
+    response.status_code = code
+    return response
+
+
+def decompress_request(max_body: int):
+    """
+    Replaces a gzip request body by the decompressed one
+
+    Returns an error response when the body cannot be accepted, else None
+    """
+    coding = request.headers.get("Content-Encoding", "identity").strip().lower()
+    if coding == "identity":
+        return None
+    if coding != "gzip":
+        return _error(
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            "Unsupported Media Type",
+            "Request bodies can only be gzip encoded",
+        )
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        # max_length stops a small body from expanding without limit
+        body = decompressor.decompress(request.get_data(cache=False), max_body + 1)
+    except zlib.error:
+        body = None
+    if body is None or not (decompressor.eof or decompressor.unconsumed_tail):
+        return _error(status.HTTP_400_BAD_REQUEST, "Bad Request", "The request body is not valid gzip")
+    if len(body) > max_body or decompressor.unconsumed_tail:
+        return _error(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "Request Entity Too Large",
+            f"The decompressed request body is larger than {max_body} bytes",
+        )
+    # the routes read the decompressed body as if it had been sent as is
+    request.environ["wsgi.input"] = io.BytesIO(body)
+    request.environ["CONTENT_LENGTH"] = str(len(body))
+    request.environ.pop("HTTP_CONTENT_ENCODING", None)
+    for cached in ("stream", "_cached_data", "content_length"):
+        request.__dict__.pop(cached, None)
+    return None
+
+
+def _compress_streamed(response, encoding: str) -> bool:
+    """Compresses a streamed body as it is sent so each event still goes out right away"""
+    response.response = compress_stream(response.iter_encoded(), encoding)
+    response.headers.pop("Content-Length", None)
+    return True
+
+
+def _compress_buffered(response, encoding: str, min_size: int) -> bool:
+    """Compresses a whole body unless it is too small to gain from it"""
+    body = response.get_data()
+    if len(body) < min_size:
+        return False
+    compressor = StreamCompressor(encoding)
+    response.set_data(compressor.compress(body, flush=False) + compressor.finish())
+    return True
+
+
+def compress_response(response, min_size: int):
+    """Compresses a response with the best coding the client accepts"""
+    if not _compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        compressed = _compress_streamed(response, encoding)
+    else:
+        compressed = _compress_buffered(response, encoding, min_size)
+    if not compressed:
+        return response
+    response.headers["Content-Encoding"] = encoding
+    # a strong validator identifies the uncompressed bytes
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """Compresses the responses and accepts gzip request bodies"""
+    if not app.config.get("COMPRESSION_ENABLED", True):
+        return
+    min_size = app.config.get("COMPRESSION_MIN_SIZE", 1024)
+    max_body = app.config.get("MAX_DECOMPRESSED_REQUEST_BYTES", 64 * 1024 * 1024)
+
+    @app.before_request
+    def decompress_body():
+        return decompress_request(max_body)
+
+    @app.after_request
+    def compress_body(response):
+        return compress_response(response, min_size)
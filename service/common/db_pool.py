@@ -0,0 +1,165 @@
+"""
+Database Connection Pool
+
+This module contains a QueuePool that keeps track of how long requests
+wait for a connection and lets them wait no longer than their deadline, and
+a helper that reports the live pool statistics
+"""
+import threading
+import time
+from collections import deque
+
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+from .deadlines import DeadlineExceeded, remaining
+
+# Number of recent checkouts used to compute the recent wait average
+RECENT_WAITS = 100
+# Checkouts older than this many seconds no longer count as recent
+RECENT_SECONDS = 10.0
+
+
+class TimedQueuePool(QueuePool):  # pylint: disable=too-many-instance-attributes
+    """A QueuePool that records the time spent waiting for a connection
+
+    This relies on SQLAlchemy 1.4 internals: QueuePool keeps its checkout
+    timeout in the private _timeout attribute and waits in _do_get().
+    SQLAlchemy is pinned below 2.0 in requirements.txt for that reason.
+    """
+
+    @property
+    def _timeout(self):
+        # QueuePool waits this long for a connection, never past the request's deadline
+        left = remaining()
+        if left is None:
+            return self.checkout_timeout
+        return max(min(self.checkout_timeout, left), 0.0)
+
+    @_timeout.setter
+    def _timeout(self, value):
+        self.checkout_timeout = value
+
+    def timeout(self):
+        """Returns the configured checkout timeout"""
+        return self.checkout_timeout
+
+    def recreate(self):
+        """Returns a new pool with the same configuration"""
+        pool = super().recreate()
+        pool.checkout_timeout = self.checkout_timeout
+        return pool
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = deque(maxlen=RECENT_WAITS)
+
+    def _do_get(self):
+        # QueuePool._do_get() calls itself when it loses an overflow race
+        # so only the outermost call is timed
+        if getattr(self._local, "timing", False):
+            return super()._do_get()
+        self._local.timing = True
+        start = time.perf_counter()
+        left = remaining()
+        try:
+            return super()._do_get()
+        except PoolTimeout as error:
+            with self._stats_lock:
+                self.timeouts += 1
+            if left is not None and left < self.checkout_timeout:
+                raise DeadlineExceeded("Request deadline exceeded while waiting for a database connection") from error
+            raise
+        except Exception:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            self._local.timing = False
+            self._record_wait(time.perf_counter() - start)
+
+    def _record_wait(self, waited: float):
+        """Adds a single checkout wait to the statistics"""
+        with self._stats_lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.recent_waits.append((time.monotonic(), waited))
+
+    def recent_wait(self) -> float:
+        """Returns the average wait in seconds over the recent checkouts"""
+        since = time.monotonic() - RECENT_SECONDS
+        with self._stats_lock:
+            waits = [waited for when, waited in self.recent_waits if when >= since]
+        return sum(waits) / len(waits) if waits else 0.0
+
+    def wait_stats(self) -> dict:
+        """Returns the wait statistics as a dictionary"""
+        with self._stats_lock:
+            checkouts = self.checkouts
+            total_wait = self.total_wait
+            max_wait = self.max_wait
+            timeouts = self.timeouts
+        return {
+            "checkouts": checkouts,
+            "timeouts": timeouts,
+            "total_wait_ms": round(total_wait * 1000, 3),
+            "avg_wait_ms": round(total_wait * 1000 / checkouts, 3) if checkouts else 0.0,
+            "max_wait_ms": round(max_wait * 1000, 3),
+            "recent_wait_ms": round(self.recent_wait() * 1000, 3),
+        }
+
+
+def recent_wait(engine) -> float:
+    """Returns the recent average pool wait of an engine in seconds"""
+    pool = engine.pool
+    return pool.recent_wait() if isinstance(pool, TimedQueuePool) else 0.0
+
+
+def pool_status(engine) -> dict:
+    """Returns the live statistics of the connection pool of an engine"""
+    pool = engine.pool
+    stats = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            {
+                "size": pool.size(),
+                "max_overflow": pool._max_overflow,  # pylint: disable=protected-access
+                "timeout": pool.timeout(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            }
+        )
+    else:
+        stats["status"] = pool.status()
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.wait_stats())
+    return stats
+
+
+def preconnect(engine, count: int) -> int:
+    """
+    Opens up to count connections of an engine at once and checks them back
+    into its pool, so the first requests do not pay for connecting
+
+    Returns the number of connections opened, pools that do not keep
+    connections are left alone
+    """
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return 0
+    connections = []
+    try:
+        for _ in range(min(count, pool.size())):
+            connections.append(engine.raw_connection())
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
@@ -0,0 +1,117 @@
+"""
+Request Deadlines
+
+This module gives every request a deadline and makes the database enforce
+it. On Postgres the time left is set as the statement_timeout of each
+transaction, on SQLite a progress handler interrupts the statement. A
+statement that runs out of time raises DeadlineExceeded, which the error
+handlers turn into a 504.
+"""
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+# Postgres SQLSTATE of a statement cancelled by statement_timeout
+QUERY_CANCELED = "57014"
+
+# SQLite calls the progress handler every this many virtual machine instructions
+SQLITE_PROGRESS_STEPS = 1000
+
+
+class DeadlineExceeded(Exception):
+    """Used when a request runs past its deadline"""
+
+
+def remaining() -> float:
+    """Returns the seconds left before the current request's deadline or None"""
+    if not has_request_context():
+        return None
+    deadline = g.get("deadline")
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextmanager
+def time_limit(seconds: float):
+    """Gives the database calls in the block at most seconds, within the deadline of the request"""
+    previous = g.get("deadline")
+    deadline = time.monotonic() + seconds
+    g.deadline = deadline if previous is None else min(previous, deadline)
+    try:
+        yield
+    finally:
+        g.deadline = previous
+
+
+def init_deadlines(app, exempt=None):
+    """
+    Gives every request a deadline
+
+    Args:
+        exempt (callable): returns True for requests that are meant to run long
+    """
+
+    @app.before_request
+    def start_deadline():
+        if exempt is not None and exempt():
+            g.deadline = None
+            return
+        timeout = app.config.get("REQUEST_DEADLINE_MS", 30000)
+        header = request.headers.get(DEADLINE_HEADER, "")
+        if header.isdigit() and int(header) > 0:
+            # clients can only ask for less time
+            timeout = min(timeout, int(header))
+        g.deadline = time.monotonic() + timeout / 1000.0
+
+
+def _check(context_name: str) -> float:
+    """Raises DeadlineExceeded if the deadline has passed"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded before {context_name}")
+    return left
+
+
+@event.listens_for(Session, "after_begin")
+def _set_statement_timeout(session, transaction, connection):  # pylint: disable=unused-argument
+    """Limits every statement of the transaction to the time left on Postgres"""
+    left = _check("the transaction began")
+    if left is not None and connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(int(left * 1000), 1)}")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _check_deadline(
+    conn, cursor, statement, parameters, context, executemany
+):  # pylint: disable=unused-argument, too-many-arguments
+    """Refuses to start a statement after the deadline and arms SQLite's interrupt"""
+    left = _check("a database statement")
+    if conn.dialect.driver == "pysqlite":
+        dbapi_connection = conn.connection.connection
+        if left is None:
+            dbapi_connection.set_progress_handler(None, 0)
+        else:
+            deadline = time.monotonic() + left
+            dbapi_connection.set_progress_handler(
+                lambda: int(time.monotonic() > deadline), SQLITE_PROGRESS_STEPS
+            )
+
+
+@event.listens_for(Engine, "handle_error", retval=True)
+def _translate_timeout(context):
+    """Turns a statement cancelled for the deadline into DeadlineExceeded"""
+    error = context.original_exception
+    left = remaining()
+    if left is None or not isinstance(context.sqlalchemy_exception, OperationalError):
+        return None
+    if getattr(error, "pgcode", None) == QUERY_CANCELED or str(error) == "interrupted":
+        return DeadlineExceeded("Request deadline exceeded while waiting for the database")
+    return None
@@ -0,0 +1,206 @@
+"""
+Duplicate Detection
+
+This module finds the customers that are likely duplicates of each other
+without comparing every pair. Rows are blocked by their postal code
+stripped down to its letters and digits, each block is sorted by normalized
+name and only the rows that fall within a small window of each other are
+compared (sorted neighborhood). Blocks are independent so they are matched
+in parallel by a process pool, and the matching pairs are joined into groups
+for the merge report.
+"""
+import logging
+import multiprocessing
+import re
+import time
+import unicodedata
+
+logger = logging.getLogger("flask.app")
+
+# Rows handed to a worker process at once, whole blocks are never split
+BATCH_SIZE = 10000
+
+# Weights of the name and the street in the similarity score
+NAME_WEIGHT = 0.7
+STREET_WEIGHT = 0.3
+
+
+def normalize(value: str) -> str:
+    """Lowercases a value, strips its accents and punctuation and collapses spaces"""
+    value = value or ""
+    if not value.isascii():
+        value = unicodedata.normalize("NFKD", value)
+        value = "".join(char for char in value if not unicodedata.combining(char))
+    return " ".join(re.findall(r"[a-z0-9]+", value.lower()))
+
+
+def blocking_key(postalcode: str) -> str:
+    """Returns the block of a row, rows in different blocks are never compared
+
+    The database sorts the rows on the same key so it has to be one SQL can
+    compute: the ASCII letters and digits of the postal code, lowercased
+    """
+    return re.sub(r"[^A-Za-z0-9]", "", postalcode or "").lower()
+
+
+def bigrams(value: str) -> frozenset:
+    """Returns the set of the pairs of adjacent characters of a value"""
+    return frozenset(value[i:i + 2] for i in range(len(value) - 1)) or frozenset([value])
+
+
+def dice(first: frozenset, second: frozenset) -> float:
+    """Returns the Dice coefficient of two sets of bigrams"""
+    return 2 * len(first & second) / (len(first) + len(second))
+
+
+def prepare(customer_id, f_name, l_name, street) -> tuple:
+    """Returns the normalized name and the bigrams that a row is compared on"""
+    name = normalize(f"{l_name} {f_name}")
+    return customer_id, name, bigrams(name), bigrams(normalize(street))
+
+
+def similarity(first: tuple, second: tuple) -> float:
+    """Returns how alike two prepared rows are between 0 and 1
+
+    Rows are compared on the bigrams of their names and streets, set
+    intersections are cheap enough to compare millions of pairs
+    """
+    name_score = dice(first[2], second[2])
+    # the street cannot make up for a name that is too different
+    if NAME_WEIGHT * name_score + STREET_WEIGHT < 0.5:
+        return 0.0
+    return NAME_WEIGHT * name_score + STREET_WEIGHT * dice(first[3], second[3])
+
+
+def match_blocks(task: tuple) -> list:
+    """
+    Finds the similar pairs in a batch of blocks, runs in a worker process
+
+    Args:
+        task (tuple): the blocks (lists of (id, first name, last name, street)),
+            the window size and the score threshold
+
+    Returns a list of (id, id, score) for the pairs scoring at least the threshold
+    """
+    blocks, window, threshold = task
+    pairs = []
+    for block in blocks:
+        rows = sorted((prepare(*row) for row in block), key=lambda row: (row[1], row[0]))
+        for i, row in enumerate(rows):
+            for other in rows[i + 1:i + window]:
+                score = similarity(row, other)
+                if score >= threshold:
+                    pairs.append((min(row[0], other[0]), max(row[0], other[0]), round(score, 3)))
+    return pairs
+
+
+def batch_blocks(rows, batch_size: int = BATCH_SIZE):
+    """
+    Cuts rows sorted by blocking key into batches of whole blocks
+
+    Args:
+        rows (iterable): (id, first name, last name, street, postal code) tuples
+            ordered by the blocking key of their postal code
+    """
+    batch, size = [], 0
+    block, key = [], None
+    for customer_id, f_name, l_name, street, postalcode in rows:
+        row_key = blocking_key(postalcode)
+        if row_key != key and block:
+            batch.append(block)
+            size += len(block)
+            block = []
+            if size >= batch_size:
+                yield batch
+                batch, size = [], 0
+        key = row_key
+        block.append((customer_id, f_name, l_name, street))
+    if block:
+        batch.append(block)
+    if batch:
+        yield batch
+
+
+def group_pairs(pairs: list) -> list:
+    """Joins the matching pairs into groups of duplicates with union-find"""
+    parent = {}
+
+    def find(customer_id):
+        parent.setdefault(customer_id, customer_id)
+        while parent[customer_id] != customer_id:
+            parent[customer_id] = parent[parent[customer_id]]
+            customer_id = parent[customer_id]
+        return customer_id
+
+    scores = {}
+    for first, second, score in pairs:
+        root, other_root = find(first), find(second)
+        if root != other_root:
+            parent[max(root, other_root)] = min(root, other_root)
+        scores[first] = min(scores.get(first, 1.0), score)
+        scores[second] = min(scores.get(second, 1.0), score)
+
+    groups = {}
+    for customer_id in parent:
+        groups.setdefault(find(customer_id), []).append(customer_id)
+    report = []
+    for members in groups.values():
+        members.sort()
+        report.append(
+            {
+                # the oldest row is kept and the others are merged into it
+                "keep": members[0],
+                "duplicates": members[1:],
+                "score": min(scores[customer_id] for customer_id in members),
+            }
+        )
+    report.sort(key=lambda group: group["keep"])
+    return report
+
+
+def find_duplicates(rows, window=10, threshold=0.85, workers=None, batch_size=BATCH_SIZE) -> dict:
+    """
+    Finds the likely duplicates among customer rows
+
+    Args:
+        rows (iterable): (id, first name, last name, street, postal code) tuples
+            ordered by the blocking key of their postal code, they are streamed
+            so the table is never in memory
+        window (int): how many neighbors of a row in its sorted block it is compared with
+        threshold (float): the similarity from which two rows are duplicates
+        workers (int): processes matching blocks in parallel, 1 matches in this process
+
+    Returns the merge report
+    """
+    start = time.monotonic()
+    counts = {"customers": 0, "blocks": 0}
+
+    def tasks():
+        for batch in batch_blocks(rows, batch_size):
+            counts["blocks"] += len(batch)
+            counts["customers"] += sum(len(block) for block in batch)
+            yield batch, window, threshold
+
+    workers = workers or multiprocessing.cpu_count()
+    pairs = []
+    if workers == 1:
+        for found in map(match_blocks, tasks()):
+            pairs.extend(found)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            for found in pool.imap_unordered(match_blocks, tasks()):
+                pairs.extend(found)
+
+    groups = group_pairs(pairs)
+    elapsed = time.monotonic() - start
+    logger.info(
+        "Found %d duplicate groups among %d customers in %.1fs", len(groups), counts["customers"], elapsed
+    )
+    return {
+        "customers": counts["customers"],
+        "blocks": counts["blocks"],
+        "pairs": len(pairs),
+        "duplicates": sum(len(group["duplicates"]) for group in groups),
+        "seconds": round(elapsed, 3),
+        "groups": groups,
+    }
@@ -17,9 +17,13 @@
 """
 Module: error_handlers
 """
+import math
+
 from service.models import DataValidationError
 from service import app, api
 from . import status
+from .circuit_breaker import CircuitOpen
+from .deadlines import DeadlineExceeded
 
 
 ######################################################################
@@ -35,3 +39,26 @@ def request_validation_error(error):
         'status_code': status.HTTP_400_BAD_REQUEST,
         'error': 'Bad Request',
         'message': message}, status.HTTP_400_BAD_REQUEST
+
+
+@api.errorhandler(DeadlineExceeded)
+def deadline_exceeded(error):
+    """ Handles requests that ran past their deadline """
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        'status_code': status.HTTP_504_GATEWAY_TIMEOUT,
+        'error': 'Gateway Timeout',
+        'message': message}, status.HTTP_504_GATEWAY_TIMEOUT
+
+
+@api.errorhandler(CircuitOpen)
+def database_unavailable(error):
+    """ Handles requests refused while the database circuit is open """
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        'status_code': status.HTTP_503_SERVICE_UNAVAILABLE,
+        'error': 'Service Unavailable',
+        'message': message}, status.HTTP_503_SERVICE_UNAVAILABLE, {
+            'Retry-After': str(max(int(math.ceil(error.retry_after)), 1))}
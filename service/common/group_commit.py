@@ -0,0 +1,139 @@
+"""
+Group Commit
+
+This module contains a writer that commits the writes of concurrent requests
+together. Each request queues its write and waits, a background thread takes
+what has queued up for a few milliseconds (or up to a number of rows), writes
+it in one transaction and commits once, then hands every request its result.
+A request still only gets its answer once its write is committed.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from service.models import db
+from .deadlines import DeadlineExceeded, remaining
+
+logger = logging.getLogger("flask.app")
+
+
+class GroupCommitWriter:
+    """Writes the items queued by concurrent requests in shared transactions"""
+
+    def __init__(self, app, write, max_rows=100, max_delay=0.005):
+        """
+        Args:
+            write (callable): writes a list of items in the current transaction
+            max_rows (int): most items written in one transaction
+            max_delay (float): seconds the first item of a group waits for others
+        """
+        self.app = app
+        self.write_items = write
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.groups = 0
+        self.items = 0
+        self.largest = 0
+
+    def submit(self, item) -> Future:
+        """Queues an item, the future is resolved once it is committed"""
+        self._start()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def write(self, item, timeout=None):
+        """Queues an item and waits for its commit, within the request deadline"""
+        if timeout is None:
+            timeout = remaining()
+        future = self.submit(item)
+        try:
+            return future.result(timeout)
+        except FutureTimeout as error:
+            # a write still queued is dropped, one being committed may already be
+            # in the database so its outcome is awaited rather than reported as a 504
+            if future.cancel():
+                raise DeadlineExceeded("The write was not committed before the deadline") from error
+        return future.result()
+
+    def _start(self):
+        """Starts the writer thread, after the worker process is forked"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def _next_group(self) -> list:
+        """Waits for an item and returns it with the ones queued shortly after it"""
+        group = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(group) < self.max_rows:
+            try:
+                group.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return group
+
+    def _run(self):
+        """Writes the queued items group by group"""
+        while True:
+            group = [
+                (item, future) for item, future in self._next_group() if future.set_running_or_notify_cancel()
+            ]
+            with self.app.app_context():
+                try:
+                    error = self._commit([item for item, _ in group])
+                    if len(group) > 1 and isinstance(error, (IntegrityError, DataError)):
+                        # one bad item must not fail the others of its group
+                        for item, future in group:
+                            self._resolve([(item, future)], self._commit([item]))
+                    else:
+                        self._resolve(group, error)
+                finally:
+                    db.session.remove()
+
+    def _commit(self, items: list):
+        """Writes and commits items in one transaction, returns the error if it failed"""
+        if not items:
+            return None
+        try:
+            self.write_items(items)
+            db.session.commit()
+        except Exception as error:  # pylint: disable=broad-except
+            db.session.rollback()
+            logger.error("Group commit of %d items failed: %s", len(items), error)
+            return error
+        with self._lock:
+            self.groups += 1
+            self.items += len(items)
+            self.largest = max(self.largest, len(items))
+        return None
+
+    @staticmethod
+    def _resolve(group: list, error):
+        """Hands each waiting request its item or the error"""
+        for item, future in group:
+            if error is None:
+                future.set_result(item)
+            else:
+                future.set_exception(error)
+
+    def stats(self) -> dict:
+        """Returns the group commit counters"""
+        with self._lock:
+            return {
+                "groups": self.groups,
+                "items": self.items,
+                "largest": self.largest,
+                "queued": self._queue.qsize(),
+                "average": round(self.items / self.groups, 2) if self.groups else 0.0,
+            }
@@ -0,0 +1,67 @@
+"""
+Health Checks
+
+This module contains the readiness check of the service. It runs the checks
+of the dependencies at most once per interval and answers every probe in
+between from the last result, so frequent probes from many pods cost almost
+nothing and never pile up on a slow database.
+"""
+import threading
+import time
+
+
+class HealthCheck:
+    """Runs named checks and caches their combined result for a short interval"""
+
+    def __init__(self, checks: list, ttl: float = 2.0):
+        """
+        Args:
+            checks (list): (name, callable) pairs, each callable returns a dict
+                with an "ok" key and details, or raises when the check fails
+            ttl (float): seconds a result is reused before the checks run again
+        """
+        self.checks = checks
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._running = False
+        self._result = None
+        self._checked_at = 0.0
+
+    def run(self) -> dict:
+        """Runs every check now and returns the combined result"""
+        report = {}
+        for name, check in self.checks:
+            start = time.perf_counter()
+            try:
+                report[name] = dict(check())
+            except Exception as error:  # pylint: disable=broad-except
+                report[name] = {"ok": False, "error": f"{type(error).__name__}: {error}"}
+            report[name]["ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return {"ok": all(result["ok"] for result in report.values()), "checks": report}
+
+    def status(self) -> dict:
+        """Returns the cached result, running the checks when it is too old"""
+        with self._lock:
+            age = time.monotonic() - self._checked_at
+            fresh = self._result is not None and age < self.ttl
+            # one probe refreshes the result and the others answer from the last
+            # one meanwhile, so probes never queue behind a slow check
+            if fresh or self._running:
+                if self._result is None:
+                    return {"ok": False, "checks": {}, "age": None}
+                return dict(self._result, age=round(age, 3))
+            self._running = True
+        try:
+            result = self.run()
+        finally:
+            with self._lock:
+                self._running = False
+        with self._lock:
+            self._result = result
+            self._checked_at = time.monotonic()
+        return dict(result, age=0.0)
+
+    def invalidate(self):
+        """Forgets the cached result so the next probe runs the checks"""
+        with self._lock:
+            self._result = None
@@ -0,0 +1,119 @@
+"""
+Idempotency Keys
+
+This module contains the decorator that makes a write safe to retry. A
+request sent with an Idempotency-Key header runs once, its response is stored
+with the key, and retries with the same key get the stored response back
+without running the write again.
+"""
+import hashlib
+import itertools
+from functools import wraps
+
+from flask import current_app, request
+from flask_restx import abort
+from flask_restx.utils import unpack
+from sqlalchemy.exc import IntegrityError
+
+from service.models import IdempotencyKey, db
+from . import status
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Prune the table once every this many stored keys (per worker)
+PRUNE_EVERY = 100
+_stored = itertools.count(1)
+
+
+def _replay(record):
+    """Returns the stored response of a key"""
+    headers = {REPLAYED_HEADER: "true"}
+    if record.location:
+        headers["Location"] = record.location
+    return record.body, record.status_code, headers
+
+
+def _reject_reuse(record, signature):
+    """Aborts if the key belongs to another request or is still running"""
+    if not record.matches(signature):
+        abort(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            f"{IDEMPOTENCY_HEADER} '{record.key}' was already used for a different request",
+        )
+    if not record.completed:
+        abort(
+            status.HTTP_409_CONFLICT,
+            f"A request with {IDEMPOTENCY_HEADER} '{record.key}' is still in progress",
+        )
+
+
+def _stored_response(key, signature):
+    """Returns the stored response of a key, or None if the request has to run"""
+    # a key still pending after its lease was left behind by a request that died
+    record = IdempotencyKey.find(key, current_app.config.get("IDEMPOTENCY_LEASE_SECONDS", 60))
+    if record is None:
+        return None
+    _reject_reuse(record, signature)
+    current_app.logger.info("Replaying response for %s %s", IDEMPOTENCY_HEADER, key)
+    return _replay(record)
+
+
+def _run_once(func, args, kwargs, key, signature):
+    """Runs the request with its key reserved and stores its response with the key"""
+    # the key commits together with the write it protects
+    record = IdempotencyKey.reserve(key, signature, current_app.config.get("IDEMPOTENCY_TTL_SECONDS", 86400))
+    try:
+        response = func(*args, **kwargs)
+    except IntegrityError:
+        # a concurrent request with the same key committed first
+        db.session.rollback()
+        record = IdempotencyKey.find(key)
+        if record is None:
+            raise
+        _reject_reuse(record, signature)
+        return _replay(record)
+    except Exception:
+        db.session.rollback()
+        raise
+
+    body, code, headers = unpack(response)
+    if not 200 <= code < 300:
+        db.session.rollback()
+        return body, code, headers
+    record.status_code = code
+    record.body = body
+    record.location = headers.get("Location")
+    db.session.add(record)
+    db.session.commit()
+    if next(_stored) % PRUNE_EVERY == 0:
+        IdempotencyKey.prune(current_app.config.get("IDEMPOTENCY_MAX_KEYS", 100000))
+    return body, code, headers
+
+
+def idempotent(func):
+    """
+    Stores and replays the response of a write sent with an Idempotency-Key
+
+    Must be applied above @api.marshal_with so that the marshalled body is
+    what gets stored.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return func(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters",
+            )
+        signature = (request.method, request.path, hashlib.sha256(request.get_data()).hexdigest())
+        response = _stored_response(key, signature)
+        if response is None:
+            response = _run_once(func, args, kwargs, key, signature)
+        return response
+
+    return wrapper
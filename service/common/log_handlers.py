@@ -18,19 +18,249 @@
 Log Handlers
 
 This module contains utility functions to set up logging
-consistently
+consistently. Records are handed to a queue on the request thread and a
+background listener formats them and writes them out, so log I/O never
+blocks a request. It also writes one access log line per request with its
+request id, latency and database time.
 """
+import atexit
+import json
 import logging
+import queue
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] [%(request_id)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Request ids sent by clients are only trusted if they look like one
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# Fields of the access log line that are added to the JSON output
+ACCESS_FIELDS = (
+    "method",
+    "route",
+    "path",
+    "status",
+    "latency_ms",
+    "db_time_ms",
+    "db_statements",
+    "row_count",
+)
+
+
+class lazy:  # pylint: disable=invalid-name, too-few-public-methods
+    """
+    Defers an expensive log argument until the message is actually built
+
+    Usage:
+        app.logger.debug("Customer : %s", lazy(customer.serialize))
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+
+class RequestSamplingFilter(logging.Filter):
+    """Keeps only a sample of the INFO and DEBUG lines logged by requests"""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or self.rate >= 1.0:
+            return True
+        if getattr(record, "access_log", False):
+            return True
+        if not has_request_context():
+            return True
+        return random.random() < self.rate
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the id of the current request to every record"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get("request_id")
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """Formats records as text, with - for the request id of those outside a request"""
+
+    def format(self, record):
+        if getattr(record, "request_id", None) is None:
+            record.request_id = "-"
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as a single line of JSON"""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for field in ACCESS_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queues records without formatting them
+
+    The standard QueueHandler formats the record on the calling thread so it
+    can be pickled. The queue here never leaves the process so only the
+    message arguments are merged (while the objects they refer to are still
+    valid) and the formatting is left to the listener thread.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
+    handlers = list(gunicorn_logger.handlers)
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config.get("LOG_FORMAT", "text") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = TextFormatter(TEXT_FORMAT, DATE_FORMAT)
+    for handler in handlers:
         handler.setFormatter(formatter)
+
+    stop_listener(app)
+    if handlers and app.config.get("LOG_QUEUE_ENABLED", True):
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        app.extensions["log_listener"] = listener
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(RequestSamplingFilter(app.config.get("LOG_INFO_SAMPLE_RATE", 1.0)))
+        app.logger.handlers = [queue_handler]
+    else:
+        app.logger.handlers = handlers
+    for handler in app.logger.handlers:
+        if not any(isinstance(f, RequestIdFilter) for f in handler.filters):
+            handler.addFilter(RequestIdFilter())
     app.logger.info("Logging handler established")
+
+
+def stop_listener(app):
+    """Flushes and stops the background log listener"""
+    listener = app.extensions.pop("log_listener", None)
+    if listener:
+        listener.stop()
+        atexit.unregister(listener.stop)
+
+
+######################################################################
+# Access Log
+######################################################################
+
+
+def init_access_log(app):
+    """Logs one line per request with its id, timing and database work"""
+    if not app.config.get("ACCESS_LOG_ENABLED", True):
+        return
+
+    @app.before_request
+    def start_access_log():
+        request_id = request.headers.get(REQUEST_ID_HEADER, "")
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        g.request_id = request_id
+        g.request_start = time.perf_counter()
+        g.db_time = 0.0
+        g.db_statements = 0
+        g.row_count = 0
+
+    @app.after_request
+    def write_access_log(response):
+        request_id = g.get("request_id")
+        if request_id is None:
+            return response
+        response.headers[REQUEST_ID_HEADER] = request_id
+        latency = time.perf_counter() - g.request_start
+        route = request.url_rule.rule if request.url_rule else None
+        app.logger.info(
+            "%s %s %s %.2fms",
+            request.method,
+            request.path,
+            response.status_code,
+            latency * 1000,
+            extra={
+                "access_log": True,
+                "method": request.method,
+                "route": route,
+                "path": request.path,
+                "status": response.status_code,
+                "latency_ms": round(latency * 1000, 3),
+                "db_time_ms": round(g.db_time * 1000, 3),
+                "db_statements": g.db_statements,
+                "row_count": g.row_count,
+            },
+        )
+        return response
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement(
+    conn, cursor, statement, parameters, context, executemany
+):  # pylint: disable=unused-argument, too-many-arguments
+    """Remembers when a statement was sent to the database"""
+    conn.info.setdefault("statement_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_statement(
+    conn, cursor, statement, parameters, context, executemany
+):  # pylint: disable=unused-argument, too-many-arguments
+    """Adds the statement time and rows to the current request"""
+    elapsed = time.perf_counter() - conn.info["statement_start"].pop()
+    if has_request_context() and "db_time" in g:
+        g.db_time += elapsed
+        g.db_statements += 1
+        # rowcount is the number of rows the driver reports, -1 when unknown
+        if cursor.rowcount > 0:
+            g.row_count += cursor.rowcount
+
+
+@event.listens_for(Engine, "handle_error")
+def _failed_statement(context):
+    """Forgets the start time of a statement that failed"""
+    if context.connection is not None and context.connection.info.get("statement_start"):
+        context.connection.info["statement_start"].pop()
@@ -0,0 +1,84 @@
+"""
+Media Types
+
+This module contains the media types the API can speak besides JSON.
+MessagePack and CBOR are compact binary encodings of the same documents,
+cheaper to parse for service-to-service calls. Each one is optional: it is
+only offered when the msgpack or cbor2 package is installed.
+"""
+import json
+
+from flask import make_response
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover
+    cbor2 = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+# Older names that clients still send for the same encodings
+ALIASES = {"application/x-msgpack": MSGPACK}
+
+
+def supported() -> list:
+    """Returns the media types that can be sent and received, JSON first"""
+    return (
+        [JSON]
+        + ([MSGPACK] if msgpack is not None else [])
+        + ([CBOR] if cbor2 is not None else [])
+    )
+
+
+def encode(data, media_type: str) -> bytes:
+    """Encodes a document in a media type"""
+    media_type = ALIASES.get(media_type, media_type)
+    if media_type == MSGPACK:
+        return msgpack.packb(data, use_bin_type=True, default=str)
+    if media_type == CBOR:
+        return cbor2.dumps(data, default=lambda encoder, value: encoder.encode(str(value)))
+    return json.dumps(data).encode("utf-8")
+
+
+def decode(body: bytes, media_type: str):
+    """Decodes a document, raises ValueError when it is not valid in its media type"""
+    media_type = ALIASES.get(media_type, media_type)
+    try:
+        if media_type == MSGPACK and msgpack is not None:
+            return msgpack.unpackb(body, raw=False)
+        if media_type == CBOR and cbor2 is not None:
+            return cbor2.loads(body)
+        if media_type == JSON:
+            return json.loads(body)
+    except ValueError:
+        raise
+    except Exception as error:  # the decoders raise their own exception types
+        raise ValueError(str(error)) from error
+    raise ValueError(f"Unsupported media type: {media_type}")
+
+
+def init_representations(api):
+    """Lets the resources of an Api answer in every supported media type"""
+
+    def representation(media_type):
+        def output(data, code, headers=None):
+            response = make_response(encode(data, media_type), code)
+            response.headers.extend(headers or {})
+            response.mimetype = media_type
+            return response
+
+        return output
+
+    for media_type in supported():
+        if media_type != JSON:
+            api.representation(media_type)(representation(media_type))
+    for alias, media_type in ALIASES.items():
+        if media_type in supported():
+            api.representation(alias)(representation(media_type))
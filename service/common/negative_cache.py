@@ -0,0 +1,164 @@
+"""
+Negative Cache
+
+This module remembers the customer ids that were recently not found so that
+repeated lookups of them can be answered with a 404 without a query. It can
+also keep a Bloom filter of every existing id, rebuilt from the table in the
+background, that rejects ids which have never existed.
+
+Ids are handed out before their transaction commits, so a snapshot can miss
+a lower id whose create commits after a higher one. The filter only rejects
+ids up to the largest id of a snapshot taken at least lag seconds earlier,
+by which time every create that was in flight has committed or rolled back.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("flask.app")
+
+
+class BloomFilter:
+    """A Bloom filter of integers"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: int):
+        """Returns the bit positions of an item using double hashing"""
+        digest = hashlib.blake2b(str(item).encode("ascii"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item: int):
+        """Adds an item to the filter"""
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class NegativeCache:  # pylint: disable=too-many-instance-attributes
+    """Remembers which ids do not exist"""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, app=None, ttl=5.0, max_size=100000, load_ids=None, bloom_refresh=300.0, error_rate=0.01, lag=60.0
+    ):
+        """
+        Args:
+            app (Flask): the application whose context the Bloom filter is built in
+            ttl (float): seconds a missing id is remembered
+            max_size (int): the most missing ids remembered
+            load_ids (callable): returns (max_id, count, ids) of the table to enable the Bloom filter
+            bloom_refresh (float): seconds between rebuilds of the Bloom filter
+            lag (float): seconds after which a create in flight has surely committed,
+                longer than any write transaction
+        """
+        self.app = app
+        self.ttl = ttl
+        self.max_size = max_size
+        self.load_ids = load_ids
+        self.bloom_refresh = bloom_refresh
+        self.error_rate = error_rate
+        self.lag = lag
+        self._lock = threading.Lock()
+        self._misses = OrderedDict()
+        self._bloom = None
+        # the ids up to the watermark are all in the filter, the largest id of
+        # the last snapshot becomes the watermark once it is lag seconds old
+        self._watermark = 0
+        self._observed = None
+        self._bloom_built_at = None
+        self._building = False
+
+    def is_missing(self, customer_id: int) -> bool:
+        """Returns True if the id is known not to exist"""
+        if customer_id <= 0:
+            return True
+        with self._lock:
+            expires = self._misses.get(customer_id)
+            if expires is not None:
+                if expires > time.monotonic():
+                    return True
+                del self._misses[customer_id]
+            bloom, watermark = self._bloom, self._watermark
+        # ids above the watermark may have been committed after the snapshot
+        return bloom is not None and customer_id <= watermark and customer_id not in bloom
+
+    def add(self, customer_id: int):
+        """Remembers that an id was not found"""
+        with self._lock:
+            self._misses[customer_id] = time.monotonic() + self.ttl
+            self._misses.move_to_end(customer_id)
+            while len(self._misses) > self.max_size:
+                self._misses.popitem(last=False)
+
+    def discard(self, customer_id: int):
+        """Forgets a missing id, used when it is created"""
+        with self._lock:
+            self._misses.pop(customer_id, None)
+            if self._bloom is not None:
+                self._bloom.add(customer_id)
+
+    def clear(self):
+        """Forgets every missing id"""
+        with self._lock:
+            self._misses.clear()
+
+    ######################################################################
+    # Bloom filter
+    ######################################################################
+
+    def bloom_stale(self) -> bool:
+        """Returns True if the Bloom filter is enabled and due for a rebuild"""
+        if self.load_ids is None:
+            return False
+        if self._bloom_built_at is None:
+            return True
+        # a filter without a watermark yet is rebuilt as soon as it can have one
+        interval = self.lag if self._watermark == 0 else self.bloom_refresh
+        return time.monotonic() - self._bloom_built_at > interval
+
+    def refresh_bloom(self, background: bool = True):
+        """Rebuilds the Bloom filter when it is stale"""
+        with self._lock:
+            if self._building or not self.bloom_stale():
+                return
+            self._building = True
+        if background:
+            threading.Thread(target=self.rebuild_bloom, name="bloom-rebuild", daemon=True).start()
+        else:
+            self.rebuild_bloom()
+
+    def rebuild_bloom(self):
+        """Builds a new Bloom filter from the ids in the table"""
+        try:
+            started = time.monotonic()
+            with self.app.app_context():
+                max_id, count, ids = self.load_ids()
+                observed = (time.monotonic(), max_id or 0)
+                bloom = BloomFilter(count, self.error_rate)
+                for customer_id in ids:
+                    bloom.add(customer_id)
+            with self._lock:
+                self._bloom = bloom
+                if self._observed is not None and started - self._observed[0] >= self.lag:
+                    self._watermark = self._observed[1]
+                    self._observed = None
+                if self._observed is None:
+                    self._observed = observed
+            logger.info("Rebuilt the Bloom filter of %d customer ids", count)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not rebuild the Bloom filter")
+        finally:
+            with self._lock:
+                self._bloom_built_at = time.monotonic()
+                self._building = False
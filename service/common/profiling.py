@@ -0,0 +1,260 @@
+"""
+Request Profiling
+
+This module profiles single requests to the API resources on demand, for a
+request carrying the admin profiling header or for a sampled share of them.
+A sampling thread takes the stack of the request thread every interval and
+the stacks are written as a collapsed-stack file, the input of flamegraph.pl
+and speedscope, next to a summary of the functions it spent the most time
+in. With the cprofile mode the request also runs under cProfile, whose
+summary is exact but slows it down. A request that is not profiled only
+pays for a config lookup.
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+# kept in the environ, not g, so the sub-requests of a batch do not stop it
+PROFILER_ENVIRON = "service.profiler"
+
+# Kinds of files written for each profile
+EXTENSIONS = (".collapsed", ".txt", ".prof")
+
+
+class StackSampler:
+    """Samples the stack of one thread from a background thread"""
+
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        """Starts taking samples"""
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        """Stops taking samples and returns how many times each stack was seen"""
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            if frame is not None:
+                self.stacks[stack_of(frame)] += 1
+
+
+def frame_name(code) -> str:
+    """Names the function of a code object the way the collapsed stacks show it"""
+    path = code.co_filename.replace(os.sep, "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+def stack_of(frame) -> tuple:
+    """Returns the names of the functions of a stack, from its root to the frame"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    return tuple(reversed(names))
+
+
+def collapse(stacks: Counter) -> str:
+    """Renders stacks in the collapsed format, one "root;...;leaf count" line each"""
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+def top_functions(stacks: Counter, limit: int = 20) -> list:
+    """Returns the functions with the most samples, alone and with what they call"""
+    own = Counter()
+    total = Counter()
+    for stack, count in stacks.items():
+        own[stack[-1]] += count
+        for name in set(stack):
+            total[name] += count
+    samples = sum(stacks.values()) or 1
+    return [
+        {
+            "function": name,
+            "own": own[name],
+            "total": total[name],
+            "own_pct": round(100.0 * own[name] / samples, 1),
+            "total_pct": round(100.0 * total[name] / samples, 1),
+        }
+        for name, _ in own.most_common(limit)
+    ]
+
+
+class Profiler:
+    """Profiles one request and writes what it found to the profile directory"""
+
+    def __init__(self, directory: str, interval: float = 0.001, deterministic: bool = False):
+        self.directory = directory
+        self.sampler = StackSampler(threading.get_ident(), interval)
+        self.profile = cProfile.Profile() if deterministic else None
+        self.started = None
+
+    def start(self):
+        """Starts profiling the current thread"""
+        self.started = time.perf_counter()
+        self.sampler.start()
+        if self.profile is not None:
+            self.profile.enable()
+
+    def stop(self, name: str, title: str, limit: int = 20) -> str:
+        """Stops profiling and writes the profile files, returns the name they share"""
+        if self.profile is not None:
+            self.profile.disable()
+        stacks = self.sampler.stop()
+        seconds = time.perf_counter() - self.started
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, name)
+        with open(base + ".collapsed", "w", encoding="utf-8") as collapsed:
+            collapsed.write(collapse(stacks))
+        with open(base + ".txt", "w", encoding="utf-8") as summary:
+            summary.write(f"{title}\n{seconds * 1000:.3f} ms, {sum(stacks.values())} samples\n\n")
+            summary.write(f"{'own %':>7} {'total %':>7}  function\n")
+            for row in top_functions(stacks, limit):
+                summary.write(f"{row['own_pct']:>7} {row['total_pct']:>7}  {row['function']}\n")
+            if self.profile is not None:
+                self.profile.dump_stats(base + ".prof")
+                output = io.StringIO()
+                pstats.Stats(self.profile, stream=output).sort_stats("cumulative").print_stats(limit)
+                summary.write("\n" + output.getvalue())
+        return name
+
+
+def list_profiles(directory: str) -> list:
+    """Returns the profiles in the directory, the most recent first"""
+    if not os.path.isdir(directory):
+        return []
+    files = {}
+    for entry in os.scandir(directory):
+        name, extension = os.path.splitext(entry.name)
+        if extension in EXTENSIONS:
+            files.setdefault(name, {"name": name, "files": [], "time": 0.0})
+            files[name]["files"].append(entry.name)
+            files[name]["time"] = max(files[name]["time"], entry.stat().st_mtime)
+    return sorted(files.values(), key=lambda profile: profile["time"], reverse=True)
+
+
+def prune_profiles(directory: str, keep: int):
+    """Deletes all but the most recent profiles"""
+    for profile in list_profiles(directory)[keep:]:
+        for file_name in profile["files"]:
+            try:
+                os.remove(os.path.join(directory, file_name))
+            except FileNotFoundError:
+                pass
+
+
+def has_profile_token(token: str) -> bool:
+    """Returns True when the request carries the profiling token in its header"""
+    sent = request.headers.get(PROFILE_HEADER, "")
+    return bool(token) and hmac.compare_digest(sent.encode("utf8"), token.encode("utf8"))
+
+
+def profile_wanted(app, api, exempt=None) -> bool:
+    """Returns True when the request is to an API resource and asks to be profiled or is sampled"""
+    token = app.config.get("PROFILE_TOKEN", "")
+    rate = app.config.get("PROFILE_SAMPLE_RATE", 0.0)
+    if not token and rate <= 0:
+        return False
+    if request.endpoint not in api.endpoints or request.endpoint == "specs":
+        return False
+    if exempt is not None and exempt():
+        return False
+    if has_profile_token(token):
+        return True
+    return rate > 0 and random.random() < rate
+
+
+def start_profile(app, busy: threading.Lock):
+    """Starts profiling the request, returns None and frees the lock when it cannot"""
+    try:
+        profiler = Profiler(
+            app.config.get("PROFILE_DIR", "/tmp/profiles"),
+            app.config.get("PROFILE_INTERVAL_MS", 1.0) / 1000.0,
+            app.config.get("PROFILE_MODE", "sample") == "cprofile",
+        )
+        profiler.start()
+    except Exception:  # pylint: disable=broad-except
+        busy.release()
+        app.logger.exception("Could not start the profiler")
+        return None
+    return profiler
+
+
+def finish_profile(app, profiler: Profiler, busy: threading.Lock, response):
+    """Writes the profile of the request, names it in the response and frees the lock"""
+    request_id = g.get("request_id") or f"{random.getrandbits(32):08x}"
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{request.endpoint}-{request_id}"
+    title = f"{request.method} {request.full_path.rstrip('?')} {response.status_code}"
+    try:
+        profiler.stop(name, title, app.config.get("PROFILE_TOP_FUNCTIONS", 20))
+        prune_profiles(profiler.directory, app.config.get("PROFILE_MAX_PROFILES", 100))
+    except Exception:  # pylint: disable=broad-except
+        # a profile that cannot be written must not fail the request it profiled
+        app.logger.exception("Could not write the profile of %s", title)
+        return
+    finally:
+        busy.release()
+    response.headers[PROFILE_ID_HEADER] = name
+    app.logger.info("Profiled %s as %s", title, name)
+
+
+def abandon_profile(app, profiler: Profiler, busy: threading.Lock):
+    """Stops profiling a request that failed before its response was made and frees the lock"""
+    try:
+        if profiler.profile is not None:
+            profiler.profile.disable()
+        profiler.sampler.stop()
+    except Exception:  # pylint: disable=broad-except
+        app.logger.exception("Could not stop the profiler")
+    finally:
+        busy.release()
+
+
+def init_profiling(app, api, exempt=None):
+    """
+    Profiles the requests to the API resources asking for it or sampled
+
+    Args:
+        exempt (callable): returns True for requests that are never profiled
+    """
+    # one profile at a time per worker, so a high sample rate cannot slow every request
+    busy = threading.Lock()
+
+    @app.before_request
+    def begin_profile():
+        if profile_wanted(app, api, exempt) and busy.acquire(blocking=False):  # pylint: disable=consider-using-with
+            request.environ[PROFILER_ENVIRON] = start_profile(app, busy)
+
+    @app.after_request
+    def end_profile(response):
+        profiler = request.environ.pop(PROFILER_ENVIRON, None)
+        if profiler is not None:
+            finish_profile(app, profiler, busy, response)
+        return response
+
+    @app.teardown_request
+    def release_profile(error=None):  # pylint: disable=unused-argument
+        # a request that failed before its response was made still frees the profiler
+        profiler = request.environ.pop(PROFILER_ENVIRON, None)
+        if profiler is not None:
+            abandon_profile(app, profiler, busy)
@@ -0,0 +1,161 @@
+"""
+Read Replica Routing
+
+This module contains the router that spreads read-only queries across the
+read replicas and remembers which clients have written recently so that
+they keep reading their own writes from the primary. A client that wrote is
+also sent a signed last-write token, as a cookie and a header, so that the
+other workers and pods keep it on the primary too when it sends it back.
+"""
+import itertools
+import logging
+import math
+import threading
+import time
+
+from flask import g, has_request_context, request
+from itsdangerous import BadSignature, TimestampSigner
+from sqlalchemy import create_engine, event
+
+logger = logging.getLogger("flask.app")
+
+# Key used for writes that do not come from an HTTP request (CLI, tests)
+LOCAL_CLIENT = "__local__"
+
+# Environ key that carries the client of a request into its sub-requests
+CLIENT_ENVIRON = "service.client"
+
+# Environ key of the replica the reads of a request go to
+REPLICA_ENVIRON = "service.replica"
+
+# Cookie and header that carry the signed time of a client's last write
+LAST_WRITE_COOKIE = "last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+
+
+def client_key() -> str:
+    """Returns the key that identifies the client of the current request"""
+    if not has_request_context():
+        return LOCAL_CLIENT
+    return (
+        request.environ.get(CLIENT_ENVIRON)
+        or request.headers.get("X-Client-ID")
+        or request.remote_addr
+        or LOCAL_CLIENT
+    )
+
+
+class ReplicaRouter:  # pylint: disable=too-many-instance-attributes
+    """Round-robin router over the read replicas"""
+
+    def __init__(self, uris, engine_options=None, sticky_seconds=5.0, retry_seconds=30.0, secret=None):
+        """
+        Args:
+            secret (str): key that signs the last-write tokens, None to only
+                remember the writes in this process
+        """
+        self.engines = [create_engine(uri, **(engine_options or {})) for uri in uris]
+        self.sticky_seconds = sticky_seconds
+        self.signer = TimestampSigner(secret, salt="last-write") if secret else None
+        self.retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._next = itertools.cycle(range(len(self.engines)))
+        self._down_until = {}
+        self._last_write = {}
+        for engine in self.engines:
+            event.listen(engine, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        """Takes a replica out of rotation when it cannot be reached"""
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    def mark_down(self, engine):
+        """Stops routing reads to a replica until the retry interval passes"""
+        logger.warning("Read replica %s is unhealthy", engine.url.render_as_string())
+        with self._lock:
+            self._down_until[engine] = time.monotonic() + self.retry_seconds
+
+    def healthy(self, engine) -> bool:
+        """Returns True if the replica is in rotation"""
+        return self._down_until.get(engine, 0.0) <= time.monotonic()
+
+    def choose(self):
+        """Returns the next healthy replica engine or None if there are none"""
+        with self._lock:
+            for _ in range(len(self.engines)):
+                engine = self.engines[next(self._next)]
+                if self.healthy(engine):
+                    return engine
+        return None
+
+    def note_write(self, client: str):
+        """Records that a client has just written to the primary"""
+        if has_request_context():
+            g.replica_write = True
+        with self._lock:
+            now = time.monotonic()
+            self._last_write[client] = now
+            # forget the clients that are past the window so this stays small
+            if len(self._last_write) > 10000:
+                self._last_write = {
+                    key: when
+                    for key, when in self._last_write.items()
+                    if now - when < self.sticky_seconds
+                }
+
+    def is_sticky(self, client: str) -> bool:
+        """Returns True if the client wrote within the stickiness window"""
+        last_write = self._last_write.get(client)
+        if last_write is not None and time.monotonic() - last_write < self.sticky_seconds:
+            return True
+        return self.wrote_elsewhere()
+
+    def wrote_elsewhere(self) -> bool:
+        """Returns True if the request carries a last-write token from any worker that is still fresh"""
+        if self.signer is None or not has_request_context():
+            return False
+        token = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+        if not token:
+            return False
+        try:
+            self.signer.unsign(token, max_age=self.sticky_seconds)
+        except BadSignature:
+            return False
+        return True
+
+    def last_write_token(self) -> str:
+        """Returns a signed token of the current time for a client that just wrote"""
+        return self.signer.sign(b"w").decode()
+
+    def status(self) -> list:
+        """Returns the health of every replica"""
+        return [
+            {"url": engine.url.render_as_string(), "healthy": self.healthy(engine)}
+            for engine in self.engines
+        ]
+
+    def dispose(self):
+        """Closes all of the replica connections"""
+        for engine in self.engines:
+            engine.dispose()
+
+
+def init_last_write(app):
+    """Sends the last-write token to the clients whose request wrote to the primary"""
+
+    @app.before_request
+    def clear_last_write():
+        g.replica_write = False
+
+    @app.after_request
+    def send_last_write(response):
+        router = app.extensions.get("replica_router")
+        if router is None or router.signer is None or not g.pop("replica_write", False):
+            return response
+        token = router.last_write_token()
+        response.headers[LAST_WRITE_HEADER] = token
+        response.set_cookie(
+            LAST_WRITE_COOKIE, token, max_age=math.ceil(router.sticky_seconds), httponly=True, samesite="Lax"
+        )
+        return response
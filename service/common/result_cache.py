@@ -0,0 +1,82 @@
+"""
+Result Cache
+
+This module keeps the response bodies of recent list queries, already
+serialized, so a repeated listing is answered without running the query or
+the serialization again. Every entry is stored with the version of the data
+it was built from and is only served while the data is still at that version,
+so a write anywhere invalidates every listing at once.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Remembers response bodies by key for as long as the data version holds"""
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024, ttl=60.0):
+        """
+        Args:
+            max_entries (int): the most bodies kept, the least recently used go first
+            max_bytes (int): the most bytes of bodies kept
+            ttl (float): seconds a body is kept at most, even if the version holds
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        """Returns the body, media type and headers stored for key at version, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or time.monotonic() - entry[1] > self.ttl:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2:]
+
+    def put(self, key, version, body: bytes, mimetype: str, headers=None):
+        """Stores the body of key built from the data at version"""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, time.monotonic(), body, mimetype, dict(headers or {}))
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        """Forgets a key, the lock must be held"""
+        self._bytes -= len(self._entries.pop(key)[2])
+
+    def clear(self):
+        """Forgets every body"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Returns the size of the cache and its hit rate"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,78 @@
+"""
+Single Flight
+
+This module contains a request coalescer: when several threads ask for the
+same key at the same time only the first one runs the call and the others
+wait for its result instead of issuing the same query again. A waiter only
+waits for as long as its own deadline allows.
+"""
+import threading
+import time
+
+from .deadlines import DeadlineExceeded
+
+
+class _Call:  # pylint: disable=too-few-public-methods
+    """A call that is in flight"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Shares one in-flight call among concurrent callers with the same key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, timeout=None, retry_on=()):
+        """
+        Runs func once for all of the concurrent callers with the same key
+
+        Returns a tuple of the result and whether it was shared with a call
+        made by another thread. The result is handed to every waiting caller
+        so it must not be modified.
+
+        Args:
+            timeout (float): seconds a caller waits for another thread's call
+                before it raises DeadlineExceeded, None waits until it is done
+            retry_on (tuple): errors of another thread's call that are its own,
+                such as its deadline, so the waiters run the call again instead
+        """
+        until = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                return self._lead(key, call, func), False
+            left = None if until is None else until - time.monotonic()
+            if (left is not None and left <= 0) or not call.done.wait(left):
+                raise DeadlineExceeded("Request deadline exceeded while waiting for a shared read")
+            if call.error is None:
+                return call.result, True
+            if not isinstance(call.error, retry_on):
+                raise call.error
+
+    def _lead(self, key, call, func):
+        """Runs the call for every caller with the key"""
+        try:
+            call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        """Returns the number of calls currently in flight"""
+        with self._lock:
+            return len(self._calls)
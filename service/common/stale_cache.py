@@ -0,0 +1,81 @@
+"""
+Stale Cache
+
+This module keeps the last representation of every recently read resource
+so that reads can still be answered, marked as stale, while the database is
+unavailable. The values are kept JSON encoded, which is compact and gives
+their size, and the cache is bounded in entries and in bytes.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class StaleCache:
+    """Remembers the last known value of each key"""
+
+    def __init__(self, max_size=10000, max_bytes=64 * 1024 * 1024):
+        """
+        Args:
+            max_size (int): the most values remembered, the least recently used go first
+            max_bytes (int): the most bytes of encoded values remembered
+        """
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+        self._bytes = 0
+        self.served = 0
+        self.evictions = 0
+
+    def put(self, key, value):
+        """Remembers the latest value of a key"""
+        encoded = json.dumps(value, default=str).encode("utf8")
+        with self._lock:
+            if key in self._values:
+                self._remove(key)
+            if len(encoded) > self.max_bytes:
+                return
+            self._values[key] = (encoded, time.monotonic())
+            self._bytes += len(encoded)
+            while len(self._values) > self.max_size or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._values)))
+                self.evictions += 1
+
+    def get(self, key):
+        """Returns the last known value of a key and its age in seconds, or None"""
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            self._values.move_to_end(key)
+            self.served += 1
+        encoded, stored_at = entry
+        return json.loads(encoded), time.monotonic() - stored_at
+
+    def _remove(self, key):
+        """Forgets a key, the lock must be held"""
+        self._bytes -= len(self._values.pop(key)[0])
+
+    def discard(self, key):
+        """Forgets a key, used when the resource is deleted"""
+        with self._lock:
+            if key in self._values:
+                self._remove(key)
+
+    def clear(self):
+        """Forgets every value"""
+        with self._lock:
+            self._values.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Returns the size of the cache and how many stale values were served"""
+        with self._lock:
+            return {
+                "size": len(self._values),
+                "bytes": self._bytes,
+                "served": self.served,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,110 @@
+"""
+Static Assets
+
+This module serves the OpenAPI spec and the static files from memory. Each
+asset is read (or, for the spec, rendered) and compressed once per process,
+then served with an ETag, Cache-Control and the best content coding the
+client accepts, so repeated fetches cost neither rendering nor compression.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+from flask import Response, abort, request
+from werkzeug.security import safe_join
+
+from . import compression, status
+
+
+class Asset:  # pylint: disable=too-few-public-methods
+    """An asset body with its compressed variants and validator"""
+
+    def __init__(self, body: bytes, mimetype: str):
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {None: body}
+        if mimetype.startswith(compression.COMPRESSIBLE):
+            for encoding in compression.encodings():
+                compressed = compression.compress(body, encoding)
+                if len(compressed) < len(body):
+                    self.bodies[encoding] = compressed
+
+
+class AssetCache:
+    """Builds every asset once and serves it with conditional and cache headers"""
+
+    def __init__(self, max_age=3600):
+        """
+        Args:
+            max_age (int): seconds clients and proxies may cache the assets
+        """
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._assets = {}
+
+    def get(self, key, build) -> Asset:
+        """Returns the asset of a key, build() returns its body and media type"""
+        asset = self._assets.get(key)
+        if asset is None:
+            with self._lock:
+                asset = self._assets.get(key)
+                if asset is None:
+                    asset = self._assets[key] = Asset(*build())
+        return asset
+
+    def respond(self, asset: Asset) -> Response:
+        """Returns the response of an asset for the current request"""
+        offered = [encoding for encoding in asset.bodies if encoding is not None]
+        encoding = compression.negotiate(request.accept_encodings, offered)
+        response = Response(asset.bodies[encoding], mimetype=asset.mimetype)
+        # each coding is a different representation so it gets its own validator
+        response.set_etag(f"{asset.etag}-{encoding}" if encoding else asset.etag)
+        response.headers["Cache-Control"] = f"public, max-age={self.max_age}"
+        response.vary.add("Accept-Encoding")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response.make_conditional(request)
+
+    def send_static(self, folder: str, filename: str) -> Response:
+        """Serves a file of a folder"""
+        path = safe_join(folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(status.HTTP_404_NOT_FOUND)
+
+        def build():
+            with open(path, "rb") as file:
+                body = file.read()
+            return body, mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+        return self.respond(self.get(("static", path), build))
+
+
+def init_static_assets(app, api) -> AssetCache:
+    """Serves the OpenAPI spec and the static folder from the asset cache"""
+    assets = AssetCache(max_age=app.config.get("STATIC_CACHE_SECONDS", 3600))
+    app.extensions["static_assets"] = assets
+
+    def build_spec():
+        schema = api.__schema__
+        if "error" in schema:
+            raise RuntimeError(schema["error"])
+        return json.dumps(schema, separators=(",", ":")).encode("utf-8"), "application/json"
+
+    def serve_spec():
+        return assets.respond(assets.get("specs", build_spec))
+
+    def serve_static(filename):
+        return assets.send_static(app.static_folder, filename)
+
+    app.view_functions[api.endpoint("specs")] = serve_spec
+    app.view_functions["static"] = serve_static
+
+    # the Swagger UI files of flask-restx are served the same way
+    swagger_ui = app.blueprints.get("restx_doc")
+    if swagger_ui is not None and "restx_doc.static" in app.view_functions:
+        app.view_functions["restx_doc.static"] = lambda filename: assets.send_static(
+            swagger_ui.static_folder, filename
+        )
+    return assets
@@ -0,0 +1,78 @@
+"""
+Warm-up
+
+This module runs the warm-up of a worker when it starts: it opens the pool
+connections, gets the hot statements compiled and primes the caches, in the
+background so the worker is up right away. The service reports itself as
+not ready until the warm-up is over, so it is only sent traffic once its
+first requests no longer pay for a cold start.
+"""
+import logging
+import threading
+import time
+
+from service.models import db
+
+logger = logging.getLogger("flask.app")
+
+
+class Warmup:
+    """Runs the warm-up steps once and keeps how each one went"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.state = "pending"
+        self.seconds = None
+        self.steps = {}
+
+    @property
+    def ready(self) -> bool:
+        """True once the warm-up is over, even if a step failed"""
+        return self._done.is_set()
+
+    def wait(self, timeout=None) -> bool:
+        """Waits for the warm-up to be over, returns True if it is"""
+        return self._done.wait(timeout)
+
+    def start(self, app, steps: list):
+        """Runs the steps, a list of (name, callable), in a background thread"""
+        self.state = "running"
+        threading.Thread(target=self.run, args=(app, steps), name="warm-up", daemon=True).start()
+
+    def run(self, app, steps: list):
+        """Runs the steps in an application context, a failed step does not stop the others"""
+        start = time.monotonic()
+        self.state = "running"
+        try:
+            for name, step in steps:
+                step_start = time.monotonic()
+                with app.app_context():
+                    try:
+                        result = step()
+                        self.steps[name] = {"seconds": round(time.monotonic() - step_start, 3), "result": result}
+                    except Exception as error:  # pylint: disable=broad-except
+                        # a cold worker is still better than one that never gets ready
+                        logger.warning("Warm-up step %s failed: %s", name, error)
+                        self.steps[name] = {"seconds": round(time.monotonic() - step_start, 3), "error": str(error)}
+                    finally:
+                        db.session.remove()
+        finally:
+            self.seconds = round(time.monotonic() - start, 3)
+            self.state = "done"
+            self._done.set()
+            logger.info("Warm-up done in %.3fs", self.seconds)
+
+    def status(self) -> dict:
+        """Returns the state of the warm-up and the outcome of each step"""
+        return {"state": self.state, "seconds": self.seconds, "steps": dict(self.steps)}
+
+
+def init_warmup(app, steps: list) -> Warmup:
+    """Starts the warm-up of the worker, it is ready right away when it is disabled"""
+    warmup = Warmup()
+    app.extensions["warmup"] = warmup
+    if not app.config.get("WARMUP_ENABLED", True):
+        warmup.run(app, [])
+    else:
+        warmup.start(app, steps)
+    return warmup
@@ -0,0 +1,86 @@
+# pylint: disable=cyclic-import
+"""
+Health Routes
+
+The liveness and readiness probes of a worker
+"""
+from flask import Blueprint, jsonify
+
+from service.models import db
+from .common import status
+from .common.db_pool import pool_status, recent_wait
+from .common.deadlines import time_limit
+from .common.health import HealthCheck
+from .routes import DATABASE_UNAVAILABLE, stale_cache
+
+# Import Flask application
+from . import app
+
+blueprint = Blueprint("health", __name__)
+
+
+def check_warmup() -> dict:
+    """Ready once the worker is warmed up"""
+    warmup = app.extensions.get("warmup")
+    return {"ok": warmup is None or warmup.ready, "state": warmup.state if warmup else "done"}
+
+
+def check_database() -> dict:
+    """Ready when the primary database answers, or degraded while stale reads can be served"""
+    timeout = app.config.get("HEALTH_CHECK_TIMEOUT_SECONDS", 1.0)
+    try:
+        # fails fast while the circuit is open, and lets the probe be the trial call after it
+        app.extensions["circuit_breaker"].allow()
+        # the pool checkout and the statement give up after the timeout
+        with time_limit(timeout), db.engine.begin() as connection:
+            if connection.dialect.name == "postgresql":
+                connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(int(timeout * 1000), 1)}")
+            connection.exec_driver_sql("SELECT 1")
+    except DATABASE_UNAVAILABLE as error:
+        # a worker holding last known customers keeps answering reads with them,
+        # which it can only do while the load balancer still sends it requests
+        stale = stale_cache.stats()["size"]
+        if not stale or not app.config.get("HEALTH_READY_WHEN_DEGRADED", True):
+            raise
+        return {"ok": True, "degraded": True, "error": f"{type(error).__name__}: {error}", "stale_entries": stale}
+    return {"ok": True}
+
+
+def check_pool() -> dict:
+    """Ready unless every pool connection is in use and requests queue for them"""
+    stats = pool_status(db.engine)
+    if "size" not in stats:
+        return {"ok": True, "pool_class": stats["pool_class"]}
+    capacity = stats["size"] + max(stats["max_overflow"], 0)
+    headroom = capacity - stats["checked_out"]
+    wait = recent_wait(db.engine)
+    return {
+        "ok": headroom > 0 or wait < app.config.get("HEALTH_MAX_POOL_WAIT", 1.0),
+        "headroom": headroom,
+        "capacity": capacity,
+        "recent_wait_ms": round(wait * 1000, 3),
+    }
+
+
+readiness = HealthCheck(
+    [("warmup", check_warmup), ("pool", check_pool), ("database", check_database)],
+    ttl=app.config.get("HEALTH_CHECK_CACHE_SECONDS", 2.0),
+)
+
+
+@blueprint.route("/health/live")
+def health_live():
+    """Liveness, the worker is up and answering"""
+    return jsonify({"status": "OK"}), status.HTTP_200_OK
+
+
+@blueprint.route("/health/ready")
+@blueprint.route("/health")
+def health():
+    """Readiness, the worker is warmed up and its database is reachable"""
+    result = readiness.status()
+    if not result["ok"]:
+        return jsonify(dict(result, status="Unavailable")), status.HTTP_503_SERVICE_UNAVAILABLE
+    if any(check.get("degraded") for check in result["checks"].values()):
+        return jsonify(dict(result, status="Degraded")), status.HTTP_200_OK
+    return jsonify(dict(result, status="OK")), status.HTTP_200_OK
@@ -3,22 +3,190 @@ Models for Customer
 All of the models are stored in this module
 """
 import logging
+import re
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
 
-from flask_sqlalchemy import SQLAlchemy
+from flask import has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import bindparam, event, or_, orm, select, text, update
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import IntegrityError, InterfaceError, OperationalError
+from sqlalchemy.sql import Select
+
+from service.common.circuit_breaker import CircuitBreaker, CircuitOpen, watch_engine
+from service.common.db_pool import TimedQueuePool
+from service.common.duplicates import blocking_key
+from service.common.log_handlers import lazy
+from service.common.replicas import REPLICA_ENVIRON, ReplicaRouter, client_key
 
 logger = logging.getLogger("flask.app")
 
+# Most words of a search query that are used
+MAX_SEARCH_TERMS = 8
+
+# The weighted document searched on Postgres, names rank above the address
+POSTGRES_SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(f_name, '') || ' ' || coalesce(l_name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(street, '') || ' ' || coalesce(city, '') || ' ' || "
+    "coalesce(state, '') || ' ' || coalesce(postalcode, '')), 'B')"
+)
+# Built by flask create-search-index, CONCURRENTLY so writes go on during the build
+POSTGRES_SEARCH_INDEX = (
+    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_customer_search ON customer USING gin (({POSTGRES_SEARCH_VECTOR}))"
+)
+# Whether the index is usable, None when it does not exist and false after a failed build
+POSTGRES_SEARCH_INDEX_VALID = (
+    "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+    "WHERE c.relname = 'ix_customer_search'"
+)
+POSTGRES_SEARCH = (
+    f"SELECT customer.* FROM customer, to_tsquery('simple', :match) AS query "
+    f"WHERE ({POSTGRES_SEARCH_VECTOR}) @@ query "
+    f"ORDER BY ts_rank({POSTGRES_SEARCH_VECTOR}, query) DESC, customer.id "
+    f"LIMIT :limit OFFSET :offset"
+)
+
+# SQLite keeps an FTS5 index of the customer table with prefix indexes for short words
+SEARCH_COLUMNS = "f_name, l_name, street, city, state, postalcode"
+SQLITE_SEARCH_TABLE = (
+    f"CREATE VIRTUAL TABLE customer_search USING fts5({SEARCH_COLUMNS}, "
+    f"content='customer', content_rowid='id', prefix='2 3')"
+)
+SQLITE_SEARCH_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS customer_search_insert AFTER INSERT ON customer BEGIN "
+    f"INSERT INTO customer_search(rowid, {SEARCH_COLUMNS}) "
+    f"VALUES (new.id, new.f_name, new.l_name, new.street, new.city, new.state, new.postalcode); END",
+    f"CREATE TRIGGER IF NOT EXISTS customer_search_delete AFTER DELETE ON customer BEGIN "
+    f"INSERT INTO customer_search(customer_search, rowid, {SEARCH_COLUMNS}) "
+    f"VALUES ('delete', old.id, old.f_name, old.l_name, old.street, old.city, old.state, old.postalcode); END",
+    f"CREATE TRIGGER IF NOT EXISTS customer_search_update AFTER UPDATE ON customer BEGIN "
+    f"INSERT INTO customer_search(customer_search, rowid, {SEARCH_COLUMNS}) "
+    f"VALUES ('delete', old.id, old.f_name, old.l_name, old.street, old.city, old.state, old.postalcode); "
+    f"INSERT INTO customer_search(rowid, {SEARCH_COLUMNS}) "
+    f"VALUES (new.id, new.f_name, new.l_name, new.street, new.city, new.state, new.postalcode); END",
+]
+# bm25 weights of the columns, names rank above the address
+SQLITE_SEARCH = (
+    "SELECT customer.* FROM customer_search JOIN customer ON customer.id = customer_search.rowid "
+    "WHERE customer_search MATCH :match "
+    "ORDER BY bm25(customer_search, 10.0, 10.0, 1.0, 1.0, 1.0, 1.0), customer.id "
+    "LIMIT :limit OFFSET :offset"
+)
+
+
+def search_terms(query: str) -> list:
+    """Splits a search query into lowercase words that are safe to put in a match expression"""
+    return re.findall(r"\w+", (query or "").lower())[:MAX_SEARCH_TERMS]
+
+
+# Only one request at a time retries creating the tables in degraded mode
+_create_tables_lock = threading.Lock()
+
+
+# its interface is the one of the Session, it only overrides how a bind is chosen
+class RoutingSession(SignallingSession):  # pylint: disable=too-few-public-methods
+    """
+    Session that sends read-only queries to the read replicas and everything
+    else to the primary database
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):  # pylint: disable=arguments-differ
+        if kwargs.get("bind") is not None:
+            return kwargs["bind"]
+        replica = self._choose_replica(clause)
+        if replica is not None:
+            return replica
+        # fail fast instead of waiting on a primary that is known to be down
+        breaker = self.app.extensions.get("circuit_breaker")
+        if breaker is not None:
+            breaker.allow()
+        return super().get_bind(mapper, clause)
+
+    def _choose_replica(self, clause):
+        """Returns the replica engine a statement can be sent to or None"""
+        router = self.app.extensions.get("replica_router")
+        if router is None:
+            return None
+
+        # SQLAlchemy has no public getter for the FOR UPDATE of a Select
+        for_update = isinstance(clause, Select) and clause._for_update_arg is not None  # pylint: disable=protected-access
+        if self._flushing or not isinstance(clause, Select) or for_update:
+            if self._flushing:
+                router.note_write(client_key())
+            return None
+
+        # reads that follow pending or recent writes must see them
+        if self.new or self.dirty or self.deleted or router.is_sticky(client_key()):
+            return None
+
+        return self._pinned_replica(router)
+
+    def _pinned_replica(self, router):
+        """Returns the one replica the reads of the request, or of the session outside of one, go to"""
+        # replicas lag by different amounts, so the reads that answer one request
+        # (a cache version and the listing it guards) must come from the same one
+        pins = request.environ if has_request_context() else self.info
+        replica = pins.get(REPLICA_ENVIRON)
+        if replica is None or not router.healthy(replica):
+            replica = pins[REPLICA_ENVIRON] = router.choose()
+        return replica
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension that uses the RoutingSession"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
-def init_db(app):
-    """Initialize the SQLAlchemy app"""
-    Customer.init_db(app)
+def init_db(app) -> bool:
+    """Initialize the SQLAlchemy app, returns False if the database is unavailable"""
+    return Customer.init_db(app)
+
+
+def in_batch() -> bool:
+    """Returns True while a batch request holds the transaction open"""
+    return bool(db.session.info.get("batch"))
+
+
+def commit():
+    """Commits the session, or only flushes it when a batch commits once at its end"""
+    if in_batch():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def engine_options(config) -> dict:
+    """Builds the SQLAlchemy engine options from the pool configuration"""
+    options = {
+        "pool_pre_ping": config.get("DB_POOL_PRE_PING", True),
+        "pool_recycle": config.get("DB_POOL_RECYCLE", -1),
+    }
+    # SQLite connections are not shared between threads so leave its pool alone
+    if make_url(config["SQLALCHEMY_DATABASE_URI"]).get_backend_name() != "sqlite":
+        options.update(
+            {
+                "poolclass": TimedQueuePool,
+                "pool_size": config.get("DB_POOL_SIZE", 5),
+                "max_overflow": config.get("DB_MAX_OVERFLOW", 10),
+                "pool_timeout": config.get("DB_POOL_TIMEOUT", 30),
+                # an unreachable host fails the connect instead of hanging the request or probe
+                "connect_args": {"connect_timeout": config.get("DB_CONNECT_TIMEOUT", 5)},
+            }
+        )
+    return options
 
 
 ######################################################################
@@ -37,30 +205,101 @@ class PersistentBase:
         logger.info("Creating %s %s", self.f_name, self.l_name)
         self.id = None  # id must be none to generate next primary key
         db.session.add(self)
-        db.session.commit()
+        db.session.flush()  # assigns the id that the change log refers to
+        self.record_change("create")
+        commit()
 
-    def update(self):
+    def update(self, operation: str = "update"):
         """
         Updates a Customer to the database
         """
-        logger.info("Updating %s", self.__str__)
-        db.session.commit()
+        logger.info("Updating %s", lazy(repr, self))
+        self.record_change(operation)
+        commit()
 
     def delete(self):
         """Removes a Customer from the data store"""
-        logger.info("Deleting %s", self.__str__)
+        logger.info("Deleting %s", lazy(repr, self))
+        self.record_change("delete")
         db.session.delete(self)
-        db.session.commit()
+        commit()
+
+    def record_change(self, operation: str):
+        """Appends the change to the change log in the current transaction"""
+        db.session.add(
+            CustomerChange(
+                customer_id=self.id, operation=operation, data=self.serialize()
+            )
+        )
+        db.session.info["changes"] = True
 
     @classmethod
     def init_db(cls, app):
         """Initializes the database session"""
         logger.info("Initializing database")
         cls.app = app
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        cls.init_replicas(app)
+        cls.init_breaker(app)
+        return cls.create_tables(app)
+
+    @classmethod
+    def init_breaker(cls, app):
+        """Puts a circuit breaker around the primary database"""
+        breaker = CircuitBreaker(
+            failure_threshold=app.config.get("CIRCUIT_BREAKER_FAILURES", 5),
+            reset_timeout=app.config.get("CIRCUIT_BREAKER_RESET_SECONDS", 10.0),
+        )
+        watch_engine(db.get_engine(app), breaker)
+        app.extensions["circuit_breaker"] = breaker
+        app.extensions["db_ready"] = False
+
+    @classmethod
+    def create_tables(cls, app) -> bool:
+        """
+        Creates the tables, returns False when the database is unavailable
+
+        The service keeps running in degraded mode until a later call succeeds
+        """
+        with _create_tables_lock:
+            if app.extensions.get("db_ready"):
+                return True
+            breaker = app.extensions["circuit_breaker"]
+            try:
+                breaker.allow()
+                db.create_all()  # make our sqlalchemy tables
+                ChangeCounter.init_counter()
+                Customer.init_search()
+            except CircuitOpen:
+                return False
+            except (OperationalError, InterfaceError) as error:
+                logger.critical("%s: the database is unavailable, running degraded", error)
+                breaker.trip()
+                return False
+            app.extensions["db_ready"] = True
+            return True
+
+    @classmethod
+    def init_replicas(cls, app):
+        """Sets up the router for the read replicas if any are configured"""
+        router = app.extensions.pop("replica_router", None)
+        if router:
+            router.dispose()
+        uris = app.config.get("DATABASE_REPLICA_URIS")
+        if not uris:
+            return
+        logger.info("Routing reads to %d replicas", len(uris))
+        options = engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI=uris[0]))
+        app.extensions["replica_router"] = ReplicaRouter(
+            uris,
+            options,
+            sticky_seconds=app.config.get("DATABASE_REPLICA_STICKY_SECONDS", 5.0),
+            retry_seconds=app.config.get("DATABASE_REPLICA_RETRY_SECONDS", 30.0),
+            secret=app.config.get("SECRET_KEY"),
+        )
 
     @classmethod
     def all(cls):
@@ -159,6 +398,165 @@ class Customer(db.Model, PersistentBase):
         """
         self.active = True
 
+    @classmethod
+    def create_many(cls, customers: list):
+        """
+        Creates many Customers with one multi-row INSERT in the current transaction
+
+        The change log rows are added with them and the id of each Customer is set
+        """
+        if not customers:
+            return
+        logger.info("Creating %d customers", len(customers))
+        rows = [
+            {
+                "f_name": customer.f_name,
+                "l_name": customer.l_name,
+                "active": True if customer.active is None else customer.active,
+                "name": customer.name,
+                "street": customer.street,
+                "city": customer.city,
+                "state": customer.state,
+                "postalcode": customer.postalcode,
+            }
+            for customer in customers
+        ]
+        connection = db.session.connection()
+        if connection.dialect.name == "postgresql":
+            # the ids are drawn first so that each row is known to get its own
+            ids = db.session.execute(
+                text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+                {"table": cls.__table__.name, "count": len(rows)},
+            ).scalars().all()
+            for row, customer_id in zip(rows, ids):
+                row["id"] = customer_id
+            db.session.execute(cls.__table__.insert().values(rows))
+        else:
+            result = db.session.execute(cls.__table__.insert().values(rows))
+            # SQLite gives the rows of one INSERT consecutive rowids
+            ids = range(result.lastrowid - len(rows) + 1, result.lastrowid + 1)
+        for customer, customer_id in zip(customers, ids):
+            customer.id = customer_id
+        db.session.execute(
+            CustomerChange.__table__.insert(),
+            [
+                {"customer_id": customer.id, "operation": "create", "data": customer.serialize()}
+                for customer in customers
+            ],
+        )
+        db.session.info["changes"] = True
+
+    @classmethod
+    def id_snapshot(cls, batch_size: int = 10000):
+        """Returns the largest id, the number of rows and an iterator of the ids
+
+        The ids are streamed in batches so the whole table is never in memory
+        """
+        logger.info("Processing id snapshot ...")
+        max_id, count = db.session.query(db.func.max(cls.id), db.func.count(cls.id)).one()
+        ids = (
+            row.id
+            for row in db.session.query(cls.id).filter(cls.id <= (max_id or 0)).yield_per(batch_size)
+        )
+        return max_id, count, ids
+
+    @classmethod
+    def duplicate_rows(cls, batch_size: int = 10000):
+        """Streams the (id, first name, last name, street, postal code) of every
+        Customer ordered by the blocking key of its postal code for the
+        duplicate detection, so the rows of a block come one after the other
+        """
+        logger.info("Processing rows for duplicate detection ...")
+        dialect = db.engine.dialect.name
+        if dialect == "postgresql":
+            key = db.func.lower(db.func.regexp_replace(db.func.coalesce(cls.postalcode, ""), "[^A-Za-z0-9]", "", "g"))
+        elif dialect == "sqlite":
+            key = db.func.blocking_key(cls.postalcode)
+        else:
+            key = cls.postalcode
+        query = db.session.query(cls.id, cls.f_name, cls.l_name, cls.street, cls.postalcode)
+        return (tuple(row) for row in query.order_by(key, cls.id).yield_per(batch_size))
+
+    ##################################################
+    # Search
+    ##################################################
+
+    @classmethod
+    def init_search(cls, rebuild: bool = False):
+        """Creates the full-text search index if the database supports one
+
+        Postgres uses a GIN index on a tsvector expression, which is only
+        checked here since it is built by create_search_index, and SQLite an
+        FTS5 table kept in sync by triggers
+        """
+        dialect = db.engine.dialect.name
+        if dialect == "postgresql":
+            if not db.session.execute(text(POSTGRES_SEARCH_INDEX_VALID)).scalar():
+                logger.warning("The customer search index is not built, run flask create-search-index")
+        elif dialect == "sqlite":
+            exists = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'customer_search'")
+            ).first()
+            if not exists:
+                db.session.execute(text(SQLITE_SEARCH_TABLE))
+                rebuild = True
+            for trigger in SQLITE_SEARCH_TRIGGERS:
+                db.session.execute(text(trigger))
+            if rebuild:
+                logger.info("Rebuilding the customer search index")
+                db.session.execute(text("INSERT INTO customer_search(customer_search) VALUES ('rebuild')"))
+        db.session.commit()
+
+    @classmethod
+    def create_search_index(cls) -> bool:
+        """Builds the Postgres search index without blocking the writes to the table
+
+        CREATE INDEX CONCURRENTLY cannot run in a transaction so it runs on an
+        autocommit connection, after dropping the invalid index a failed build
+        leaves behind. Returns False on the databases that do not use it
+        """
+        if db.engine.dialect.name != "postgresql":
+            return False
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            if connection.execute(text(POSTGRES_SEARCH_INDEX_VALID)).scalar() is False:
+                logger.warning("Dropping the invalid customer search index of a failed build")
+                connection.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_customer_search"))
+            logger.info("Building the customer search index")
+            connection.execute(text(POSTGRES_SEARCH_INDEX))
+        return True
+
+    @classmethod
+    def search(cls, query: str, limit: int = 20, offset: int = 0):
+        """Returns the Customers matching every word of the query, best matches first
+
+        Each word matches the start of a word in the name or the address
+        Args:
+            query (string): the words to search for
+            limit (int): the most Customers to return
+            offset (int): the number of best matches to skip
+        """
+        logger.info("Processing search for %s ...", query)
+        terms = search_terms(query)
+        if not terms:
+            return []
+        dialect = db.engine.dialect.name
+        if dialect == "postgresql":
+            statement, match = POSTGRES_SEARCH, " & ".join(f"{term}:*" for term in terms)
+        elif dialect == "sqlite":
+            statement, match = SQLITE_SEARCH, " ".join(f'"{term}"*' for term in terms)
+        else:
+            return cls._search_like(terms, limit, offset)
+        return cls.query.from_statement(text(statement)).params(
+            match=match, limit=limit, offset=offset
+        ).all()
+
+    @classmethod
+    def _search_like(cls, terms, limit, offset):
+        """Searches with LIKE on databases without a full-text index"""
+        columns = [cls.f_name, cls.l_name, cls.street, cls.city, cls.state, cls.postalcode]
+        criteria = [or_(*[column.ilike(f"{term}%") for column in columns]) for term in terms]
+        return cls.query.filter(*criteria).order_by(cls.id).limit(limit).offset(offset).all()
+
     @classmethod
     def find_by_name(cls, f_name, l_name):
         """Returns all Customers with the given first_name and last_name
@@ -182,3 +580,327 @@ class Customer(db.Model, PersistentBase):
         """
         logger.info("Processing activity query for %s ...", active)
         return cls.query.filter(cls.active == active)
+
+    @classmethod
+    def rows(cls, active: bool = None) -> list:
+        """Returns all Customers as read-only CustomerRows, or only those with an activity
+
+        The rows are read with a Core select, so unlike Customer.all() no
+        instance is built, tracked or kept in the identity map. Use it where
+        the Customers are only serialized.
+        """
+        logger.info("Processing row query for %s ...", active)
+        return [CustomerRow._make(row) for row in db.session.execute(cls._rows_statement(active))]
+
+    @classmethod
+    def _rows_statement(cls, active: bool = None):
+        """Returns the select of rows()"""
+        statement = select(*(cls.__table__.c[column] for column in CustomerRow._fields))
+        if active is not None:
+            statement = statement.where(cls.__table__.c.active == active)
+        return statement
+
+    @classmethod
+    def warm_statements(cls):
+        """
+        Runs the hot queries once so that SQLAlchemy compiles and caches their SQL
+
+        Lookups are made for an id and a name that match nothing and listings
+        are streamed and closed after their first row. The cached SQL is reused
+        whatever the parameters of the later calls, except for the activity
+        that is part of the SQL so both are warmed.
+        """
+        cls.find(0)
+        cls.find_by_name("", "").all()
+        for active in (True, False):
+            rows = iter(cls.find_by_activity(active).execution_options(stream_results=True))
+            next(rows, None)
+            rows.close()
+        for active in (None, True, False):
+            db.session.execute(cls._rows_statement(active), execution_options={"stream_results": True}).close()
+        CustomerChange.last_seq()
+
+    @classmethod
+    def hottest_ids(cls, count: int) -> list:
+        """Returns the ids of the Customers written most recently, the likeliest to be read"""
+        # only the tail of the change log is read, ids written many times are counted once
+        recent = (
+            db.session.query(CustomerChange.customer_id)
+            .order_by(CustomerChange.id.desc())
+            .limit(count * 4)
+        )
+        return list(dict.fromkeys(customer_id for customer_id, in recent))[:count]
+
+
+class CustomerRow(namedtuple("CustomerRow", "id f_name l_name active name street city state postalcode")):
+    """A read-only Customer row, a tuple with the attributes of a Customer"""
+
+    __slots__ = ()
+
+    serialize = Customer.serialize
+
+
+######################################################################
+#  C U S T O M E R   C H A N G E   L O G   (O U T B O X)
+######################################################################
+class CustomerChange(db.Model):
+    """
+    Class that represents one write to a Customer
+
+    Rows are appended in the same transaction as the write, so the change
+    log never misses or invents a change. The seq column orders the changes
+    and is what consumers pass back as ?since= to read incrementally. It is
+    only given when the transaction commits, see sequence_changes().
+    """
+
+    __tablename__ = "customer_change"
+
+    # Table Schema
+    id = db.Column(db.Integer, primary_key=True)
+    seq = db.Column(db.Integer, unique=True, index=True)  # None until the transaction commits
+    customer_id = db.Column(db.Integer, nullable=False, index=True)
+    operation = db.Column(db.String(16), nullable=False)
+    data = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<CustomerChange {self.operation} id=[{self.customer_id}] seq=[{self.seq}]>"
+
+    def serialize(self):
+        """Serializes a CustomerChange into a dictionary"""
+        return {
+            "seq": self.seq,
+            "customer_id": self.customer_id,
+            "operation": self.operation,
+            "data": self.data,
+            "created_at": self.created_at.isoformat(),
+        }
+
+    @classmethod
+    def since(cls, seq: int, limit: int = 100) -> list:
+        """Returns the changes after seq in the order they were committed
+
+        :param seq: the last seq the consumer has seen
+        :param limit: the maximum number of changes to return
+        """
+        logger.info("Processing changes since %s ...", seq)
+        return cls.query.filter(cls.seq > seq).order_by(cls.seq).limit(limit).all()
+
+    @classmethod
+    def last_seq(cls) -> int:
+        """Returns the seq of the latest committed change or 0 if there are none"""
+        return db.session.query(ChangeCounter.value).filter(ChangeCounter.id == 1).scalar() or 0
+
+
+class ChangeCounter(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    Class that holds the last seq given to the change log
+
+    It is a single row that every write transaction updates right before it
+    commits. The row lock is held until the commit, so the seqs are handed
+    out in the order the transactions commit and a consumer that has read a
+    seq can never be passed by a smaller one committing later.
+    """
+
+    __tablename__ = "change_counter"
+
+    # Table Schema
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def init_counter(cls):
+        """Adds the counter row if the database does not have it yet"""
+        if db.session.get(cls, 1) is not None:
+            return
+        try:
+            db.session.add(cls(id=1, value=db.session.query(db.func.max(CustomerChange.seq)).scalar() or 0))
+            db.session.commit()
+        except IntegrityError:
+            # another worker added it first
+            db.session.rollback()
+
+
+def sequence_changes(connection) -> int:
+    """
+    Gives the changes of the transaction on connection their seq
+
+    Called last before the commit, returns the number of changes sequenced
+    """
+    changes = CustomerChange.__table__
+    counter = ChangeCounter.__table__
+    pending = connection.execute(
+        select(changes.c.id).where(changes.c.seq.is_(None)).order_by(changes.c.id)
+    ).scalars().all()
+    if not pending:
+        return 0
+    # the row lock taken here is what orders the seqs by commit
+    connection.execute(update(counter).where(counter.c.id == 1).values(value=counter.c.value + len(pending)))
+    first = connection.execute(select(counter.c.value).where(counter.c.id == 1)).scalar() - len(pending) + 1
+    connection.execute(
+        update(changes)
+        .where(changes.c.id == bindparam("change_id"), changes.c.seq.is_(None))
+        .values(seq=bindparam("change_seq")),
+        [{"change_id": change_id, "change_seq": first + i} for i, change_id in enumerate(pending)],
+    )
+    return len(pending)
+
+
+@event.listens_for(Engine, "connect")
+def _add_sqlite_functions(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+    """Lets SQLite sort the customers by the blocking key of the duplicate detection"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function("blocking_key", 1, blocking_key, deterministic=True)
+
+
+@event.listens_for(db.session, "before_commit")
+def _sequence_changes(session):
+    """Sequences the changes of a transaction that wrote to the change log"""
+    if session.in_nested_transaction() or not session.info.pop("changes", False):
+        return
+    session.flush()
+    sequence_changes(session.connection())
+
+
+######################################################################
+#  I D E M P O T E N C Y   K E Y S
+######################################################################
+class IdempotencyKey(db.Model):
+    """
+    Class that remembers the response to a request sent with an Idempotency-Key
+
+    A key is added to the session before the request runs so that it commits
+    in the same transaction as the write. A concurrent retry with the same key
+    then fails on the primary key and its write is rolled back with it.
+    """
+
+    __tablename__ = "idempotency_key"
+
+    # Table Schema
+    key = db.Column(db.String(255), primary_key=True)
+    method = db.Column(db.String(8), nullable=False)
+    path = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)  # None while the request is running
+    body = db.Column(db.JSON)
+    location = db.Column(db.String(2048))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.key} {self.method} {self.path} [{self.status_code}]>"
+
+    @property
+    def completed(self) -> bool:
+        """Returns True once the response has been stored"""
+        return self.status_code is not None
+
+    def matches(self, signature: tuple) -> bool:
+        """Returns True if the key was used for the request with this (method, path, fingerprint)"""
+        return (self.method, self.path, self.fingerprint) == tuple(signature)
+
+    def abandoned(self, lease: int) -> bool:
+        """Returns True if the key is still pending after its request had lease seconds to finish"""
+        return not self.completed and self.created_at <= datetime.utcnow() - timedelta(seconds=lease)
+
+    @classmethod
+    def reserve(cls, key: str, signature: tuple, ttl: int):
+        """Adds a pending key for the request with this (method, path, fingerprint) to the session"""
+        method, path, fingerprint = signature
+        record = cls(
+            key=key,
+            method=method,
+            path=path,
+            fingerprint=fingerprint,
+            expires_at=datetime.utcnow() + timedelta(seconds=ttl),
+        )
+        db.session.add(record)
+        return record
+
+    @classmethod
+    def find(cls, key: str, lease: int = None):
+        """Returns the key if it has not expired nor, with a lease, been abandoned"""
+        record = cls.query.get(key)
+        if record is None:
+            return None
+        if record.expires_at <= datetime.utcnow() or (lease is not None and record.abandoned(lease)):
+            # make room for the key to be reserved again
+            db.session.delete(record)
+            db.session.flush()
+            return None
+        return record
+
+    @classmethod
+    def prune(cls, max_keys: int):
+        """Deletes the expired keys and the oldest keys above max_keys"""
+        logger.info("Pruning idempotency keys")
+        cls.query.filter(cls.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+        extra = cls.query.count() - max_keys
+        if extra > 0:
+            oldest = db.session.query(cls.key).order_by(cls.created_at).limit(extra)
+            cls.query.filter(cls.key.in_(oldest.subquery().select())).delete(synchronize_session=False)
+        db.session.commit()
+
+
+class DuplicateRun(db.Model):
+    """
+    Class that records a run of the duplicate detection and its merge report
+
+    The running run holds running_slot, which is unique, so a second run
+    fails to start whichever worker or pod starts it. A run still going
+    after the timeout is taken as dead and its slot is freed.
+    """
+
+    __tablename__ = "duplicate_run"
+
+    # Table Schema
+    id = db.Column(db.Integer, primary_key=True)
+    state = db.Column(db.String(16), nullable=False, default="running")
+    running_slot = db.Column(db.Integer, unique=True)  # 1 while running, None after
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    error = db.Column(db.String(1024))
+    report = db.Column(db.JSON)
+
+    def __repr__(self):
+        return f"<DuplicateRun {self.id} [{self.state}]>"
+
+    def serialize(self) -> dict:
+        """Serializes a run into a dictionary"""
+        return {
+            "id": self.id,
+            "state": self.state,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "error": self.error,
+            "report": self.report,
+        }
+
+    @classmethod
+    def begin(cls, timeout: int):
+        """Records a new running run, returns None if another one is running"""
+        cutoff = datetime.utcnow() - timedelta(seconds=timeout)
+        cls.query.filter(cls.running_slot.isnot(None), cls.started_at <= cutoff).update(
+            {"state": "failed", "running_slot": None, "error": "Timed out"}, synchronize_session=False
+        )
+        run = cls(running_slot=1)
+        db.session.add(run)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+        return run
+
+    def finish(self, report: dict = None, error: str = None):
+        """Records the report of the run, or the error it failed with"""
+        self.state = "failed" if error else "done"
+        self.report, self.error = report, error and error[:1024]
+        self.running_slot = None
+        self.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    @classmethod
+    def latest(cls):
+        """Returns the most recent run or None"""
+        return cls.query.order_by(cls.id.desc()).first()
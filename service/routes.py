@@ -5,26 +5,27 @@ My Service
 Describe what your service does here
 """
 
-from flask import jsonify, request
-from flask_restx import Resource, fields, reqparse, inputs
-from service.models import Customer
-from .common import status
+from flask import Response, request
+from flask_restx import Resource, fields, reqparse, inputs, marshal
+from sqlalchemy import event
+from sqlalchemy.exc import InterfaceError, OperationalError
+from service.models import Customer, CustomerChange, db, in_batch, search_terms
+from .common import admission, batch, media_types, status
+from .common.circuit_breaker import CircuitOpen
+from .common.db_pool import preconnect, recent_wait
+from .common.deadlines import DeadlineExceeded, remaining
+from .common.group_commit import GroupCommitWriter
+from .common.idempotency import IDEMPOTENCY_HEADER, idempotent
+from .common.negative_cache import NegativeCache
+from .common.replicas import client_key
+from .common.result_cache import ResultCache
+from .common.single_flight import SingleFlight
+from .common.stale_cache import StaleCache
 
 # Import Flask application
 from . import app, api
 
 
-############################################################
-# Health Endpoint
-############################################################
-
-
-@app.route("/health")
-def health():
-    """Health Status"""
-    return jsonify(dict(status="OK")), status.HTTP_200_OK
-
-
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -33,7 +34,7 @@ def health():
 @app.route("/")
 def index():
     """Base URL for our service"""
-    return app.send_static_file("index.html")
+    return app.extensions["static_assets"].send_static(app.static_folder, "index.html")
 
 
 ######################################################################
@@ -47,25 +48,251 @@ def abort(error_code: int, message: str):
     api.abort(error_code, message)
 
 
-def check_content_type(content_type):
-    """Checks that the media type is correct"""
+# Concurrent identical reads in this worker share one database call
+single_flight = SingleFlight()
+
+
+def reads_own_writes() -> bool:
+    """Returns True when the client wrote recently, so its reads go to the primary"""
+    router = app.extensions.get("replica_router")
+    return router is not None and router.is_sticky(client_key())
+
+
+def coalesce(key, func):
+    """Runs a read once for all of the concurrent requests with the same key"""
+    # reads in a batch may see its uncommitted writes so they are never shared
+    if not app.config.get("SINGLE_FLIGHT_ENABLED", True) or in_batch():
+        return func()
+    # clients reading their own writes must not share a replica read
+    if reads_own_writes():
+        return func()
+    # a waiter gives up at its own deadline and runs the read again if the
+    # one it waited for ran out of time on the deadline of another request
+    result, shared = single_flight.do(key, func, timeout=remaining(), retry_on=(DeadlineExceeded,))
+    if shared:
+        app.logger.debug("Shared the in-flight read of %s", key)
+    return result
+
+
+# Errors that mean the database cannot answer right now
+DATABASE_UNAVAILABLE = (CircuitOpen, OperationalError, InterfaceError)
+
+# The last known representations served while the database is unavailable
+stale_cache = StaleCache(
+    max_size=app.config.get("STALE_CACHE_MAX_SIZE", 10000),
+    max_bytes=app.config.get("STALE_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+)
+
+
+@app.before_request
+def retry_degraded_start():
+    """Creates the tables once the database is back after a degraded start"""
+    # the probes answer without the database, a hanging connect must not fail liveness
+    if request.blueprint != "health" and not app.extensions.get("db_ready"):
+        Customer.create_tables(app)
+
+
+def read_or_stale(key, func):
+    """
+    Runs a coalesced read and remembers the result, falling back to the
+    last known result when the database is unavailable
+
+    Returns the result and the headers to send with it
+    """
+    try:
+        result = coalesce(key, func)
+    except DATABASE_UNAVAILABLE as error:
+        stale = stale_cache.get(key)
+        if stale is None:
+            raise
+        result, age = stale
+        app.logger.warning("Serving stale %s: %s", key, error)
+        return result, {"Warning": '110 - "Response is Stale"', "Age": str(int(age))}
+    # every copy is JSON-encoded on the read that makes it, so long lists are not kept
+    too_long = isinstance(result, list) and len(result) > app.config.get("STALE_CACHE_MAX_LIST_ITEMS", 100)
+    if result is None:
+        stale_cache.discard(key)
+    elif not in_batch() and not too_long:
+        stale_cache.put(key, result)
+    return result, {}
+
+
+# The serialized responses of recent listings, valid until the next write
+result_cache = ResultCache(
+    max_entries=app.config.get("RESULT_CACHE_MAX_ENTRIES", 1000),
+    max_bytes=app.config.get("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+    ttl=app.config.get("RESULT_CACHE_TTL_SECONDS", 60.0),
+)
+
+
+def data_version():
+    """Returns the version of the customers, or None when it cannot be read
+
+    Every write bumps the change log counter in its transaction, so the
+    counter changes with every committed write, in the order they commit
+    """
+    try:
+        return CustomerChange.last_seq()
+    except DATABASE_UNAVAILABLE:
+        return None
+
+
+def cached_response(key, build):
+    """
+    Answers a listing from the result cache, or with the response of build()
+    and caches its body
+
+    build() returns the marshalled result and the headers to send with it
+    """
+    if not app.config.get("RESULT_CACHE_ENABLED", True) or in_batch():
+        data, headers = build()
+        return api.make_response(data, status.HTTP_200_OK, headers)
+    media_type = request.accept_mimetypes.best_match(api.representations, default=api.default_mediatype)
+    key = key + (media_type,)
+    version = data_version()
+    cached = result_cache.get(key, version) if version is not None else None
+    if cached is not None:
+        body, mimetype, headers = cached
+        return Response(body, status=status.HTTP_200_OK, mimetype=mimetype, headers=headers)
+
+    data, headers = build()
+    response = api.make_response(data, status.HTTP_200_OK, headers)
+    # stale answers are never cached, they were not built from the current version
+    if version is not None and "Warning" not in headers and response.status_code == status.HTTP_200_OK:
+        result_cache.put(key, version, response.get_data(), response.mimetype, headers)
+    return response
+
+
+# Remembers the ids that were not found so they can be rejected without a query
+negative_cache = NegativeCache(
+    app,
+    ttl=app.config.get("NEGATIVE_CACHE_TTL_SECONDS", 5.0),
+    max_size=app.config.get("NEGATIVE_CACHE_MAX_SIZE", 100000),
+    load_ids=Customer.id_snapshot if app.config.get("NEGATIVE_CACHE_BLOOM", False) else None,
+    bloom_refresh=app.config.get("NEGATIVE_CACHE_BLOOM_REFRESH_SECONDS", 300.0),
+    lag=app.config.get("NEGATIVE_CACHE_BLOOM_LAG_SECONDS", 60.0),
+)
+
+
+@event.listens_for(Customer, "after_insert")
+def remember_created(mapper, connection, target):  # pylint: disable=unused-argument
+    """Collects the ids created in this transaction"""
+    negative_cache.discard(target.id)
+    db.session.info.setdefault("created_ids", []).append(target.id)
+
+
+@event.listens_for(db.session, "after_commit")
+def forget_created_misses(session):
+    """Forgets the cached misses of the ids that were just created"""
+    for customer_id in session.info.pop("created_ids", []):
+        negative_cache.discard(customer_id)
+
+
+def write_customers(customers):
+    """Creates the customers queued for a group commit"""
+    Customer.create_many(customers)
+    db.session.info.setdefault("created_ids", []).extend(customer.id for customer in customers)
+
+
+# Concurrent creates in this worker share one INSERT and one commit (opt-in)
+GROUP_WRITER = (
+    GroupCommitWriter(
+        app,
+        write_customers,
+        max_rows=app.config.get("GROUP_COMMIT_MAX_ROWS", 100),
+        max_delay=app.config.get("GROUP_COMMIT_MAX_DELAY_MS", 5) / 1000.0,
+    )
+    if app.config.get("GROUP_COMMIT_ENABLED", False)
+    else None
+)
+
+
+def warmup_steps() -> list:
+    """Returns the warm-up steps of a worker as (name, callable)"""
+
+    def connect():
+        count = app.config.get("WARMUP_CONNECTIONS", 5)
+        router = app.extensions.get("replica_router")
+        engines = [db.engine] + (router.engines if router else [])
+        return sum(preconnect(engine, count) for engine in engines)
+
+    def prime_caches():
+        # the most recently written customers are the likeliest to be read
+        ids = Customer.hottest_ids(app.config.get("WARMUP_PRIME_IDS", 0))
+        customers = Customer.query.filter(Customer.id.in_(ids)).all() if ids else []
+        for customer in customers:
+            stale_cache.put(("customer", customer.id), customer.serialize())
+        negative_cache.refresh_bloom(background=False)
+        return len(customers)
+
+    steps = [("connect", connect), ("compile", Customer.warm_statements)]
+    if app.config.get("WARMUP_PRIME_IDS", 0):
+        steps.append(("prime", prime_caches))
+    return steps
+
+
+def long_lived_request():
+    """Returns True for requests that are not API calls or wait on purpose"""
+    if not request.path.startswith(api.prefix) or request.endpoint is None:
+        return True
+    return request.endpoint == "stream_resource" or bool(request.args.get("wait"))
+
+
+def admission_class():
+    """Returns the admission priority of the current request"""
+    # streams and long-polls wait on purpose so they do not count as load
+    if long_lived_request():
+        return None
+    if request.method == "GET" and request.endpoint == "customer_resource":
+        return admission.HIGH
+    return admission.LOW
+
+
+def pool_wait():
+    """Returns the recent wait for a database connection"""
+    return recent_wait(db.engine)
+
+
+# Media types the request bodies can be sent in
+PAYLOAD_TYPES = media_types.supported() + [
+    alias for alias, media_type in media_types.ALIASES.items() if media_type in media_types.supported()
+]
+
+# Lets every resource answer in the media type the client accepts
+media_types.init_representations(api)
+
+
+def check_content_type(*content_types):
+    """Checks that the media type is one of content_types"""
+    expected = " or ".join(content_types)
     if "Content-Type" not in request.headers:
         app.logger.error("No Content-Type specified.")
         abort(
             status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            f"Content-Type must be {content_type}",
+            f"Content-Type must be {expected}",
         )
 
-    if request.headers["Content-Type"] == content_type:
+    if request.mimetype in content_types:
         return
 
     app.logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-        f"Content-Type must be {content_type}",
+        f"Content-Type must be {expected}",
     )
 
 
+def request_payload():
+    """Returns the decoded request body in any of the PAYLOAD_TYPES, in place of api.payload"""
+    if request.mimetype == media_types.JSON:
+        return request.get_json()
+    try:
+        return media_types.decode(request.get_data(), request.mimetype)
+    except ValueError as error:
+        abort(status.HTTP_400_BAD_REQUEST, f"The request body could not be decoded: {error}")
+    return None
+
+
 addresses = {
     "name": fields.String(
         zrequired=True, description="The name of the address (ex.: Home)"
@@ -132,6 +359,82 @@ customer_args.add_argument(
     help="List Customers by active",
 )
 
+# Largest page of results returned by /customers/search
+MAX_SEARCH_LIMIT = 100
+
+search_args = reqparse.RequestParser()
+search_args.add_argument(
+    "q",
+    type=str,
+    location="args",
+    required=True,
+    help="The words to search for in the names and addresses",
+)
+search_args.add_argument(
+    "limit",
+    type=inputs.int_range(1, MAX_SEARCH_LIMIT),
+    location="args",
+    required=False,
+    default=20,
+    help="The maximum number of Customers to return",
+)
+search_args.add_argument(
+    "offset",
+    type=inputs.natural,
+    location="args",
+    required=False,
+    default=0,
+    help="The number of best matches to skip",
+)
+
+batch_operation_model = api.model(
+    "BatchOperation",
+    {
+        "method": fields.String(required=True, enum=list(batch.METHODS), description="The HTTP method"),
+        "path": fields.String(required=True, description="The path of the call (ex.: /api/customers/1)"),
+        "body": fields.Raw(description="The body of a POST or PUT"),
+    },
+)
+
+batch_model = api.model(
+    "Batch",
+    {
+        "mode": fields.String(
+            enum=list(batch.MODES),
+            default=batch.ATOMIC,
+            description="atomic rolls every call back when one fails, per_item only the failed ones",
+        ),
+        "operations": fields.List(fields.Nested(batch_operation_model), required=True),
+    },
+)
+
+batch_result_model = api.model(
+    "BatchResult",
+    {
+        "status": fields.Integer(description="The status code of the call"),
+        "location": fields.String(description="The Location header of the call"),
+        "body": fields.Raw(description="The body of the response to the call"),
+    },
+)
+
+batch_results_model = api.model(
+    "BatchResults",
+    {
+        "mode": fields.String(),
+        "committed": fields.Boolean(description="True if the writes of the batch were committed"),
+        "results": fields.List(fields.Nested(batch_result_model)),
+    },
+)
+
+# The resources that can be called in a batch
+BATCH_ENDPOINTS = {
+    "customer_resource",
+    "customer_collection",
+    "search_resource",
+    "activate_resource",
+    "deactivate_resource",
+}
+
 ######################################################################
 #  PATH: /customers/{id}
 ######################################################################
@@ -161,15 +464,31 @@ class CustomerResource(Resource):
         This endpoint will return a customer based on id
         """
         app.logger.info("Request for customer with id: %s", customer_id)
-        customer = Customer.find(customer_id)
+        negative_cache.refresh_bloom()
+        # a client that just wrote may be reading a customer it created on another worker
+        own_writes = reads_own_writes()
+        if not own_writes and negative_cache.is_missing(customer_id):
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Customer with id '{customer_id}' was not found.",
+            )
+
+        def load():
+            customer = Customer.find(customer_id)
+            return customer.serialize() if customer else None
+
+        customer, headers = read_or_stale(("customer", customer_id), load)
         if not customer:
+            # a miss read from a replica may only be a create it has not replayed yet
+            if own_writes or "replica_router" not in app.extensions:
+                negative_cache.add(customer_id)
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Customer with id '{customer_id}' was not found.",
             )
 
-        app.logger.info("Returning customer: %s", customer.f_name)
-        return customer.serialize(), status.HTTP_200_OK
+        app.logger.info("Returning customer: %s", customer["first_name"])
+        return customer, status.HTTP_200_OK, headers
 
     ######################################################################
     # UPDATE AN EXISTING CUSTOMER
@@ -185,7 +504,7 @@ class CustomerResource(Resource):
         This endpoint will update a customer based on the body that is posted
         """
         app.logger.info("Request to update customer with id: %s", customer_id)
-        check_content_type("application/json")
+        check_content_type(*PAYLOAD_TYPES)
 
         customer = Customer.find(customer_id)
         if not customer:
@@ -193,11 +512,16 @@ class CustomerResource(Resource):
                 status.HTTP_404_NOT_FOUND,
                 f"Customer with id '{customer_id}' was not found.",
             )
-        app.logger.debug("Payload = %s", api.payload)
-        data = api.payload
+        data = request_payload()
+        app.logger.debug("Payload = %s", data)
         customer.deserialize(data)
         customer.id = customer_id
         customer.update()
+        if in_batch():
+            # the batch may still roll the update back
+            stale_cache.discard(("customer", customer_id))
+        else:
+            stale_cache.put(("customer", customer_id), customer.serialize())
 
         app.logger.info("Customer with ID [%s] updated.", customer.id)
         location_url = api.url_for(
@@ -224,6 +548,7 @@ class CustomerResource(Resource):
                 f"Customer with id '{customer_id}' was not found.",
             )
         customer.delete()
+        stale_cache.discard(("customer", customer_id))
         app.logger.info("customer with ID [%s] delete complete.", customer_id)
         return "", status.HTTP_204_NO_CONTENT
 
@@ -245,7 +570,7 @@ class CustomerCollection(Resource):
     ######################################################################
     @api.doc("list_customers")
     @api.expect(customer_args, validate=True)
-    @api.marshal_list_with(customer_model)
+    @api.response(200, "Success", [customer_model])
     def get(self):
         """
         List all customers
@@ -254,27 +579,34 @@ class CustomerCollection(Resource):
             json: an array of customer data
         """
         app.logger.info("Request to list all customers")
-        customers = []
+        is_active = None
 
         active = request.args.get("active")
 
         if active:
             app.logger.info("Filtering by active: %s", active)
             is_active = active.lower() in ["yes", "y", "true", "t", "1"]
-            customers = Customer.find_by_activity(is_active)
-        else:
-            customers = Customer.all()
 
-        results = [customer.serialize() for customer in customers]
-        app.logger.info("Returning %d customers", len(results))
-        return results, status.HTTP_200_OK
+        def load():
+            return [customer.serialize() for customer in Customer.rows(is_active)]
+
+        def build():
+            results, headers = read_or_stale(("customers", is_active), load)
+            app.logger.info("Returning %d customers", len(results))
+            return marshal(results, customer_model), headers
+
+        return cached_response(("customers", is_active), build)
 
     ######################################################################
     # ADD A NEW CUSTOMER
     ######################################################################
     @api.doc("create_customers")
     @api.response(400, "The posted data was not valid")
+    @api.response(409, "A request with the same Idempotency-Key is in progress")
+    @api.response(422, "The Idempotency-Key was used for a different request")
+    @api.param("Idempotency-Key", "Makes retries of this request safe", _in="header")
     @api.expect(create_model)
+    @idempotent
     @api.marshal_with(customer_model, code=201)
     def post(self):
         """
@@ -282,21 +614,74 @@ class CustomerCollection(Resource):
         This endpoint will create a customer based the data in the body that is posted
         """
         app.logger.info("Request to create a customer")
-        check_content_type("application/json")
+        check_content_type(*PAYLOAD_TYPES)
         customer = Customer()
-        app.logger.info("Payload = %s", api.payload)
-        customer.deserialize(api.payload)
-        app.logger.info("Customer : %s", customer.serialize())
-        customer.create()
-
-        app.logger.info("Customer : %s", customer.serialize())
+        data = request_payload()
+        app.logger.debug("Payload = %s", data)
+        customer.deserialize(data)
+        # an idempotency key or a batch must commit in the same transaction as the create
+        if GROUP_WRITER is not None and not in_batch() and IDEMPOTENCY_HEADER not in request.headers:
+            GROUP_WRITER.write(customer)
+            # the writer thread inserted it, so the client's reads are kept on the primary here
+            router = app.extensions.get("replica_router")
+            if router is not None:
+                router.note_write(client_key())
+        else:
+            customer.create()
+        results = customer.serialize()
+        app.logger.debug("Customer : %s", results)
         location_url = api.url_for(
             CustomerResource, customer_id=customer.id, _external=True
         )
 
-        app.logger.info("Customer : ", customer.serialize())
         app.logger.info("Customer with ID [%s] created.", customer.id)
-        return customer.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+        return results, status.HTTP_201_CREATED, {"Location": location_url}
+
+
+######################################################################
+#  PATH: /customers/search
+######################################################################
+@api.route("/customers/search", strict_slashes=False)
+class SearchResource(Resource):
+    """
+    SearchResource class
+    Finds customers by the start of the words in their name or address
+    GET /customers/search?q=<words> - Returns the best matches first
+    """
+
+    @api.doc("search_customers")
+    @api.expect(search_args, validate=True)
+    @api.response(200, "Success", [customer_model])
+    def get(self):
+        """
+        Search the customers
+        This endpoint returns the customers whose name or address has a word
+        starting with each of the words of q, best matches first. The Link
+        header points to the next page when there is one
+        """
+        args = search_args.parse_args()
+        app.logger.info("Request to search customers for %s", args["q"])
+
+        def build():
+            # one extra row tells if there is a next page without counting the matches
+            customers = Customer.search(args["q"], args["limit"] + 1, args["offset"])
+            results = [customer.serialize() for customer in customers[: args["limit"]]]
+            headers = {}
+            if len(customers) > args["limit"]:
+                next_url = api.url_for(
+                    SearchResource,
+                    q=args["q"],
+                    limit=args["limit"],
+                    offset=args["offset"] + args["limit"],
+                    _external=True,
+                )
+                headers["Link"] = f'<{next_url}>; rel="next"'
+            app.logger.info("Returning %d customers", len(results))
+            return marshal(results, customer_model), headers
+
+        # the Link header holds absolute URLs so the host is part of the key
+        terms = " ".join(search_terms(args["q"]))
+        return cached_response(("search", request.url_root, terms, args["limit"], args["offset"]), build)
 
 
 ######################################################################
@@ -330,6 +715,7 @@ class ActivateResource(Resource):
                 f"Customer with id '{customer_id}' was not found.",
             )
         customer.activate()
+        customer.update("activate")
         app.logger.info(
             "Customer with ID [%s]'s active status is set to [%s].",
             customer.id,
@@ -369,6 +755,7 @@ class DeactivateResource(Resource):
                 f"Customer with id '{customer_id}' was not found.",
             )
         customer.deactivate()
+        customer.update("deactivate")
         app.logger.info(
             "Customer with ID [%s]'s active status is set to [%s].",
             customer.id,
@@ -378,3 +765,58 @@ class DeactivateResource(Resource):
             CustomerResource, customer_id=customer.id, _external=True
         )
         return customer.serialize(), status.HTTP_200_OK, {"Location": location_url}
+
+
+######################################################################
+#  PATH: /batch
+######################################################################
+@api.route("/batch", strict_slashes=False)
+class BatchResource(Resource):
+    """
+    BatchResource class
+    Runs many calls to the customer resources in one round trip and one transaction
+    POST /batch - Runs the operations and returns the result of each one
+    """
+
+    @api.doc("run_batch")
+    @api.response(400, "The posted batch was not valid")
+    @api.param("Idempotency-Key", "Makes retries of this request safe", _in="header")
+    @api.expect(batch_model)
+    @idempotent
+    @api.marshal_with(batch_results_model)
+    def post(self):
+        """
+        Run a batch of operations
+        This endpoint runs each operation like a request of its own and commits
+        all of their writes at once. In atomic mode the first operation that fails
+        rolls the batch back and its status is the status of the batch
+        """
+        check_content_type(*PAYLOAD_TYPES)
+        data = request_payload()
+        if not isinstance(data, dict) or not isinstance(data.get("operations"), list):
+            abort(status.HTTP_400_BAD_REQUEST, "The batch must have a list of operations")
+        mode = data.get("mode") or batch.ATOMIC
+        if mode not in batch.MODES:
+            abort(status.HTTP_400_BAD_REQUEST, f"mode must be one of {', '.join(batch.MODES)}")
+        operations = data["operations"]
+        max_operations = app.config.get("BATCH_MAX_OPERATIONS", 100)
+        if len(operations) > max_operations:
+            abort(status.HTTP_400_BAD_REQUEST, f"A batch can have at most {max_operations} operations")
+        for operation in operations:
+            if (
+                not isinstance(operation, dict)
+                or str(operation.get("method", "")).upper() not in batch.METHODS
+                or not str(operation.get("path", "")).startswith("/")
+            ):
+                abort(
+                    status.HTTP_400_BAD_REQUEST,
+                    "Each operation must have a method (GET, POST, PUT or DELETE) and a path",
+                )
+
+        app.logger.info("Request to run a batch of %d operations (%s)", len(operations), mode)
+        results, committed = batch.run_batch(app, operations, mode, BATCH_ENDPOINTS)
+        code = status.HTTP_200_OK
+        if not committed:
+            code = results[-1]["status"]
+            app.logger.info("Batch rolled back by operation %d with %s", len(results), code)
+        return {"mode": mode, "committed": committed, "results": results}, code
@@ -0,0 +1,91 @@
+"""
+Test cases for Admission Control
+"""
+from unittest import TestCase
+from unittest.mock import patch
+
+from service import app
+from service.common import status
+from service.common.admission import HIGH, LOW, AdmissionController, TokenBucket
+from service.health_routes import readiness
+
+
+######################################################################
+#  A D M I S S I O N   C O N T R O L   T E S T   C A S E S
+######################################################################
+class TestAdmissionController(TestCase):
+    """Test Cases for the AdmissionController"""
+
+    def test_token_bucket(self):
+        """It should allow a burst and then ask the client to wait"""
+        bucket = TokenBucket(rate=1, burst=2)
+        self.assertEqual(bucket.take(), 0.0)
+        self.assertEqual(bucket.take(), 0.0)
+        self.assertGreater(bucket.take(), 0.0)
+
+    def test_rate_limit_per_client(self):
+        """It should return 429 when a client runs out of tokens"""
+        controller = AdmissionController(client_rate=1, client_burst=1)
+        self.assertIsNone(controller.admit("a", LOW))
+        code, retry_after = controller.admit("a", LOW)
+        self.assertEqual(code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(retry_after, 1)
+        # other clients have their own bucket
+        self.assertIsNone(controller.admit("b", LOW))
+        self.assertEqual(controller.stats()["rejected"], 1)
+
+    def test_shed_low_priority_first(self):
+        """It should shed low priority requests before high priority ones"""
+        controller = AdmissionController(max_in_flight=4, low_priority_share=0.5)
+        self.assertIsNone(controller.admit("a", LOW))
+        self.assertIsNone(controller.admit("a", LOW))
+        self.assertEqual(controller.admit("a", LOW)[0], status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIsNone(controller.admit("a", HIGH))
+        self.assertIsNone(controller.admit("a", HIGH))
+        self.assertEqual(controller.admit("a", HIGH)[0], status.HTTP_503_SERVICE_UNAVAILABLE)
+        controller.release()
+        self.assertIsNone(controller.admit("a", HIGH))
+        self.assertEqual(controller.stats()["in_flight"], 4)
+
+    def test_shed_on_pool_wait(self):
+        """It should shed load when the pool is slow to hand out connections"""
+        controller = AdmissionController(max_pool_wait=0.5)
+        self.assertEqual(controller.admit("a", LOW, pool_wait=0.6)[0], status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIsNone(controller.admit("a", HIGH, pool_wait=0.6))
+        self.assertEqual(controller.admit("a", HIGH, pool_wait=1.1)[0], status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_shed_requests(self):
+        """It should answer shed requests with 503 and Retry-After"""
+        client = app.test_client()
+        with patch("service.routes.recent_wait", return_value=10.0):
+            response = client.get("/api/customers")
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response.headers["Retry-After"], "1")
+            # the health check is not controlled
+            app.extensions["warmup"].wait(10)
+            readiness.invalidate()
+            self.assertEqual(client.get("/health").status_code, status.HTTP_200_OK)
+        self.assertEqual(client.get("/api/customers").status_code, status.HTTP_200_OK)
+        self.assertEqual(app.extensions["admission"].in_flight, 0)
+
+    def test_rate_limit_by_address(self):
+        """It should rate limit a client by its address whatever X-Client-ID it sends"""
+        client = app.test_client()
+        controller = app.extensions["admission"]
+        address = {"REMOTE_ADDR": "192.0.2.7"}
+        with patch.object(controller, "client_rate", 0.001), patch.object(controller, "client_burst", 1):
+            response = client.get("/api/customers", headers={"X-Client-ID": "one"}, environ_base=address)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = client.get("/api/customers", headers={"X-Client-ID": "two"}, environ_base=address)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            response = client.get("/api/customers", environ_base={"REMOTE_ADDR": "192.0.2.8"})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_max_clients(self):
+        """It should forget the least recently seen clients above the maximum"""
+        controller = AdmissionController(client_rate=1, client_burst=1, max_clients=2)
+        for client in ("a", "b", "c"):
+            controller.admit(client, LOW)
+        self.assertEqual(controller.stats()["clients"], 2)
+        # a was forgotten so it has a full bucket again
+        self.assertIsNone(controller.admit("a", LOW))
@@ -0,0 +1,207 @@
+"""
+Test cases for Batch Operations
+"""
+from unittest import TestCase
+from unittest.mock import patch
+
+from service import app
+from service.common import status
+from service.common.replicas import client_key
+from service.models import Customer, CustomerChange, IdempotencyKey, db
+from tests.factories import CustomerFactory
+
+BASE_URL = "/api/customers"
+BATCH_URL = "/api/batch"
+
+
+######################################################################
+#  B A T C H   T E S T   C A S E S
+######################################################################
+class TestBatch(TestCase):
+    """Test Cases for Batch Operations"""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+
+    def _create(self):
+        """Creates a customer and returns its id"""
+        response = self.client.post(BASE_URL, json=CustomerFactory().serialize())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.get_json()["id"]
+
+    def _count(self):
+        """Returns the number of customers in the database"""
+        db.session.remove()
+        return Customer.query.count()
+
+    def test_atomic_batch(self):
+        """It should run every operation and commit them once"""
+        customer_id, deleted_id = self._create(), self._create()
+        new = CustomerFactory().serialize()
+        before = self._count()
+        with patch.object(db.session, "commit", wraps=db.session.commit) as commit:
+            response = self.client.post(
+                BATCH_URL,
+                json={
+                    "operations": [
+                        {"method": "POST", "path": BASE_URL, "body": new},
+                        {"method": "PUT", "path": f"{BASE_URL}/{customer_id}/deactivate"},
+                        {"method": "DELETE", "path": f"{BASE_URL}/{deleted_id}"},
+                        {"method": "GET", "path": f"{BASE_URL}?active=false"},
+                    ]
+                },
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(commit.call_count, 1)
+        data = response.get_json()
+        self.assertEqual(data["mode"], "atomic")
+        self.assertTrue(data["committed"])
+        self.assertEqual([result["status"] for result in data["results"]], [201, 200, 204, 200])
+        created = data["results"][0]
+        self.assertEqual(created["body"]["first_name"], new["first_name"])
+        self.assertTrue(created["location"].endswith(f"{BASE_URL}/{created['body']['id']}"))
+        self.assertFalse(data["results"][1]["body"]["active"])
+        self.assertIn(customer_id, [customer["id"] for customer in data["results"][3]["body"]])
+
+        self.assertEqual(self._count(), before)
+        self.assertFalse(Customer.find(customer_id).active)
+        self.assertIsNone(Customer.find(deleted_id))
+        self.assertEqual(CustomerChange.since(CustomerChange.last_seq() - 3)[0].operation, "create")
+
+    def test_atomic_batch_rolls_back(self):
+        """It should roll every operation back when one fails"""
+        before = self._count()
+        response = self.client.post(
+            BATCH_URL,
+            json={
+                "mode": "atomic",
+                "operations": [
+                    {"method": "POST", "path": BASE_URL, "body": CustomerFactory().serialize()},
+                    {"method": "PUT", "path": f"{BASE_URL}/0/activate"},
+                    {"method": "POST", "path": BASE_URL, "body": CustomerFactory().serialize()},
+                ],
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        data = response.get_json()
+        self.assertFalse(data["committed"])
+        self.assertEqual([result["status"] for result in data["results"]], [201, 404])
+        self.assertIn("was not found", data["results"][1]["body"]["message"])
+        self.assertEqual(self._count(), before)
+
+    def test_per_item_batch(self):
+        """It should only roll back the operations that fail"""
+        before = self._count()
+        response = self.client.post(
+            BATCH_URL,
+            json={
+                "mode": "per_item",
+                "operations": [
+                    {"method": "POST", "path": BASE_URL, "body": CustomerFactory().serialize()},
+                    {"method": "POST", "path": BASE_URL, "body": {"first_name": "Missing"}},
+                    {"method": "POST", "path": BASE_URL, "body": CustomerFactory().serialize()},
+                ],
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertTrue(data["committed"])
+        self.assertEqual([result["status"] for result in data["results"]], [201, 400, 201])
+        self.assertEqual(self._count(), before + 2)
+
+    def test_batch_reads_its_own_writes(self):
+        """It should let an operation see the writes of the ones before it"""
+        customer_id = self._create()
+        response = self.client.post(
+            BATCH_URL,
+            json={
+                "operations": [
+                    {"method": "PUT", "path": f"{BASE_URL}/{customer_id}/deactivate"},
+                    {"method": "GET", "path": f"{BASE_URL}/{customer_id}"},
+                ]
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.get_json()["results"][1]["body"]["active"])
+
+    def test_batch_rejects_other_endpoints(self):
+        """It should not call endpoints outside of the customer resources"""
+        response = self.client.post(
+            BATCH_URL,
+            json={
+                "mode": "per_item",
+                "operations": [
+                    {"method": "POST", "path": BATCH_URL, "body": {"operations": []}},
+                    {"method": "GET", "path": "/admin/pool"},
+                    {"method": "GET", "path": f"{BASE_URL}/stream"},
+                ],
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for result in response.get_json()["results"]:
+            self.assertEqual(result["status"], status.HTTP_400_BAD_REQUEST)
+            self.assertIn("cannot be called in a batch", result["body"]["message"])
+
+    def test_invalid_batch(self):
+        """It should reject batches that are not valid"""
+        invalid = [
+            {},
+            {"operations": "all"},
+            {"mode": "some", "operations": []},
+            {"operations": [{"method": "PATCH", "path": BASE_URL}]},
+            {"operations": [{"method": "GET", "path": "customers"}]},
+        ]
+        for body in invalid:
+            response = self.client.post(BATCH_URL, json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+        response = self.client.post(BATCH_URL, data="operations", content_type="text/plain")
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_batch_size_limit(self):
+        """It should reject batches with too many operations"""
+        operations = [{"method": "GET", "path": BASE_URL}] * 3
+        with patch.dict(app.config, {"BATCH_MAX_OPERATIONS": 2}):
+            response = self.client.post(BATCH_URL, json={"operations": operations})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_idempotent_batch(self):
+        """It should replay a batch retried with the same Idempotency-Key"""
+        body = {"operations": [{"method": "POST", "path": BASE_URL, "body": CustomerFactory().serialize()}]}
+        headers = {"Idempotency-Key": "batch-retry"}
+        IdempotencyKey.query.delete()
+        db.session.commit()
+        first = self.client.post(BATCH_URL, json=body, headers=headers)
+        before = self._count()
+        retry = self.client.post(BATCH_URL, json=body, headers=headers)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(self._count(), before)
+
+    def test_batch_releases_admission_once(self):
+        """It should hold its admission slot until the whole batch is done"""
+        controller = app.extensions["admission"]
+        with patch.object(controller, "release", wraps=controller.release) as release:
+            self.client.post(
+                BATCH_URL,
+                json={"operations": [{"method": "GET", "path": BASE_URL}] * 3},
+            )
+        self.assertEqual(release.call_count, 1)
+
+    def test_calls_keep_the_client(self):
+        """It should make the calls of a batch on behalf of its client"""
+        clients = []
+
+        def find(customer_id):  # pylint: disable=unused-argument
+            clients.append(client_key())
+
+        with patch.object(Customer, "find", side_effect=find):
+            self.client.post(
+                BATCH_URL,
+                json={"operations": [{"method": "DELETE", "path": f"{BASE_URL}/1"}]},
+                headers={"X-Client-ID": "client-1"},
+            )
+        self.assertEqual(clients, ["client-1"])
@@ -0,0 +1,90 @@
+"""
+Test cases for the Change Dispatcher
+"""
+import threading
+import time
+from unittest import TestCase
+
+from service import app
+from service.common.change_dispatcher import ChangeDispatcher
+
+
+class FakeChangeLog:
+    """An in-memory change log"""
+
+    def __init__(self):
+        self.changes = []
+
+    def append(self, operation):
+        """Appends a change"""
+        self.changes.append({"seq": len(self.changes) + 1, "operation": operation})
+
+    def fetch(self, since, limit):
+        """Returns the changes after since"""
+        return [change for change in self.changes if change["seq"] > since][:limit]
+
+    def last_seq(self):
+        """Returns the latest seq"""
+        return len(self.changes)
+
+
+######################################################################
+#  C H A N G E   D I S P A T C H E R   T E S T   C A S E S
+######################################################################
+class TestChangeDispatcher(TestCase):
+    """Test Cases for the ChangeDispatcher"""
+
+    def setUp(self):
+        self.log = FakeChangeLog()
+        self.log.append("create")
+        self.dispatcher = ChangeDispatcher(
+            app, self.log.fetch, self.log.last_seq, poll_interval=0.01, buffer_size=3
+        )
+
+    def test_wait_for_change(self):
+        """It should wake up a subscriber when a change arrives"""
+        def write():
+            time.sleep(0.05)
+            self.log.append("update")
+            self.dispatcher.notify()
+
+        threading.Thread(target=write).start()
+        changes = self.dispatcher.changes_after(1, 10, timeout=5)
+        self.assertEqual([change["operation"] for change in changes], ["update"])
+
+    def test_timeout(self):
+        """It should return no changes when the wait times out"""
+        self.assertEqual(self.dispatcher.changes_after(1, 10, timeout=0.05), [])
+
+    def test_fan_out(self):
+        """It should hand the same change to many subscribers"""
+        results = []
+
+        def subscriber():
+            results.append(self.dispatcher.changes_after(1, 10, timeout=5))
+
+        threads = [threading.Thread(target=subscriber) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        self.log.append("delete")
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result[0]["operation"] == "delete" for result in results))
+
+    def test_older_than_buffer(self):
+        """It should ask the caller to read the log when since is too old"""
+        self.assertEqual(self.dispatcher.changes_after(1, 10, timeout=0.05), [])
+        for _ in range(5):
+            self.log.append("update")
+        time.sleep(0.1)
+        self.assertIsNone(self.dispatcher.changes_after(1, 10, timeout=1))
+        changes = self.dispatcher.changes_after(4, 10, timeout=1)
+        self.assertEqual([change["seq"] for change in changes], [5, 6])
+
+    def test_stops_without_subscribers(self):
+        """It should stop polling when nobody is subscribed"""
+        self.dispatcher.changes_after(1, 10, timeout=0.02)
+        time.sleep(0.1)
+        self.assertIsNone(self.dispatcher._thread)  # pylint: disable=protected-access
@@ -0,0 +1,126 @@
+"""
+Test cases for the Circuit Breaker
+"""
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy.exc import OperationalError
+
+from service import app
+from service.common import status
+from service.common.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+from service.models import Customer, db
+from service.routes import result_cache, stale_cache
+from tests.factories import CustomerFactory
+
+BASE_URL = "/api/customers"
+
+
+######################################################################
+#  C I R C U I T   B R E A K E R   T E S T   C A S E S
+######################################################################
+class TestCircuitBreaker(TestCase):
+    """Test Cases for the CircuitBreaker"""
+
+    def test_open_after_failures(self):
+        """It should open after a run of failures and fail fast"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        breaker.record_failure()
+        breaker.allow()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertRaises(CircuitOpen, breaker.allow)
+        self.assertEqual(breaker.stats()["rejected"], 1)
+
+    def test_success_resets_failures(self):
+        """It should only count consecutive failures"""
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_half_open_trial(self):
+        """It should let one trial through after the reset timeout"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        breaker.allow()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertRaises(CircuitOpen, breaker.allow)
+        # a failed trial opens the circuit again, a good one closes it
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        time.sleep(0.06)
+        breaker.allow()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+
+
+class TestDegradedService(TestCase):
+    """Test Cases for the service while the database is unavailable"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.breaker = app.extensions["circuit_breaker"]
+        stale_cache.clear()
+        result_cache.clear()
+
+    def tearDown(self):
+        self.breaker.record_success()
+        db.session.remove()
+
+    def test_serve_stale_customer(self):
+        """It should serve the last known customer while the circuit is open"""
+        customer = CustomerFactory()
+        customer.create()
+        first_name = customer.f_name
+        response = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Warning", response.headers)
+        db.session.remove()
+
+        self.breaker.trip()
+        response = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Warning"], '110 - "Response is Stale"')
+        self.assertIn("Age", response.headers)
+        self.assertEqual(response.get_json()["first_name"], first_name)
+
+    def test_long_lists_not_kept(self):
+        """It should only keep the lists short enough to copy on every read"""
+        for _ in range(3):
+            CustomerFactory().create()
+        with patch.dict(app.config, {"STALE_CACHE_MAX_LIST_ITEMS": 2}):
+            self.assertEqual(self.client.get(BASE_URL).status_code, status.HTTP_200_OK)
+        self.assertEqual(stale_cache.stats()["size"], 0)
+        result_cache.clear()
+        with patch.dict(app.config, {"STALE_CACHE_MAX_LIST_ITEMS": 100000}):
+            self.assertEqual(self.client.get(BASE_URL).status_code, status.HTTP_200_OK)
+        self.assertEqual(stale_cache.stats()["size"], 1)
+
+    def test_fail_fast_without_stale_copy(self):
+        """It should answer 503 right away when there is nothing cached"""
+        self.breaker.trip()
+        response = self.client.get(f"{BASE_URL}/987654")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn("Retry-After", response.headers)
+        response = self.client.post(BASE_URL, json=CustomerFactory().serialize())
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_degraded_start(self):
+        """It should keep running when the tables cannot be created"""
+        error = OperationalError("CREATE TABLE", {}, Exception("connection refused"))
+        app.extensions["db_ready"] = False
+        try:
+            with patch("service.models.db.create_all", side_effect=error):
+                self.assertFalse(Customer.create_tables(app))
+            self.assertEqual(self.breaker.state, OPEN)
+            # the tables are created once the database is back
+            self.breaker.opened_at -= self.breaker.reset_timeout
+            response = self.client.get(BASE_URL)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(app.extensions["db_ready"])
+        finally:
+            app.extensions["db_ready"] = True
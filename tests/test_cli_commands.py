@@ -1,10 +1,11 @@
 """
 Flask CLI Extensions
 """
+import json
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import create_db
+from service.common.cli_commands import create_db, create_search_index, find_duplicates_command
 
 
 class TestFlaskCLI(TestCase):
@@ -19,3 +20,25 @@ class TestFlaskCLI(TestCase):
         db_mock.return_value = MagicMock()
         result = self.runner.invoke(create_db)
         self.assertEqual(result.exit_code, 0)
+
+    @patch("service.common.cli_commands.Customer")
+    def test_create_search_index(self, customer_mock):
+        """It should build the search index on the databases that need it"""
+        customer_mock.create_search_index.return_value = True
+        result = self.runner.invoke(create_search_index)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("is ready", result.output)
+        customer_mock.create_search_index.return_value = False
+        result = self.runner.invoke(create_search_index)
+        self.assertIn("nothing to build", result.output)
+
+    @patch("service.common.cli_commands.Customer")
+    def test_find_duplicates(self, customer_mock):
+        """It should write the merge report of the duplicates"""
+        customer_mock.duplicate_rows.return_value = iter(
+            [(1, "Ada", "Lovelace", "1 Byron St", "12345"), (2, "ada", "Lovelace", "1 Byron St.", "12345")]
+        )
+        result = self.runner.invoke(find_duplicates_command, ["--workers", "1"])
+        self.assertEqual(result.exit_code, 0)
+        report = json.loads(result.output)
+        self.assertEqual(report["groups"], [{"keep": 1, "duplicates": [2], "score": 1.0}])
@@ -0,0 +1,94 @@
+"""
+Test cases for Compression
+"""
+import gzip
+import json
+import zlib
+from unittest import TestCase
+
+import brotli
+import zstandard
+
+from service import app
+from service.common import status
+from service.common.compression import compress_stream
+from service.models import CustomerChange
+from tests.factories import CustomerFactory
+
+BASE_URL = "/api/customers"
+DECOMPRESS = {
+    "gzip": gzip.decompress,
+    "br": brotli.decompress,
+    "zstd": lambda body: zstandard.ZstdDecompressor().decompressobj().decompress(body),
+}
+
+
+######################################################################
+#  C O M P R E S S I O N   T E S T   C A S E S
+######################################################################
+class TestCompression(TestCase):
+    """Test Cases for Compression"""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_negotiate_encoding(self):
+        """It should compress large responses with the coding the client prefers"""
+        for _ in range(10):
+            self.client.post(BASE_URL, json=CustomerFactory().serialize())
+        plain = self.client.get(BASE_URL)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+        for encoding, decompress in DECOMPRESS.items():
+            response = self.client.get(BASE_URL, headers={"Accept-Encoding": encoding})
+            self.assertEqual(response.headers["Content-Encoding"], encoding)
+            self.assertEqual(json.loads(decompress(response.data)), plain.get_json())
+        response = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip, zstd;q=0"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+
+    def test_small_responses_are_not_compressed(self):
+        """It should not compress bodies below the size threshold"""
+        response = self.client.get(f"{BASE_URL}/0", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_compress_stream_incrementally(self):
+        """It should flush every chunk so it can be decoded right away"""
+        chunks = [b"retry: 3000\n\n", b"id: 1\ndata: {}\n\n", b": keep-alive\n\n"]
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        stream = compress_stream(iter(chunks), "gzip")
+        for chunk in chunks:
+            self.assertEqual(decompressor.decompress(next(stream)), chunk)
+        decompressor.decompress(next(stream))
+        self.assertTrue(decompressor.eof)
+
+    def test_compressed_event_stream(self):
+        """It should compress Server-Sent Events without buffering them"""
+        response = self.client.get(
+            f"{BASE_URL}/stream",
+            query_string={"since": CustomerChange.last_seq()},
+            headers={"Accept-Encoding": "gzip"},
+            buffered=False,
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(next(iter(response.response))), b"retry: 3000\n\n")
+        response.close()
+
+    def test_gzip_request_body(self):
+        """It should accept gzip encoded request bodies"""
+        body = gzip.compress(json.dumps(CustomerFactory().serialize()).encode())
+        headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        response = self.client.post(BASE_URL, data=body, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(BASE_URL, data=body[:-10], headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(BASE_URL, data=body, headers=dict(headers, **{"Content-Encoding": "br"}))
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_gzip_bomb(self):
+        """It should refuse request bodies that decompress beyond the limit"""
+        body = gzip.compress(b" " * (app.config["MAX_DECOMPRESSED_REQUEST_BYTES"] + 1))
+        headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        response = self.client.post(BASE_URL, data=body, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
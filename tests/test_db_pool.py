@@ -0,0 +1,79 @@
+"""
+Test cases for the Database Connection Pool
+"""
+import sqlite3
+import time
+from unittest import TestCase
+
+from flask import g
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from service import app
+from service.common.db_pool import TimedQueuePool, pool_status
+from service.common.deadlines import DeadlineExceeded
+
+
+def _connect():
+    """Creates a raw DBAPI connection for the pool"""
+    return sqlite3.connect(":memory:", check_same_thread=False)
+
+
+######################################################################
+#  D B   P O O L   T E S T   C A S E S
+######################################################################
+class TestTimedQueuePool(TestCase):
+    """Test Cases for the TimedQueuePool"""
+
+    def test_records_checkouts(self):
+        """It should record every connection checkout"""
+        pool = TimedQueuePool(_connect, pool_size=2, max_overflow=0)
+        conn = pool.connect()
+        conn.close()
+        conn = pool.connect()
+        conn.close()
+        stats = pool.wait_stats()
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["timeouts"], 0)
+        self.assertGreaterEqual(stats["max_wait_ms"], 0.0)
+
+    def test_records_timeouts(self):
+        """It should count checkouts that time out"""
+        pool = TimedQueuePool(_connect, pool_size=1, max_overflow=0, timeout=0.01)
+        conn = pool.connect()
+        self.assertRaises(Exception, pool.connect)
+        conn.close()
+        self.assertEqual(pool.wait_stats()["timeouts"], 1)
+        self.assertGreaterEqual(pool.recent_wait(), 0.0)
+
+    def test_checkout_deadline(self):
+        """It should wait for a connection no longer than the request has left"""
+        pool = TimedQueuePool(_connect, pool_size=1, max_overflow=0, timeout=30)
+        conn = pool.connect()
+        with app.test_request_context():
+            g.deadline = time.monotonic() + 0.1
+            start = time.monotonic()
+            self.assertRaises(DeadlineExceeded, pool.connect)
+            self.assertLess(time.monotonic() - start, 5)
+        conn.close()
+        self.assertEqual(pool.timeout(), 30)
+        self.assertEqual(pool.recreate().timeout(), 30)
+        self.assertEqual(pool.wait_stats()["timeouts"], 1)
+
+    def test_pool_status(self):
+        """It should report the live pool statistics"""
+        engine = create_engine("sqlite://", creator=_connect, poolclass=TimedQueuePool,
+                               pool_size=3, max_overflow=1)
+        with engine.connect():
+            stats = pool_status(engine)
+            self.assertEqual(stats["pool_class"], "TimedQueuePool")
+            self.assertEqual(stats["size"], 3)
+            self.assertEqual(stats["max_overflow"], 1)
+            self.assertEqual(stats["checked_out"], 1)
+        self.assertEqual(pool_status(engine)["checked_out"], 0)
+
+    def test_pool_status_other_pools(self):
+        """It should report the status of pools without a queue"""
+        engine = create_engine("sqlite://", creator=_connect, poolclass=NullPool)
+        stats = pool_status(engine)
+        self.assertEqual(stats["pool_class"], "NullPool")
+        self.assertIn("status", stats)
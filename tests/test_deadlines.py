@@ -0,0 +1,94 @@
+"""
+Test cases for Request Deadlines
+"""
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import g
+from sqlalchemy import text
+
+from service import app
+from service.common import status
+from service.common.deadlines import DEADLINE_HEADER, DeadlineExceeded, remaining, time_limit
+from service.models import Customer, db
+from service.routes import result_cache
+
+# A query that keeps SQLite busy for many seconds
+SLOW_QUERY = text(
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+    "SELECT count(*) FROM n"
+)
+
+
+######################################################################
+#  D E A D L I N E   T E S T   C A S E S
+######################################################################
+class TestDeadlines(TestCase):
+    """Test Cases for Request Deadlines"""
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.remove()
+
+    def test_no_deadline_outside_requests(self):
+        """It should not limit work outside of a request"""
+        with app.app_context():
+            self.assertIsNone(remaining())
+
+    def test_header_lowers_deadline(self):
+        """It should let clients lower the deadline but not raise it"""
+        with app.app_context(), app.test_request_context("/api/customers", headers={DEADLINE_HEADER: "100"}):
+            app.preprocess_request()
+            self.assertLessEqual(remaining(), 0.1)
+        with app.app_context(), app.test_request_context("/api/customers", headers={DEADLINE_HEADER: "99999999"}):
+            app.preprocess_request()
+            self.assertLessEqual(remaining(), app.config["REQUEST_DEADLINE_MS"] / 1000.0)
+
+    def test_no_deadline_for_streams(self):
+        """It should not give long-lived requests a deadline"""
+        with app.app_context(), app.test_request_context("/api/customers/changes?wait=5"):
+            app.preprocess_request()
+            self.assertIsNone(remaining())
+
+    def test_expired_deadline(self):
+        """It should not start a statement after the deadline"""
+        with app.app_context(), app.test_request_context():
+            g.deadline = time.monotonic() - 1
+            self.assertRaises(DeadlineExceeded, db.session.execute, text("SELECT 1"))
+
+    def test_interrupt_slow_statement(self):
+        """It should interrupt a statement that runs past the deadline"""
+        with app.app_context(), app.test_request_context():
+            g.deadline = time.monotonic() + 0.1
+            start = time.monotonic()
+            self.assertRaises(DeadlineExceeded, db.session.execute, SLOW_QUERY)
+            self.assertLess(time.monotonic() - start, 5)
+
+    def test_time_limit(self):
+        """It should bound the statements of a block and restore the deadline after it"""
+        with app.app_context(), app.test_request_context():
+            g.deadline = None
+            start = time.monotonic()
+            with self.assertRaises(DeadlineExceeded), time_limit(0.1), db.engine.begin() as connection:
+                connection.execute(SLOW_QUERY)
+            self.assertLess(time.monotonic() - start, 5)
+            self.assertIsNone(remaining())
+            g.deadline = time.monotonic() + 0.05
+            with time_limit(10):
+                self.assertLessEqual(remaining(), 0.05)
+
+    def test_deadline_returns_504(self):
+        """It should answer a request that ran out of time with 504"""
+        query_rows = Customer.rows
+
+        def slow_rows(active=None):
+            time.sleep(0.01)
+            return query_rows(active)
+
+        client = app.test_client()
+        result_cache.clear()
+        with patch("service.models.Customer.rows", side_effect=slow_rows):
+            response = client.get("/api/customers", headers={DEADLINE_HEADER: "1"})
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertEqual(response.get_json()["error"], "Gateway Timeout")
@@ -0,0 +1,107 @@
+"""
+Test cases for Duplicate Detection
+"""
+from unittest import TestCase
+from unittest.mock import patch
+
+from click.testing import CliRunner
+from service import admin_routes, app
+from service.common import status
+from service.common.cli_commands import find_duplicates_command
+from service.common.duplicates import batch_blocks, blocking_key, find_duplicates, group_pairs, normalize
+from service.models import Customer, DuplicateRun, db
+from tests.factories import CustomerFactory
+
+ROWS = [
+    (1, "José", "García", "12 Main St.", "10001"),
+    (2, "Jose", "Garcia", "12 Main St", "10001 "),
+    (3, "Maria", "Lopez", "4 Elm Rd", "10001"),
+    (4, "John", "Smith", "1 Oak Ave", "94105"),
+    (5, "Jon", "Smith", "1 Oak Ave.", "94105"),
+    (7, "Johnny", "Smith", "1 Oak Avenue", "94105"),
+    (6, "Jon", "Smith", "1 Oak Ave", "94107"),
+]
+
+
+######################################################################
+#  D U P L I C A T E   D E T E C T I O N   T E S T   C A S E S
+######################################################################
+class TestDuplicates(TestCase):
+    """Test Cases for Duplicate Detection"""
+
+    def test_normalize(self):
+        """It should ignore case, accents and punctuation"""
+        self.assertEqual(normalize("  José-María  O'Neil "), "jose maria o neil")
+        self.assertEqual(normalize(None), "")
+
+    def test_batch_whole_blocks(self):
+        """It should never split a block across batches"""
+        batches = list(batch_blocks(ROWS, batch_size=2))
+        self.assertEqual([len(block) for batch in batches for block in batch], [3, 3, 1])
+
+    def test_group_pairs(self):
+        """It should join chained pairs into one group"""
+        groups = group_pairs([(1, 2, 0.9), (2, 3, 0.95), (5, 6, 1.0)])
+        self.assertEqual(groups[0], {"keep": 1, "duplicates": [2, 3], "score": 0.9})
+        self.assertEqual(groups[1]["duplicates"], [6])
+
+    def test_find_duplicates(self):
+        """It should find the duplicates within a postal code only"""
+        for workers in (1, 2):
+            report = find_duplicates(iter(ROWS), window=5, threshold=0.85, workers=workers)
+            self.assertEqual(report["customers"], 7)
+            self.assertEqual(report["blocks"], 3)
+            keeps = {group["keep"]: group["duplicates"] for group in report["groups"]}
+            self.assertEqual(keeps[1], [2])
+            self.assertIn(5, keeps[4])
+            # the same person in another postal code is in another block
+            self.assertNotIn(6, keeps[4])
+
+    def test_rows_ordered_by_block(self):
+        """It should stream the rows of a block one after the other"""
+        db.session.query(Customer).delete()
+        db.session.commit()
+        for postalcode in ("10-001", "10002", "10001", "1000 2"):
+            CustomerFactory(postalcode=postalcode).create()
+        keys = [blocking_key(row[4]) for row in Customer.duplicate_rows()]
+        self.assertEqual(keys, ["10001", "10001", "10002", "10002"])
+
+    def test_admin_duplicates(self):
+        """It should run the duplicate detection for an admin, one run at a time"""
+        db.session.query(Customer).delete()
+        db.session.query(DuplicateRun).delete()
+        db.session.commit()
+        for _ in range(2):
+            customer = CustomerFactory(f_name="Ada", l_name="Lovelace", street="1 Byron St", postalcode="12345")
+            customer.create()
+        client = app.test_client()
+        headers = {"Authorization": "Bearer s3cr3t"}
+        with patch.dict(app.config, {"ADMIN_TOKEN": "s3cr3t"}), patch.object(admin_routes.subprocess, "Popen") as popen:
+            self.assertEqual(client.post("/admin/duplicates").status_code, status.HTTP_401_UNAUTHORIZED)
+            response = client.post("/admin/duplicates", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            run_id = response.get_json()["id"]
+            command = popen.call_args[0][0]
+            self.assertEqual(command[command.index("--run") + 1], str(run_id))
+            # a second run is refused while the first one runs
+            self.assertEqual(client.post("/admin/duplicates", headers=headers).status_code, status.HTTP_409_CONFLICT)
+
+            # the process started by the endpoint runs the command
+            result = CliRunner().invoke(find_duplicates_command, ["--workers", "1", "--run", str(run_id)])
+            self.assertEqual(result.exit_code, 0)
+            state = client.get("/admin/duplicates", headers=headers).get_json()
+        self.assertEqual(state["state"], "done")
+        self.assertEqual(state["report"]["duplicates"], 1)
+        self.assertEqual(client.get("/admin/duplicates", headers=headers).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_abandoned_run(self):
+        """It should let a new run start once the running one timed out"""
+        db.session.query(DuplicateRun).delete()
+        db.session.commit()
+        self.assertIsNotNone(DuplicateRun.begin(timeout=3600))
+        self.assertIsNone(DuplicateRun.begin(timeout=3600))
+        run = DuplicateRun.begin(timeout=-1)
+        self.assertIsNotNone(run)
+        self.assertEqual([run.state for run in DuplicateRun.query.order_by(DuplicateRun.id)], ["failed", "running"])
+        run.finish(error="stopped")
+        self.assertEqual(DuplicateRun.latest().serialize()["error"], "stopped")
@@ -0,0 +1,152 @@
+"""
+Test cases for Group Commit
+"""
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy.exc import IntegrityError
+
+from service import app, routes
+from service.common import status
+from service.common.deadlines import DeadlineExceeded
+from service.common.group_commit import GroupCommitWriter
+from service.common.replicas import LAST_WRITE_HEADER, ReplicaRouter
+from service.models import Customer, CustomerChange, IdempotencyKey, db
+from tests.factories import CustomerFactory
+
+BASE_URL = "/api/customers"
+
+
+######################################################################
+#  G R O U P   C O M M I T   T E S T   C A S E S
+######################################################################
+class TestGroupCommitWriter(TestCase):
+    """Test Cases for the GroupCommitWriter"""
+
+    def test_groups_concurrent_writes(self):
+        """It should write the items queued together in one group"""
+        groups = []
+        writer = GroupCommitWriter(app, groups.append, max_rows=5, max_delay=0.2)
+        with patch.object(db.session, "commit") as commit:
+            futures = [writer.submit(number) for number in range(12)]
+            self.assertEqual([future.result(5) for future in futures], list(range(12)))
+        self.assertEqual([len(group) for group in groups], [5, 5, 2])
+        self.assertEqual(commit.call_count, 3)
+        self.assertEqual(writer.stats()["largest"], 5)
+        self.assertEqual(writer.stats()["items"], 12)
+
+    def test_bad_item_does_not_fail_its_group(self):
+        """It should retry the items of a failed group one by one"""
+
+        def write(items):
+            if "bad" in items:
+                raise IntegrityError("INSERT", {}, Exception("duplicate"))
+
+        writer = GroupCommitWriter(app, write, max_rows=3, max_delay=0.2)
+        with patch.object(db.session, "commit"):
+            futures = [writer.submit(item) for item in ("good", "bad", "fine")]
+            self.assertEqual(futures[0].result(5), "good")
+            self.assertRaises(IntegrityError, futures[1].result, 5)
+            self.assertEqual(futures[2].result(5), "fine")
+
+    def test_write_past_deadline(self):
+        """It should drop a write still queued at the deadline"""
+        release = threading.Event()
+        written = []
+
+        def write(items):
+            release.wait(5)
+            written.extend(items)
+
+        writer = GroupCommitWriter(app, write, max_rows=1, max_delay=0)
+        with patch.object(db.session, "commit"):
+            first = writer.submit("first")
+            self.assertRaises(DeadlineExceeded, writer.write, "late", 0.05)
+            release.set()
+            self.assertEqual(first.result(5), "first")
+            # the next item goes through the writer after the cancelled one
+            self.assertEqual(writer.write("next", 5), "next")
+        self.assertEqual(written, ["first", "next"])
+
+    def test_write_running_at_deadline(self):
+        """It should wait for a write that is being committed at the deadline"""
+        writer = GroupCommitWriter(app, lambda items: threading.Event().wait(0.2), max_delay=0)
+        with patch.object(db.session, "commit"):
+            self.assertEqual(writer.write("slow", 0.05), "slow")
+
+
+class TestGroupCommitRoutes(TestCase):
+    """Test Cases for creates with group commit"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.writer = GroupCommitWriter(app, routes.write_customers, max_rows=10, max_delay=0.05)
+
+    def tearDown(self):
+        db.session.remove()
+
+    def test_concurrent_creates(self):
+        """It should create concurrent customers with one INSERT and one commit"""
+        responses = []
+        bodies = [CustomerFactory().serialize() for _ in range(8)]
+
+        def create(body):
+            responses.append(self.client.post(BASE_URL, json=body))
+
+        last_seq = CustomerChange.last_seq()
+        with patch.object(routes, "GROUP_WRITER", self.writer):
+            threads = [threading.Thread(target=create, args=(body,)) for body in bodies]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertTrue(all(response.status_code == status.HTTP_201_CREATED for response in responses))
+        self.assertLess(self.writer.stats()["groups"], len(bodies))
+        db.session.remove()
+        for response in responses:
+            data = response.get_json()
+            self.assertTrue(response.headers["Location"].endswith(f"{BASE_URL}/{data['id']}"))
+            customer = Customer.find(data["id"])
+            self.assertEqual((customer.f_name, customer.l_name), (data["first_name"], data["last_name"]))
+        changes = CustomerChange.since(last_seq, 100)
+        self.assertEqual(
+            sorted(change.customer_id for change in changes),
+            sorted(int(response.get_json()["id"]) for response in responses),
+        )
+        self.assertEqual({change.operation for change in changes}, {"create"})
+
+    def test_create_forgets_cached_miss(self):
+        """It should forget the cached 404 of an id it creates"""
+        with patch.object(routes, "GROUP_WRITER", self.writer):
+            response = self.client.post(BASE_URL, json=CustomerFactory().serialize())
+        customer_id = int(response.get_json()["id"])
+        routes.negative_cache.add(customer_id + 1)
+        with patch.object(routes, "GROUP_WRITER", self.writer):
+            response = self.client.post(BASE_URL, json=CustomerFactory().serialize())
+        self.assertEqual(int(response.get_json()["id"]), customer_id + 1)
+        self.assertFalse(routes.negative_cache.is_missing(customer_id + 1))
+
+    def test_create_reads_own_write(self):
+        """It should keep the client of a grouped create reading from the primary"""
+        router = ReplicaRouter(["sqlite://"], sticky_seconds=60, secret="s3cr3t")
+        with patch.object(routes, "GROUP_WRITER", self.writer), patch.dict(app.extensions, {"replica_router": router}):
+            response = self.client.post(BASE_URL, json=CustomerFactory().serialize(), headers={"X-Client-ID": "grouped"})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertIn(LAST_WRITE_HEADER, response.headers)
+            self.assertTrue(router.is_sticky("grouped"))
+            response = self.client.get(response.headers["Location"], headers={"X-Client-ID": "grouped"})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        router.dispose()
+
+    def test_idempotent_create_is_not_grouped(self):
+        """It should commit a create sent with an Idempotency-Key on its own"""
+        IdempotencyKey.query.delete()
+        db.session.commit()
+        with patch.object(routes, "GROUP_WRITER", self.writer):
+            response = self.client.post(
+                BASE_URL, json=CustomerFactory().serialize(), headers={"Idempotency-Key": "not-grouped"}
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.writer.stats()["items"], 0)
@@ -0,0 +1,160 @@
+"""
+Test cases for the Health Checks
+"""
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from service import app, health_routes
+from service.common import status
+from service.common.health import HealthCheck
+from service.models import Customer, db
+from service.routes import stale_cache
+
+
+######################################################################
+#  H E A L T H   C H E C K   T E S T   C A S E S
+######################################################################
+class TestHealthCheck(TestCase):
+    """Test Cases for the HealthCheck"""
+
+    def test_cached_result(self):
+        """It should run the checks at most once per interval"""
+        check = MagicMock(return_value={"ok": True})
+        health = HealthCheck([("check", check)], ttl=0.05)
+        self.assertTrue(health.status()["ok"])
+        self.assertTrue(health.status()["ok"])
+        self.assertEqual(check.call_count, 1)
+        time.sleep(0.06)
+        health.status()
+        self.assertEqual(check.call_count, 2)
+        health.invalidate()
+        health.status()
+        self.assertEqual(check.call_count, 3)
+
+    def test_failed_check(self):
+        """It should not be ok when a check fails or raises"""
+
+        def unreachable():
+            raise ConnectionError("refused")
+
+        health = HealthCheck([("up", lambda: {"ok": True}), ("down", unreachable)])
+        result = health.status()
+        self.assertFalse(result["ok"])
+        self.assertTrue(result["checks"]["up"]["ok"])
+        self.assertEqual(result["checks"]["down"]["error"], "ConnectionError: refused")
+        self.assertIn("ms", result["checks"]["down"])
+
+    def test_probes_do_not_queue(self):
+        """It should answer from the last result while one probe runs the checks"""
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return {"ok": True}
+
+        health = HealthCheck([("slow", slow)], ttl=0)
+        thread = threading.Thread(target=health.status)
+        thread.start()
+        started.wait(5)
+        self.assertEqual(health.status(), {"ok": False, "checks": {}, "age": None})
+        release.set()
+        thread.join()
+        started.clear()
+        release.clear()
+        thread = threading.Thread(target=health.status)
+        thread.start()
+        started.wait(5)
+        self.assertTrue(health.status()["checks"]["slow"]["ok"])
+        release.set()
+        thread.join()
+
+
+class TestHealthRoutes(TestCase):
+    """Test Cases for the liveness and readiness probes"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        app.extensions["warmup"].wait(10)
+        health_routes.readiness.invalidate()
+
+    def tearDown(self):
+        app.extensions["circuit_breaker"].record_success()
+        health_routes.readiness.invalidate()
+        db.session.remove()
+
+    def test_live(self):
+        """It should always be live"""
+        response = self.client.get("/health/live")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["status"], "OK")
+
+    def test_ready(self):
+        """It should be ready when every check passes"""
+        response = self.client.get("/health/ready")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["status"], "OK")
+        self.assertEqual(set(data["checks"]), {"warmup", "pool", "database"})
+
+    def test_ready_is_cached(self):
+        """It should not query the database on every probe"""
+        self.client.get("/health/ready")
+        with patch.object(health_routes.readiness, "run", wraps=health_routes.readiness.run) as run:
+            self.client.get("/health/ready")
+        run.assert_not_called()
+
+    def test_not_ready_without_database(self):
+        """It should not be ready while the database is unreachable"""
+        stale_cache.clear()
+        app.extensions["circuit_breaker"].trip()
+        response = self.client.get("/health/ready")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        data = response.get_json()
+        self.assertEqual(data["status"], "Unavailable")
+        self.assertIn("CircuitOpen", data["checks"]["database"]["error"])
+        self.assertEqual(self.client.get("/health/live").status_code, status.HTTP_200_OK)
+
+    def test_ready_when_degraded(self):
+        """It should stay ready while the database is unreachable and stale reads can be served"""
+        stale_cache.clear()
+        stale_cache.put(("customer", 1), {"id": 1})
+        app.extensions["circuit_breaker"].trip()
+        response = self.client.get("/health/ready")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["status"], "Degraded")
+        self.assertTrue(data["checks"]["database"]["degraded"])
+        self.assertEqual(data["checks"]["database"]["stale_entries"], 1)
+        health_routes.readiness.invalidate()
+        with patch.dict(app.config, {"HEALTH_READY_WHEN_DEGRADED": False}):
+            response = self.client.get("/health/ready")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        stale_cache.clear()
+
+    def test_live_without_database(self):
+        """It should not retry creating the tables on a probe after a degraded start"""
+        with patch.dict(app.extensions, {"db_ready": False}), patch.object(
+            Customer, "create_tables"
+        ) as create_tables:
+            self.assertEqual(self.client.get("/health/live").status_code, status.HTTP_200_OK)
+            create_tables.assert_not_called()
+            self.client.get("/api/customers")
+            create_tables.assert_called_once()
+
+    def test_pool_headroom(self):
+        """It should not be ready when the pool is exhausted and requests queue"""
+        stats = {"pool_class": "TimedQueuePool", "size": 5, "max_overflow": 10, "checked_out": 15}
+        with patch.object(health_routes, "pool_status", return_value=stats), patch.object(
+            health_routes, "recent_wait", return_value=2.0
+        ):
+            result = health_routes.check_pool()
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["headroom"], 0)
+        stats["checked_out"] = 3
+        with patch.object(health_routes, "pool_status", return_value=stats), patch.object(
+            health_routes, "recent_wait", return_value=2.0
+        ):
+            self.assertTrue(health_routes.check_pool()["ok"])
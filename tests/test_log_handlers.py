@@ -0,0 +1,143 @@
+"""
+Test cases for the Log Handlers
+"""
+import json
+import logging
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from service import app
+from service.common import log_handlers
+from service.common.log_handlers import (
+    DATE_FORMAT,
+    TEXT_FORMAT,
+    JsonFormatter,
+    RequestSamplingFilter,
+    TextFormatter,
+    lazy,
+)
+from tests.factories import CustomerFactory
+
+
+class ListHandler(logging.Handler):
+    """Collects the formatted records"""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+######################################################################
+#  L O G   H A N D L E R S   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """Test Cases for the logging setup"""
+
+    def setUp(self):
+        self.handler = ListHandler()
+        self.gunicorn_logger = logging.getLogger("test.gunicorn")
+        self.gunicorn_logger.handlers = [self.handler]
+        self.gunicorn_logger.setLevel(logging.INFO)
+        self.old_handlers = app.logger.handlers
+        self.old_level = app.logger.level
+
+    def tearDown(self):
+        log_handlers.stop_listener(app)
+        app.config["LOG_INFO_SAMPLE_RATE"] = 1.0
+        app.logger.handlers = self.old_handlers
+        app.logger.setLevel(self.old_level)
+
+    def test_queue_logging(self):
+        """It should write the records from the listener thread"""
+        log_handlers.init_logging(app, "test.gunicorn")
+        self.assertIsInstance(app.logger.handlers[0], log_handlers.DeferredQueueHandler)
+        app.logger.info("Hello %s", "world")
+        log_handlers.stop_listener(app)
+        self.assertTrue(self.handler.lines[-1].endswith("Hello world"))
+        self.assertIn("[INFO]", self.handler.lines[-1])
+
+    def test_lazy_arguments(self):
+        """It should only evaluate lazy arguments for enabled levels"""
+        log_handlers.init_logging(app, "test.gunicorn")
+        func = MagicMock(return_value="expensive")
+        app.logger.debug("Value %s", lazy(func))
+        func.assert_not_called()
+        app.logger.info("Value %s", lazy(func))
+        log_handlers.stop_listener(app)
+        func.assert_called_once()
+        self.assertTrue(self.handler.lines[-1].endswith("Value expensive"))
+
+    def test_request_sampling(self):
+        """It should drop sampled INFO lines from requests only"""
+        log_filter = RequestSamplingFilter(0.0)
+        info = logging.LogRecord("flask.app", logging.INFO, __file__, 1, "info", None, None)
+        error = logging.LogRecord("flask.app", logging.ERROR, __file__, 1, "error", None, None)
+        self.assertTrue(log_filter.filter(info))
+        with app.test_request_context("/"):
+            self.assertFalse(log_filter.filter(info))
+            self.assertTrue(log_filter.filter(error))
+            self.assertTrue(RequestSamplingFilter(1.0).filter(info))
+
+    def test_queue_disabled(self):
+        """It should log directly when the queue is disabled"""
+        app.config["LOG_QUEUE_ENABLED"] = False
+        try:
+            log_handlers.init_logging(app, "test.gunicorn")
+        finally:
+            app.config["LOG_QUEUE_ENABLED"] = True
+        self.assertEqual(app.logger.handlers, [self.handler])
+        self.assertNotIn("log_listener", app.extensions)
+
+    def test_json_format(self):
+        """It should format records as one line of JSON"""
+        record = logging.LogRecord("flask.app", logging.INFO, __file__, 1, "Hello %s", ("world",), None)
+        record.request_id = "abc"
+        record.status = 200
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "Hello world")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["request_id"], "abc")
+        self.assertEqual(entry["status"], 200)
+
+    def test_text_format(self):
+        """It should put the request id on text lines and a dash outside of requests"""
+        formatter = TextFormatter(TEXT_FORMAT, DATE_FORMAT)
+        record = logging.LogRecord("flask.app", logging.INFO, __file__, 1, "Hello", (), None)
+        self.assertTrue(formatter.format(record).endswith("[test_log_handlers] [-] Hello"))
+        record.request_id = "abc"
+        self.assertTrue(formatter.format(record).endswith("[test_log_handlers] [abc] Hello"))
+
+    def test_access_log(self):
+        """It should log one JSON line per request with its request id"""
+        app.config["LOG_FORMAT"] = "json"
+        try:
+            log_handlers.init_logging(app, "test.gunicorn")
+        finally:
+            app.config["LOG_FORMAT"] = "text"
+        client = app.test_client()
+        response = client.post(
+            "/api/customers",
+            json=CustomerFactory().serialize(),
+            headers={"X-Request-ID": "test-request-1"},
+        )
+        self.assertEqual(response.headers["X-Request-ID"], "test-request-1")
+        log_handlers.stop_listener(app)
+        entries = [json.loads(line) for line in self.handler.lines]
+        access = [entry for entry in entries if "latency_ms" in entry][-1]
+        self.assertEqual(access["request_id"], "test-request-1")
+        self.assertEqual(access["route"], "/api/customers")
+        self.assertEqual(access["status"], 201)
+        self.assertGreater(access["db_statements"], 0)
+        self.assertGreaterEqual(access["row_count"], 1)
+        # every line of the request carries its id
+        self.assertTrue(all(entry.get("request_id") == "test-request-1" for entry in entries[1:]))
+
+    def test_generated_request_id(self):
+        """It should generate a request id when the client sends none or a bad one"""
+        client = app.test_client()
+        response = client.get("/health", headers={"X-Request-ID": "bad id!"})
+        self.assertEqual(len(response.headers["X-Request-ID"]), 32)
+        self.assertNotEqual(response.headers["X-Request-ID"], client.get("/health").headers["X-Request-ID"])
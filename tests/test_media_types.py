@@ -0,0 +1,76 @@
+"""
+Test cases for the binary Media Types
+"""
+from unittest import TestCase
+
+import cbor2
+import msgpack
+from service import app
+from service.common import status
+from service.common.media_types import CBOR, MSGPACK, decode, encode
+from tests.factories import CustomerFactory
+
+BASE_URL = "/api/customers"
+
+
+######################################################################
+#  M E D I A   T Y P E   T E S T   C A S E S
+######################################################################
+class TestMediaTypes(TestCase):
+    """Test Cases for MessagePack and CBOR negotiation"""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_round_trip(self):
+        """It should decode what it encodes"""
+        document = CustomerFactory().serialize()
+        for media_type in (MSGPACK, CBOR, "application/json", "application/x-msgpack"):
+            self.assertEqual(decode(encode(document, media_type), media_type), document)
+        self.assertRaises(ValueError, decode, b"\xc1", MSGPACK)
+        self.assertRaises(ValueError, decode, b"{}", "text/plain")
+
+    def test_create_with_msgpack(self):
+        """It should create a Customer sent and returned as MessagePack"""
+        customer = CustomerFactory().serialize()
+        response = self.client.post(
+            BASE_URL,
+            data=msgpack.packb(customer),
+            headers={"Content-Type": MSGPACK, "Accept": MSGPACK},
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.mimetype, MSGPACK)
+        created = msgpack.unpackb(response.data)
+        self.assertEqual(created["first_name"], customer["first_name"])
+
+        # the same customer read back as CBOR and as JSON
+        response = self.client.get(f"{BASE_URL}/{created['id']}", headers={"Accept": CBOR})
+        self.assertEqual(response.mimetype, CBOR)
+        self.assertEqual(cbor2.loads(response.data), created)
+        response = self.client.get(f"{BASE_URL}/{created['id']}")
+        self.assertEqual(response.get_json(), created)
+
+    def test_update_with_cbor(self):
+        """It should update a Customer sent as CBOR"""
+        response = self.client.post(BASE_URL, json=CustomerFactory().serialize())
+        customer = response.get_json()
+        customer["last_name"] = "Binary"
+        response = self.client.put(
+            f"{BASE_URL}/{customer['id']}", data=cbor2.dumps(customer), headers={"Content-Type": CBOR}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["last_name"], "Binary")
+
+    def test_list_and_errors(self):
+        """It should answer lists and errors in the accepted media type"""
+        self.client.post(BASE_URL, json=CustomerFactory().serialize())
+        response = self.client.get(BASE_URL, headers={"Accept": MSGPACK})
+        self.assertEqual(msgpack.unpackb(response.data), self.client.get(BASE_URL).get_json())
+        response = self.client.get(f"{BASE_URL}/0", headers={"Accept": MSGPACK})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn("was not found", msgpack.unpackb(response.data)["message"])
+
+    def test_bad_binary_body(self):
+        """It should reject a body that is not valid in its media type"""
+        response = self.client.post(BASE_URL, data=b"\xc1", headers={"Content-Type": MSGPACK})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,104 @@
+"""
+Test cases for the Negative Cache
+"""
+import time
+from unittest import TestCase
+
+from service import app
+from service.common.negative_cache import BloomFilter, NegativeCache
+
+
+######################################################################
+#  N E G A T I V E   C A C H E   T E S T   C A S E S
+######################################################################
+class TestNegativeCache(TestCase):
+    """Test Cases for the NegativeCache"""
+
+    def test_bloom_filter(self):
+        """It should contain every added item and few others"""
+        bloom = BloomFilter(1000, 0.01)
+        for item in range(1000):
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in range(1000)))
+        false_positives = sum(item in bloom for item in range(1000, 11000))
+        self.assertLess(false_positives, 300)
+
+    def test_remember_misses(self):
+        """It should remember missing ids until they expire"""
+        cache = NegativeCache(ttl=0.05)
+        self.assertFalse(cache.is_missing(7))
+        cache.add(7)
+        self.assertTrue(cache.is_missing(7))
+        time.sleep(0.1)
+        self.assertFalse(cache.is_missing(7))
+
+    def test_invalid_ids(self):
+        """It should treat ids below 1 as missing"""
+        self.assertTrue(NegativeCache().is_missing(0))
+
+    def test_discard(self):
+        """It should forget a miss when the id is created"""
+        cache = NegativeCache()
+        cache.add(7)
+        cache.discard(7)
+        self.assertFalse(cache.is_missing(7))
+
+    def test_max_size(self):
+        """It should forget the oldest misses above the maximum size"""
+        cache = NegativeCache(max_size=2)
+        for customer_id in (1, 2, 3):
+            cache.add(customer_id)
+        self.assertFalse(cache.is_missing(1))
+        self.assertTrue(cache.is_missing(3))
+        cache.clear()
+        self.assertFalse(cache.is_missing(3))
+
+    def test_bloom_rejects_unknown_ids(self):
+        """It should reject ids that are not in the table snapshot"""
+        cache = NegativeCache(app, load_ids=lambda: (10, 3, iter([2, 5, 10])), bloom_refresh=60, lag=0.05)
+        self.assertTrue(cache.bloom_stale())
+        cache.refresh_bloom(background=False)
+        # a lower id may still commit after the first snapshot
+        self.assertFalse(cache.is_missing(4))
+        time.sleep(0.1)
+        self.assertTrue(cache.bloom_stale())
+        cache.refresh_bloom(background=False)
+        self.assertFalse(cache.bloom_stale())
+        self.assertFalse(cache.is_missing(5))
+        self.assertTrue(cache.is_missing(4))
+        # ids created after the snapshot are not rejected
+        self.assertFalse(cache.is_missing(11))
+        cache.discard(4)
+        self.assertFalse(cache.is_missing(4))
+
+    def test_bloom_watermark(self):
+        """It should only reject ids up to the largest id of a snapshot older than the lag"""
+        snapshots = iter([[2, 5], [2, 5, 10], [2, 5, 10, 12], [2, 5, 10, 12]])
+
+        def load_ids():
+            ids = next(snapshots)
+            return max(ids), len(ids), iter(ids)
+
+        cache = NegativeCache(app, load_ids=load_ids, lag=0.05)
+        cache.rebuild_bloom()
+        time.sleep(0.1)
+        cache.rebuild_bloom()
+        self.assertTrue(cache.is_missing(4))
+        # 7 is above the watermark of 5 so it may be a create committing late
+        self.assertFalse(cache.is_missing(7))
+        # a rebuild before the lag keeps the watermark
+        cache.rebuild_bloom()
+        self.assertFalse(cache.is_missing(7))
+        time.sleep(0.1)
+        cache.rebuild_bloom()
+        self.assertTrue(cache.is_missing(7))
+        self.assertFalse(cache.is_missing(10))
+
+    def test_bloom_load_error(self):
+        """It should keep working when the ids cannot be loaded"""
+        def fail():
+            raise RuntimeError("database is down")
+
+        cache = NegativeCache(app, load_ids=fail)
+        cache.refresh_bloom(background=False)
+        self.assertFalse(cache.is_missing(4))
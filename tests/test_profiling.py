@@ -0,0 +1,145 @@
+"""
+Test cases for Request Profiling
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from unittest import TestCase
+from unittest.mock import patch
+
+from service import app
+from service.common import status
+from service.common.profiling import PROFILE_HEADER, PROFILE_ID_HEADER, StackSampler, collapse, top_functions
+from service.models import db
+
+BASE_URL = "/api/customers"
+
+
+def busy_loop(seconds):
+    """Keeps the thread on the CPU for a while"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+######################################################################
+#  P R O F I L I N G   T E S T   C A S E S
+######################################################################
+class TestProfiling(TestCase):
+    """Test Cases for the stack sampling"""
+
+    def test_sample_stacks(self):
+        """It should see the function a thread spends its time in"""
+        sampler = StackSampler(threading.get_ident(), 0.001)
+        sampler.start()
+        busy_loop(0.05)
+        stacks = sampler.stop()
+        self.assertGreater(sum(stacks.values()), 0)
+        top = top_functions(stacks, 1)[0]
+        self.assertTrue(top["function"].startswith("busy_loop (tests/test_profiling.py:"))
+
+    def test_collapse(self):
+        """It should render the stacks for flamegraph.pl and count each function once per stack"""
+        stacks = Counter({("main", "handle", "query"): 3, ("main", "handle"): 1, ("main", "main"): 1})
+        self.assertEqual(collapse(stacks), "main;handle 1\nmain;handle;query 3\nmain;main 1\n")
+        summary = {row["function"]: row for row in top_functions(stacks)}
+        self.assertEqual(summary["query"]["own"], 3)
+        self.assertEqual(summary["handle"]["total"], 4)
+        self.assertEqual(summary["main"]["total_pct"], 100.0)
+
+
+class TestProfilingRoutes(TestCase):
+    """Test Cases for the profiled requests"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.directory = tempfile.mkdtemp()
+        self.config = patch.dict(app.config, {"PROFILE_DIR": self.directory, "PROFILE_TOKEN": "s3cr3t"})
+        self.config.start()
+        self.headers = {PROFILE_HEADER: "s3cr3t"}
+
+    def tearDown(self):
+        self.config.stop()
+        shutil.rmtree(self.directory)
+        db.session.remove()
+
+    def test_not_profiled(self):
+        """It should not profile a request without the right header"""
+        response = self.client.get(BASE_URL, headers={PROFILE_HEADER: "guess"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn(PROFILE_ID_HEADER, response.headers)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_profile_with_header(self):
+        """It should write the collapsed stacks and summary of a request sent with the token"""
+        response = self.client.get(BASE_URL, headers={PROFILE_HEADER: "s3cr3t"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        name = response.headers[PROFILE_ID_HEADER]
+        self.assertIn("customer_collection", name)
+        self.assertEqual(sorted(os.listdir(self.directory)), [name + ".collapsed", name + ".txt"])
+        summary = self.client.get(f"/admin/profiles/{name}.txt", headers=self.headers)
+        self.assertEqual(summary.status_code, status.HTTP_200_OK)
+        self.assertTrue(summary.get_data(as_text=True).startswith("GET /api/customers 200\n"))
+        profiles = self.client.get("/admin/profiles", headers=self.headers).get_json()
+        self.assertEqual(profiles[0]["name"], name)
+
+    def test_cprofile_mode(self):
+        """It should add the cProfile stats in cprofile mode"""
+        with patch.dict(app.config, {"PROFILE_MODE": "cprofile"}):
+            response = self.client.get(BASE_URL, headers={PROFILE_HEADER: "s3cr3t"})
+        name = response.headers[PROFILE_ID_HEADER]
+        self.assertTrue(os.path.exists(os.path.join(self.directory, name + ".prof")))
+        with open(os.path.join(self.directory, name + ".txt"), encoding="utf-8") as summary:
+            self.assertIn("cumulative", summary.read())
+
+    def test_sample_rate(self):
+        """It should profile the sampled API requests only and keep the most recent ones"""
+        with patch.dict(app.config, {"PROFILE_TOKEN": "", "PROFILE_SAMPLE_RATE": 1.0, "PROFILE_MAX_PROFILES": 2}):
+            self.assertNotIn(PROFILE_ID_HEADER, self.client.get("/health/live").headers)
+            names = [self.client.get(BASE_URL).headers[PROFILE_ID_HEADER] for _ in range(3)]
+        self.assertEqual(len(set(names)), 3)
+        profiles = self.client.get("/admin/profiles", headers=self.headers).get_json()
+        self.assertEqual([profile["name"] for profile in profiles][-1], names[1])
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+
+    def test_unknown_file(self):
+        """It should only serve profile files"""
+        for file_name in ("passwd", "missing.txt"):
+            response = self.client.get(f"/admin/profiles/{file_name}", headers=self.headers)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_profiles_need_token(self):
+        """It should only serve the profiles to requests sent with the profiling token"""
+        response = self.client.get(BASE_URL, headers=self.headers)
+        name = response.headers[PROFILE_ID_HEADER]
+        self.assertEqual(self.client.get("/admin/profiles").status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(f"/admin/profiles/{name}.txt", headers={PROFILE_HEADER: "guess"})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        with patch.dict(app.config, {"PROFILE_TOKEN": ""}):
+            self.assertEqual(self.client.get("/admin/profiles").status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_non_ascii_header(self):
+        """It should not profile a request with a header that is not ASCII"""
+        response = self.client.get(BASE_URL, headers={PROFILE_HEADER: "s3cr\u00e9t"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn(PROFILE_ID_HEADER, response.headers)
+
+    def test_write_failure(self):
+        """It should answer the request when its profile cannot be written"""
+        with patch("service.common.profiling.Profiler.stop", side_effect=OSError("disk full")):
+            response = self.client.get(BASE_URL, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn(PROFILE_ID_HEADER, response.headers)
+        self.assertIn(PROFILE_ID_HEADER, self.client.get(BASE_URL, headers=self.headers).headers)
+
+    def test_profile_batch(self):
+        """It should profile a whole batch, not stop at its first sub-request"""
+        operations = [{"method": "GET", "path": BASE_URL}, {"method": "GET", "path": f"{BASE_URL}?active=true"}]
+        response = self.client.post("/api/batch", json={"operations": operations}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        name = response.headers[PROFILE_ID_HEADER]
+        self.assertIn(name + ".txt", os.listdir(self.directory))
+        self.assertIn(PROFILE_ID_HEADER, self.client.get(BASE_URL, headers=self.headers).headers)
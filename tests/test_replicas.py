@@ -0,0 +1,122 @@
+"""
+Test cases for the Read Replica Router
+"""
+from unittest import TestCase
+from unittest.mock import patch
+
+from service import app
+from service.common import status
+from service.common.replicas import LAST_WRITE_COOKIE, LAST_WRITE_HEADER, ReplicaRouter
+from service.models import Customer, db
+from service.routes import negative_cache
+from tests.factories import CustomerFactory
+
+
+######################################################################
+#  R E P L I C A   R O U T E R   T E S T   C A S E S
+######################################################################
+class TestReplicaRouter(TestCase):
+    """Test Cases for the ReplicaRouter"""
+
+    def setUp(self):
+        self.router = ReplicaRouter(["sqlite://", "sqlite://"], sticky_seconds=60)
+
+    def tearDown(self):
+        self.router.dispose()
+
+    def test_round_robin(self):
+        """It should alternate between the replicas"""
+        first = self.router.choose()
+        second = self.router.choose()
+        self.assertIsNot(first, second)
+        self.assertIs(self.router.choose(), first)
+
+    def test_skips_unhealthy_replicas(self):
+        """It should not route to a replica that is down"""
+        down = self.router.engines[0]
+        self.router.mark_down(down)
+        for _ in range(4):
+            self.assertIs(self.router.choose(), self.router.engines[1])
+        self.router.mark_down(self.router.engines[1])
+        self.assertIsNone(self.router.choose())
+        self.assertFalse(self.router.status()[0]["healthy"])
+
+    def test_retry_after_interval(self):
+        """It should put a replica back in rotation after the retry interval"""
+        router = ReplicaRouter(["sqlite://"], retry_seconds=0)
+        router.mark_down(router.engines[0])
+        self.assertIs(router.choose(), router.engines[0])
+        router.dispose()
+
+    def test_read_your_writes(self):
+        """It should keep a client sticky after it writes"""
+        self.assertFalse(self.router.is_sticky("client-1"))
+        self.router.note_write("client-1")
+        self.assertTrue(self.router.is_sticky("client-1"))
+        self.assertFalse(self.router.is_sticky("client-2"))
+
+
+class TestLastWrite(TestCase):
+    """Test Cases for the last-write tokens shared between workers"""
+
+    def setUp(self):
+        self.router = ReplicaRouter(["sqlite://"], sticky_seconds=60, secret="s3cr3t")
+
+    def tearDown(self):
+        self.router.dispose()
+        db.session.remove()
+
+    def test_token_from_another_worker(self):
+        """It should keep a client sticky when it sends back the token of another worker"""
+        token = self.router.last_write_token()
+        other = ReplicaRouter(["sqlite://"], sticky_seconds=60, secret="s3cr3t")
+        with app.test_request_context(headers={LAST_WRITE_HEADER: token}):
+            self.assertTrue(other.is_sticky("client-1"))
+        with app.test_request_context(headers={"Cookie": f"{LAST_WRITE_COOKIE}={token}"}):
+            self.assertTrue(other.is_sticky("client-1"))
+        with app.test_request_context(headers={LAST_WRITE_HEADER: token + "x"}):
+            self.assertFalse(other.is_sticky("client-1"))
+        other.sticky_seconds = -1
+        with app.test_request_context(headers={LAST_WRITE_HEADER: token}):
+            self.assertFalse(other.is_sticky("client-1"))
+        other.dispose()
+
+    def test_write_sends_token(self):
+        """It should send the token to a client that wrote"""
+        client = app.test_client()
+        with patch.dict(app.extensions, {"replica_router": self.router}):
+            response = client.post("/api/customers", json=CustomerFactory().serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertIn(f"{LAST_WRITE_COOKIE}=", response.headers["Set-Cookie"])
+            with app.test_request_context(headers={LAST_WRITE_HEADER: response.headers[LAST_WRITE_HEADER]}):
+                self.assertTrue(self.router.wrote_elsewhere())
+            response = client.get("/health/live")
+        self.assertNotIn(LAST_WRITE_HEADER, response.headers)
+
+    def test_replica_miss_not_cached(self):
+        """It should only remember the misses read from the primary"""
+        client = app.test_client()
+        negative_cache.clear()
+        with patch.dict(app.extensions, {"replica_router": self.router}), patch.object(
+            Customer, "find", return_value=None
+        ):
+            response = client.get("/api/customers/987654")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            self.assertFalse(negative_cache.is_missing(987654))
+            self.router.note_write("client-1")
+            response = client.get("/api/customers/987654", headers={"X-Client-ID": "client-1"})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            self.assertTrue(negative_cache.is_missing(987654))
+        negative_cache.clear()
+
+    def test_fresh_token_skips_cached_miss(self):
+        """It should read a client's own create even where its id is cached as missing"""
+        client = app.test_client()
+        customer = CustomerFactory()
+        customer.create()
+        negative_cache.add(customer.id)
+        token = self.router.last_write_token()
+        with patch.dict(app.extensions, {"replica_router": self.router}):
+            response = client.get(f"/api/customers/{customer.id}", headers={LAST_WRITE_HEADER: token})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        negative_cache.clear()
@@ -0,0 +1,137 @@
+"""
+Test cases for the Result Cache
+"""
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from service import app, routes
+from service.common import status
+from service.common.media_types import MSGPACK, decode
+from service.common.result_cache import ResultCache
+from service.models import Customer, db
+from service.routes import data_version, result_cache
+from tests.factories import CustomerFactory
+
+BASE_URL = "/api/customers"
+
+
+######################################################################
+#  R E S U L T   C A C H E   T E S T   C A S E S
+######################################################################
+class TestResultCache(TestCase):
+    """Test Cases for the ResultCache"""
+
+    def test_version(self):
+        """It should only serve a body at the version it was built from"""
+        cache = ResultCache()
+        self.assertIsNone(cache.get("all", 1))
+        cache.put("all", 1, b"[]", "application/json", {"Link": "next"})
+        self.assertEqual(cache.get("all", 1), (b"[]", "application/json", {"Link": "next"}))
+        self.assertIsNone(cache.get("all", 2))
+        self.assertIsNone(cache.get("all", 1))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 3)
+        self.assertEqual(cache.stats()["hit_rate"], 0.25)
+
+    def test_ttl(self):
+        """It should not serve a body older than the ttl"""
+        cache = ResultCache(ttl=0.01)
+        cache.put("all", 1, b"[]", "application/json")
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("all", 1))
+
+    def test_size_limits(self):
+        """It should evict the least recently used bodies past its limits"""
+        cache = ResultCache(max_entries=2, max_bytes=10)
+        cache.put("a", 1, b"aaa", "application/json")
+        cache.put("b", 1, b"bbb", "application/json")
+        cache.get("a", 1)
+        cache.put("c", 1, b"ccc", "application/json")
+        self.assertIsNone(cache.get("b", 1))
+        self.assertIsNotNone(cache.get("a", 1))
+        cache.put("d", 1, b"dddddddd", "application/json")
+        self.assertEqual(cache.stats()["size"], 1)
+        self.assertEqual(cache.stats()["bytes"], 8)
+        self.assertEqual(cache.stats()["evictions"], 3)
+        cache.put("e", 1, b"e" * 11, "application/json")
+        self.assertIsNone(cache.get("e", 1))
+
+
+class TestResultCacheRoutes(TestCase):
+    """Test Cases for the listings served from the result cache"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        result_cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+
+    def test_repeated_listing(self):
+        """It should answer a repeated listing without running the query"""
+        self.client.post(BASE_URL, json=CustomerFactory(active=True).serialize())
+        first = self.client.get(BASE_URL, query_string={"active": "true"})
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        with patch.object(Customer, "rows") as rows:
+            again = self.client.get(BASE_URL, query_string={"active": "true"})
+        rows.assert_not_called()
+        self.assertEqual(again.status_code, status.HTTP_200_OK)
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(again.mimetype, "application/json")
+
+    def test_write_invalidates(self):
+        """It should run the listing again after a write"""
+        self.client.post(BASE_URL, json=CustomerFactory(active=True).serialize())
+        before = self.client.get(BASE_URL).get_json()
+        created = self.client.post(BASE_URL, json=CustomerFactory().serialize()).get_json()
+        after = self.client.get(BASE_URL).get_json()
+        self.assertEqual(len(after), len(before) + 1)
+        self.client.delete(f"{BASE_URL}/{created['id']}")
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), len(before))
+
+    def test_version_follows_every_write(self):
+        """It should change the version with every committed write, in commit order"""
+        with app.app_context():
+            version = data_version()
+            customer = CustomerFactory()
+            customer.create()
+            self.assertGreater(data_version(), version)
+            version = data_version()
+            customer.deactivate()
+            customer.update("deactivate")
+            self.assertGreater(data_version(), version)
+            version = data_version()
+            db.session.rollback()
+            self.assertEqual(data_version(), version)
+
+    def test_media_types_are_cached_apart(self):
+        """It should keep one body per media type"""
+        self.client.post(BASE_URL, json=CustomerFactory().serialize())
+        as_json = self.client.get(BASE_URL)
+        as_msgpack = self.client.get(BASE_URL, headers={"Accept": MSGPACK})
+        self.assertEqual(as_msgpack.mimetype, MSGPACK)
+        self.assertEqual(decode(as_msgpack.data, MSGPACK), as_json.get_json())
+        self.assertEqual(self.client.get(BASE_URL, headers={"Accept": MSGPACK}).data, as_msgpack.data)
+
+    def test_search_is_cached(self):
+        """It should cache searches by their normalized words and page"""
+        customer = CustomerFactory(f_name="Quintessa")
+        self.client.post(BASE_URL, json=customer.serialize())
+        first = self.client.get(f"{BASE_URL}/search", query_string={"q": "quint"})
+        with patch.object(Customer, "search") as search:
+            again = self.client.get(f"{BASE_URL}/search", query_string={"q": "  QUINT "})
+        search.assert_not_called()
+        self.assertEqual(again.get_json(), first.get_json())
+        self.assertGreater(result_cache.stats()["hits"], 0)
+
+    def test_disabled(self):
+        """It should run every listing when the cache is disabled"""
+        with patch.dict(app.config, {"RESULT_CACHE_ENABLED": False}):
+            self.client.get(BASE_URL)
+            self.client.get(BASE_URL)
+            with patch.object(routes, "read_or_stale", return_value=([], {"Age": "3"})):
+                response = self.client.get(BASE_URL)
+        self.assertEqual(result_cache.stats()["size"], 0)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Age"], "3")
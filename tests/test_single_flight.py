@@ -0,0 +1,101 @@
+"""
+Test cases for the Single Flight request coalescer
+"""
+import threading
+import time
+from unittest import TestCase
+
+from service.common.deadlines import DeadlineExceeded
+from service.common.single_flight import SingleFlight
+
+
+######################################################################
+#  S I N G L E   F L I G H T   T E S T   C A S E S
+######################################################################
+class TestSingleFlight(TestCase):
+    """Test Cases for SingleFlight"""
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def _slow_call(self):
+        """A call that blocks until it is released"""
+        self.calls += 1
+        self.release.wait(5)
+        return {"id": 1}
+
+    def test_single_call(self):
+        """It should run an uncontended call and not share it"""
+        self.release.set()
+        self.assertEqual(self.flight.do("key", self._slow_call), ({"id": 1}, False))
+        self.assertEqual(self.flight.in_flight(), 0)
+
+    def test_coalesce_concurrent_calls(self):
+        """It should run concurrent calls with the same key once"""
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.flight.do("key", self._slow_call)))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        # give every thread time to join the flight before it lands
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 9)
+        self.assertTrue(all(result is results[0][0] for result, _ in results))
+
+    def test_different_keys(self):
+        """It should not share calls with different keys"""
+        self.release.set()
+        self.flight.do("one", self._slow_call)
+        self.flight.do("two", self._slow_call)
+        self.assertEqual(self.calls, 2)
+
+    def test_shared_error(self):
+        """It should raise the error of the call for every caller"""
+        def fail():
+            raise ValueError("boom")
+
+        self.assertRaises(ValueError, self.flight.do, "key", fail)
+        self.assertEqual(self.flight.in_flight(), 0)
+
+    def test_waiter_deadline(self):
+        """It should stop waiting for another caller's call at the waiter's own deadline"""
+        leader = threading.Thread(target=self.flight.do, args=("key", self._slow_call))
+        leader.start()
+        time.sleep(0.1)
+        self.assertRaises(DeadlineExceeded, self.flight.do, "key", self._slow_call, timeout=0.1)
+        self.release.set()
+        leader.join()
+        self.assertEqual(self.calls, 1)
+
+    def test_retry_leader_deadline(self):
+        """It should run the call again when the call it waited for ran out of time"""
+        def timed_out():
+            self.release.wait(5)
+            raise DeadlineExceeded("leader ran out of time")
+
+        leader = threading.Thread(target=self.assertRaises, args=(DeadlineExceeded, self.flight.do, "key", timed_out))
+        results = []
+        waiter = threading.Thread(
+            target=lambda: results.append(
+                self.flight.do("key", self._slow_call, timeout=5, retry_on=(DeadlineExceeded,))
+            )
+        )
+        leader.start()
+        time.sleep(0.1)
+        waiter.start()
+        # let the waiter join the flight before the leader fails
+        time.sleep(0.1)
+        self.release.set()
+        leader.join()
+        waiter.join()
+        self.assertEqual(results, [({"id": 1}, False)])
+        self.assertEqual(self.calls, 1)
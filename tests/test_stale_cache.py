@@ -0,0 +1,50 @@
+"""
+Test cases for the Stale Cache
+"""
+from unittest import TestCase
+
+from service.common.stale_cache import StaleCache
+
+
+######################################################################
+#  S T A L E   C A C H E   T E S T   C A S E S
+######################################################################
+class TestStaleCache(TestCase):
+    """Test Cases for the StaleCache"""
+
+    def test_put_and_get(self):
+        """It should return the last value of a key and its age"""
+        cache = StaleCache()
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", [{"id": 1}])
+        cache.put("a", [{"id": 2}])
+        value, age = cache.get("a")
+        self.assertEqual(value, [{"id": 2}])
+        self.assertGreaterEqual(age, 0.0)
+        cache.discard("a")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+    def test_max_size(self):
+        """It should forget the least recently used values above the maximum size"""
+        cache = StaleCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a")[0], 1)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_max_bytes(self):
+        """It should keep the encoded values under the maximum bytes"""
+        cache = StaleCache(max_bytes=100)
+        cache.put("a", "x" * 40)
+        cache.put("b", "y" * 40)
+        cache.put("c", "z" * 40)
+        self.assertIsNone(cache.get("a"))
+        self.assertLessEqual(cache.stats()["bytes"], 100)
+        # a value larger than the cache is not kept and replaces the old one
+        cache.put("b", "y" * 200)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["size"], 1)
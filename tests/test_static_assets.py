@@ -0,0 +1,55 @@
+"""
+Test cases for the Static Assets
+"""
+import gzip
+from unittest import TestCase
+from unittest.mock import patch
+
+from service import api, app
+from service.common import status
+from service.common.static_assets import Asset
+
+
+######################################################################
+#  S T A T I C   A S S E T S   T E S T   C A S E S
+######################################################################
+class TestStaticAssets(TestCase):
+    """Test Cases for the Static Assets"""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_spec_is_built_once(self):
+        """It should render the OpenAPI spec once and serve it with an ETag"""
+        with patch("service.common.static_assets.Asset", wraps=Asset) as built:
+            response = self.client.get("/api/swagger.json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(built.call_count, 1)
+            response = self.client.get("/api/swagger.json")
+            self.assertLessEqual(built.call_count, 1)
+        self.assertEqual(response.get_json()["info"]["title"], api.title)
+        self.assertIn("max-age", response.headers["Cache-Control"])
+        etag = response.headers["ETag"]
+        response = self.client.get("/api/swagger.json", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_precompressed_index(self):
+        """It should serve the index page compressed when the client accepts it"""
+        plain = self.client.get("/")
+        self.assertEqual(plain.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        response = self.client.get("/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+        self.assertNotEqual(response.headers["ETag"], plain.headers["ETag"])
+
+    def test_static_files(self):
+        """It should serve the static files and nothing outside of the folder"""
+        response = self.client.get("/static/js/rest_api.js")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("javascript", response.headers["Content-Type"])
+        response = self.client.get("/static/../config.py")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get("/static/nothing.js")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,90 @@
+"""
+Test cases for the Warm-up
+"""
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool, QueuePool
+
+from service import app, health_routes, routes
+from service.common import status
+from service.common.db_pool import preconnect
+from service.common.warmup import Warmup
+from service.models import Customer, db
+from tests.factories import CustomerFactory
+
+
+######################################################################
+#  W A R M - U P   T E S T   C A S E S
+######################################################################
+class TestWarmup(TestCase):
+    """Test Cases for the Warm-up"""
+
+    def tearDown(self):
+        db.session.remove()
+
+    def test_run_steps(self):
+        """It should run every step and be ready even if one fails"""
+
+        def fail():
+            raise RuntimeError("no database")
+
+        warmup = Warmup()
+        self.assertFalse(warmup.ready)
+        warmup.start(app, [("fail", fail), ("count", lambda: 3)])
+        self.assertTrue(warmup.wait(5))
+        status_ = warmup.status()
+        self.assertEqual(status_["state"], "done")
+        self.assertEqual(status_["steps"]["fail"]["error"], "no database")
+        self.assertEqual(status_["steps"]["count"]["result"], 3)
+
+    def test_not_ready_until_warm(self):
+        """It should report not ready until the warm-up is done"""
+        client = app.test_client()
+        warmup = Warmup()
+        with patch.dict(app.extensions, {"warmup": warmup}):
+            health_routes.readiness.invalidate()
+            response = client.get("/health/ready")
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertFalse(response.get_json()["checks"]["warmup"]["ok"])
+            warmup.run(app, [])
+            health_routes.readiness.invalidate()
+            self.assertEqual(client.get("/health/ready").status_code, status.HTTP_200_OK)
+
+    def test_preconnect(self):
+        """It should open the pool connections up front"""
+        engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=3)
+        self.assertEqual(preconnect(engine, 5), 3)
+        self.assertEqual(engine.pool.checkedin(), 3)
+        self.assertEqual(preconnect(create_engine("sqlite://", poolclass=NullPool), 5), 0)
+
+    def test_warm_statements(self):
+        """It should leave the SQL of the hot queries compiled"""
+        with app.app_context():
+            db.engine._compiled_cache.clear()  # pylint: disable=protected-access
+            Customer.warm_statements()
+            warm = len(db.engine._compiled_cache)  # pylint: disable=protected-access
+            Customer.find(1)
+            Customer.find_by_name("John", "Smith").all()
+            Customer.find_by_activity(False).all()
+            Customer.rows(True)
+            self.assertEqual(len(db.engine._compiled_cache), warm)  # pylint: disable=protected-access
+
+    def test_prime_caches(self):
+        """It should load the most recently written customers into the caches"""
+        customers = [CustomerFactory() for _ in range(3)]
+        for customer in customers:
+            customer.create()
+        customers[0].update()
+        ids = [customer.id for customer in customers]
+        self.assertEqual(Customer.hottest_ids(2), [ids[0], ids[2]])
+
+        routes.stale_cache.clear()
+        with patch.dict(app.config, {"WARMUP_PRIME_IDS": 2}):
+            steps = dict(routes.warmup_steps())
+            warmup = Warmup()
+            warmup.run(app, [("prime", steps["prime"])])
+        self.assertEqual(warmup.status()["steps"]["prime"]["result"], 2)
+        self.assertEqual(routes.stale_cache.get(("customer", ids[0]))[0]["id"], ids[0])
+        self.assertIsNone(routes.stale_cache.get(("customer", ids[1])))